@@ -0,0 +1,236 @@
+import base64
+
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.loading import get_model
+from django.middleware.csrf import get_token
+
+from api_boilerplate import usage
+from api_boilerplate.cache import AUTH_CACHE, BASIC_AUTH_CACHE, api_key_cache, basic_auth_cache
+from api_boilerplate.exceptions import ApiUnauthorizedException
+from api_boilerplate.models import split_key
+from api_boilerplate.tokens import TokenUser, verify_token
+from api_boilerplate.utils import import_by_path
+
+### Settings
+
+AUTH_CASE_INSENSITIVE = getattr(settings, 'API_AUTH_CASE_INSENSITIVE', False)
+
+AUTH_EMAIL_AS_USERNAME = getattr(settings, 'API_AUTH_EMAIL_AS_USERNAME', False)
+
+AUTHENTICATORS = getattr(settings, 'API_AUTHENTICATORS', (
+    'api_boilerplate.authentication.TokenAuthenticator',
+    'api_boilerplate.authentication.ApiKeyAuthenticator',
+    'api_boilerplate.authentication.BasicAuthenticator',
+    'api_boilerplate.authentication.SessionAuthenticator',
+))
+
+# Paths handled by the API middlewares, e.g. ('/api/',). None for all paths.
+URL_PREFIXES = getattr(settings, 'API_URL_PREFIXES', None)
+
+API_KEY_MODEL = getattr(settings, 'API_KEY_MODEL',
+    'api_boilerplate.models.ApiKey')
+# Both 'app_label.Model' and 'app_label.models.Model' are accepted
+ApiKey = get_model(API_KEY_MODEL.split('.')[0], API_KEY_MODEL.split('.')[-1])
+
+# Orders username matches before email matches
+USERNAME_MATCH_SQL = ('CASE WHEN UPPER(%s.%s) = UPPER(%%s) THEN 0 ELSE 1 END' if AUTH_CASE_INSENSITIVE
+    else 'CASE WHEN %s.%s = %%s THEN 0 ELSE 1 END') % (
+    connection.ops.quote_name(User._meta.db_table), connection.ops.quote_name('username'))
+
+### Helper functions
+
+def _get_user(username):
+    """
+    Looks up an user by username, or by email with ``API_AUTH_EMAIL_AS_USERNAME``,
+    in a single query.
+
+    Username matches win over email matches, remaining ties (e.g. case
+    variants with ``API_AUTH_CASE_INSENSITIVE``) go to the oldest user. See
+    ``create_api_auth_indexes`` command for indexes that make the lookups fast.
+    """
+    lookup = 'iexact' if AUTH_CASE_INSENSITIVE else 'exact'
+    match = Q(**{'username__%s' % lookup: username})
+
+    if AUTH_EMAIL_AS_USERNAME:
+        match |= Q(**{'email__%s' % lookup: username})
+        users = User.objects.filter(match).extra(
+            select={'username_match': USERNAME_MATCH_SQL},
+            select_params=(username,),
+        ).order_by('username_match', 'pk')
+    else:
+        users = User.objects.filter(match).order_by('pk')
+
+    users = list(users[:1])
+    return users[0] if users else None
+
+def _username_matches(user, username):
+    names = [user.username]
+    if AUTH_EMAIL_AS_USERNAME:
+        names.append(user.email)
+    if AUTH_CASE_INSENSITIVE:
+        return username.upper() in [name.upper() for name in names]
+    return username in names
+
+def _get_api_key(username, raw_key):
+    """
+    Returns the ``ApiKey``, with its user, matching ``raw_key`` and
+    ``username``, or ``None``.
+
+    Looks the key up by its short prefix in a single query and checks the
+    secret's hash in constant time. Keys not yet converted by
+    ``hash_api_keys`` are looked up by the full key.
+    """
+    prefix, secret = split_key(raw_key)
+    if not (prefix and secret):
+        return None
+
+    keys = list(ApiKey.objects.filter(prefix=prefix).select_related('user'))
+    if not keys and '.' not in raw_key:
+        keys = list(ApiKey.objects.filter(key=raw_key).select_related('user'))
+
+    for api_key in keys:
+        if api_key.check_key(raw_key) and _username_matches(api_key.user, username):
+            return api_key
+    return None
+
+_url_prefixes = tuple(URL_PREFIXES) if URL_PREFIXES is not None else None
+
+def is_api_request(request):
+    """
+    Returns whether the request is under ``API_URL_PREFIXES``.
+    """
+    return _url_prefixes is None or request.path_info.startswith(_url_prefixes)
+
+### Authenticators
+
+class TokenAuthenticator(object):
+    """
+    Signed bearer tokens, ``Authorization: Bearer <token>``, see ``tokens``.
+
+    Checked without queries. The user is loaded when a view uses more
+    than its ``pk``. Sets ``request.auth_token`` to the token payload and
+    ``request.auth_scopes`` to the scopes it grants (``None`` for
+    unrestricted tokens).
+    """
+    def authenticate(self, request):
+        authorization = request.META.get('HTTP_AUTHORIZATION')
+        if not authorization or authorization.split(' ', 1)[0] != 'Bearer':
+            return None
+
+        token = authorization.split(' ', 1)[1].strip() if ' ' in authorization else ''
+        if not token:
+            raise ApiUnauthorizedException('Missing token.')
+        payload = verify_token(token)
+        if 'kid' in payload:
+            # Keys only exchanged for tokens are in use too
+            usage.record_id(payload['kid'])
+        request.auth_token = payload
+        request.auth_scopes = frozenset(payload['scp']) if payload['scp'] is not None else None
+        return TokenUser(payload['uid'])
+
+class ApiKeyAuthenticator(object):
+    """
+    Username and API key in the ``X-<SITE_NAME>-Username`` and
+    ``X-<SITE_NAME>-API-Token`` headers.
+
+    Sets ``request.api_key`` to the key used and ``request.auth_scopes`` to
+    its scopes (``None`` for unrestricted keys).
+
+    Partly forked form django-tastypie
+    """
+    def __init__(self):
+        self.username_header = 'HTTP_X_%s_USERNAME' % settings.SITE_NAME.upper()
+        self.api_key_header = 'HTTP_X_%s_API_TOKEN' % settings.SITE_NAME.upper()
+
+    def authenticate(self, request):
+        username = request.META.get(self.username_header)
+        api_key = request.META.get(self.api_key_header)
+        if not (username and api_key):
+            return None
+
+        key = api_key_cache.get(username, api_key) if AUTH_CACHE else None
+        if key == None:
+            key = _get_api_key(username, api_key)
+            if key == None:
+                raise ApiUnauthorizedException('Can\'t find an user with this username and api_key')
+
+            if AUTH_CACHE:
+                api_key_cache.set(username, api_key, key)
+
+        if key.is_expired():
+            raise ApiUnauthorizedException('API key has expired')
+        usage.record(key)
+        request.api_key = key
+        request.auth_scopes = key.get_scopes()
+        return key.user
+
+class BasicAuthenticator(object):
+    """
+    HTTP Basic auth with username (or email) and password.
+
+    Partly forked from django-tastypie
+    """
+    def authenticate(self, request):
+        authorization = request.META.get('HTTP_AUTHORIZATION')
+        if not authorization or authorization.split(' ', 1)[0] != 'Basic':
+            return None
+
+        try:
+            (auth_type, data) = authorization.split()
+            user_pass = base64.b64decode(data)
+        except:
+            raise ApiUnauthorizedException('Error with HTTP Basic Auth')
+
+        bits = user_pass.split(':', 1)
+
+        if len(bits) != 2:
+            raise ApiUnauthorizedException('Invalid Authorization header. Value should be "Basic QWxhZGRpbjpvcGVuIHNlc2FtZQ==" where base64 encoded part is encrypted from "username:password"')
+
+        # Get user by username or email
+        username = bits[0]
+        user = _get_user(username)
+        if user == None:
+            raise ApiUnauthorizedException('User and password don\'t match')
+
+        if BASIC_AUTH_CACHE and basic_auth_cache.check(user, username, bits[1]):
+            # Verified recently, skip the slow password hasher
+            return user
+        if user.check_password(bits[1]):
+            if BASIC_AUTH_CACHE:
+                basic_auth_cache.set(user, username, bits[1])
+            return user
+        raise ApiUnauthorizedException('Username and password don\'t match')
+
+class SessionAuthenticator(object):
+    """
+    Django session auth
+
+    Authenticates logged in users. Handy for quick debugging or extensions.
+
+    Note: Only allows CSRF safe methods. See Django's CSRF AJAX documentation for including tokens to requests:
+
+        https://docs.djangoproject.com/en/dev/ref/contrib/csrf/#ajax
+
+    """
+    def authenticate(self, request):
+        # The session is loaded here, only when no other authenticator
+        # claimed the request
+        if request.user.is_authenticated():
+            # Always set CSRF token (not set by default unless templatetag or ensure_csrf_cookie decorator is used)
+            get_token(request)
+            return request.user
+        return None
+
+_authenticators = None
+
+def get_authenticators():
+    """
+    Returns instances of the ``API_AUTHENTICATORS``, in order.
+    """
+    global _authenticators
+    if _authenticators is None:
+        _authenticators = [import_by_path(path)() for path in AUTHENTICATORS]
+    return _authenticators
@@ -0,0 +1,271 @@
+import copy
+import json
+import logging
+import time
+from io import BytesIO
+try:
+    from urllib.parse import unquote
+except ImportError:
+    from urllib import unquote
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.urlresolvers import Resolver404, resolve
+from django.http import Http404
+from django.utils import six
+from django.utils.encoding import force_bytes, force_str
+from django.utils.functional import LazyObject, empty
+
+from api_boilerplate import parsers
+from api_boilerplate.authentication import is_api_request
+from api_boilerplate.concurrency import get_pool
+from api_boilerplate.encoders import dumps
+from api_boilerplate.exceptions import ApiBadRequestException, ApiTimeoutException
+from api_boilerplate.http import ApiView, JSONResponse, JSONResponseBadRequest
+from api_boilerplate.tokens import TokenUser
+
+logger = logging.getLogger('django.request')
+
+### Settings
+
+BATCH_MAX_REQUESTS = getattr(settings, 'API_BATCH_MAX_REQUESTS', 20)
+
+BATCH_TIMEOUT = getattr(settings, 'API_BATCH_TIMEOUT', 10)
+
+# Pool threads one batch runs calls on at most
+BATCH_MAX_WORKERS = getattr(settings, 'API_BATCH_MAX_WORKERS', 4)
+
+BATCH_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+# Set on the batch request by authentication and passed on to sub-requests
+AUTH_ATTRIBUTES = ('user', 'session', 'auth_token', 'auth_scopes', 'api_key')
+
+# Mutable ones, copied for each sub-request as they run on several threads
+COPIED_ATTRIBUTES = ('user', 'session', 'api_key')
+
+# Request headers that describe the batch body, not the sub-request's
+BODY_HEADERS = ('CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_CONTENT_ENCODING', 'HTTP_CONTENT_MD5',
+    'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE')
+
+### Helper functions
+
+def _result(status, body, headers=None):
+    return {'status': status, 'headers': headers or {}, 'body': body}
+
+def _error(status, message):
+    return _result(status, {'message': message}, {'Content-Type': 'application/json'})
+
+def _path_info(path):
+    path = unquote(force_str(path))
+    # WSGI requires latin-1 encoded strings
+    if six.PY3:
+        path = path.encode('utf-8').decode('iso-8859-1')
+    return path
+
+def _copy(value):
+    """
+    Returns a copy of ``value`` for a sub-request. Token users stay lazy,
+    other lazy objects (e.g. the session user) are copied loaded.
+    """
+    if isinstance(value, TokenUser):
+        return TokenUser(value.pk)
+    if isinstance(value, LazyObject):
+        if value._wrapped is empty:
+            value._setup()
+        value = value._wrapped
+    if isinstance(value, SessionBase):
+        return copy.deepcopy(value)
+    return copy.copy(value)
+
+def _build_request(request, item):
+    """
+    Returns a request for ``item`` carrying the batch request's headers
+    and credentials.
+    """
+    path, _, query_string = item['path'].partition('?')
+    method = item.get('method', 'GET').upper()
+    data = item.get('body') if method not in parsers.BODYLESS_METHODS else None
+    body = force_bytes(dumps(data)) if data is not None else b''
+
+    environ = dict((key, value) for key, value in request.META.items() if key not in BODY_HEADERS)
+    environ.update({
+        'REQUEST_METHOD': force_str(method),
+        'PATH_INFO': _path_info(path),
+        'QUERY_STRING': force_str(query_string),
+        # Bodies are embedded in the batch response as JSON
+        'HTTP_ACCEPT': 'application/json',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+    })
+    sub_request = WSGIRequest(environ)
+    for name in AUTH_ATTRIBUTES:
+        if hasattr(request, name):
+            value = getattr(request, name)
+            setattr(sub_request, name, _copy(value) if name in COPIED_ATTRIBUTES else value)
+    sub_request.data = data
+    sub_request.batch = request
+    sub_request.rate_limiter = getattr(request, 'rate_limiter', None)
+    sub_request.rate_limited = None
+    return sub_request
+
+def _serialize_response(request, response):
+    if request.method == 'HEAD':
+        content = b''
+    elif response.streaming:
+        content = b''.join(response.streaming_content)
+    else:
+        content = response.content
+    response.close()
+
+    headers = dict(response.items())
+    body = None
+    if content:
+        content = content.decode(response._charset)
+        content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+        body = content
+        if parsers.is_json(content_type):
+            try:
+                body = json.loads(content)
+            except ValueError:
+                pass
+    return _result(response.status_code, body, headers)
+
+def _dispatch(request):
+    """
+    Runs a sub-request through the URL resolver and its view, and returns
+    the result. Errors become results too, so one failing call doesn't
+    fail the batch.
+    """
+    try:
+        response = request.rate_limited
+        if response is None:
+            if not is_api_request(request):
+                raise Http404
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+            response = match.func(request, *match.args, **match.kwargs)
+        if request.rate_limiter is not None:
+            response = request.rate_limiter.process_response(request, response)
+        return _serialize_response(request, response)
+    except (Resolver404, Http404):
+        return _error(404, 'Not found.')
+    except PermissionDenied:
+        return _error(403, 'Forbidden.')
+    except ApiBadRequestException as e:
+        return _error(400, str(e))
+    except Exception:
+        logger.exception('Internal Server Error in batch: %s', request.path,
+            extra={
+                'status_code': 500,
+                'request': request
+            }
+        )
+        return _error(500, 'Internal server error.')
+
+def _run(request, deadline):
+    if time.time() >= deadline:
+        return _error(504, 'Batch timed out.')
+    return _dispatch(request)
+
+def _validate(items, max_requests):
+    """
+    Returns an error message for invalid batches, ``None`` otherwise.
+    """
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return 'Expected a list of requests.'
+    if len(items) > max_requests:
+        return 'Too many requests, up to %d are allowed per batch.' % max_requests
+    for index, item in enumerate(items):
+        path = item.get('path')
+        if not isinstance(path, six.string_types) or not path.startswith('/'):
+            return 'Request %d: path should be an absolute path.' % index
+        method = item.get('method', 'GET')
+        if not isinstance(method, six.string_types) or method.upper() not in BATCH_METHODS:
+            return 'Request %d: method should be one of %s.' % (index, ', '.join(BATCH_METHODS))
+    return None
+
+### Views
+
+class ApiBatchView(ApiView):
+    """
+    Batch view
+
+    ``POST`` runs several API calls in one round trip:
+
+        [
+            {"method": "GET", "path": "/api/account/"},
+            {"method": "GET", "path": "/api/users/?limit=5"},
+            {"method": "POST", "path": "/api/echo/", "body": {"message": "hi"}}
+        ]
+
+    The batch is authenticated once and each call runs with the same
+    credentials, straight through the URL resolver to its view. The
+    response lists ``{"status": ..., "headers": {...}, "body": ...}`` per
+    call, in request order.
+
+    Consecutive ``GET`` and ``HEAD`` calls run concurrently on up to
+    ``max_workers`` threads of the ``concurrency`` pool, and on the request
+    thread when the pool is busy. Other methods run one at a time in order
+    on the request thread. Pool threads have their own database
+    connections and wouldn't see uncommitted writes (e.g. with
+    ``TransactionMiddleware``), so reads after a write run on the request
+    thread too. Calls that don't finish within ``timeout`` seconds of the
+    batch's start get a ``504``.
+
+    With ``ApiRateLimitMiddleware`` every call counts against the limit,
+    and calls over it get a ``429``.
+    """
+    max_requests = None
+    max_workers = None
+    timeout = None
+
+    def post(self, request, *args, **kwargs):
+        if getattr(request, 'batch', None) is not None:
+            return JSONResponseBadRequest(request, 'Batches can\'t be nested.')
+
+        items = request.data
+        error = _validate(items, self.max_requests or BATCH_MAX_REQUESTS)
+        if error is not None:
+            return JSONResponseBadRequest(request, error)
+
+        deadline = time.time() + (self.timeout or BATCH_TIMEOUT)
+        sub_requests = [_build_request(request, item) for item in items]
+        for sub_request in sub_requests:
+            if sub_request.rate_limiter is not None:
+                sub_request.rate_limited = sub_request.rate_limiter.check(sub_request)
+        results = []
+        reads = []
+        written = False
+        for sub_request in sub_requests:
+            if sub_request.method in ('GET', 'HEAD'):
+                reads.append(sub_request)
+                continue
+            results.extend(self.run_reads(reads, deadline, written))
+            reads = []
+            results.append(_run(sub_request, deadline))
+            written = True
+        results.extend(self.run_reads(reads, deadline, written))
+        return JSONResponse(request, results)
+
+    def run_reads(self, sub_requests, deadline, serial=False):
+        workers = min(len(sub_requests), self.max_workers or BATCH_MAX_WORKERS)
+        if serial or workers < 2:
+            return [_run(sub_request, deadline) for sub_request in sub_requests]
+
+        # Each thread runs every workers-th call, this one included
+        groups = [sub_requests[start::workers] for start in range(workers)]
+        pool = get_pool()
+        tasks = [None] + [pool.submit(lambda group=group: [_run(sub_request, deadline) for sub_request in group], backlog=False)
+            for group in groups[1:]]
+        grouped = []
+        for group, task in zip(groups, tasks):
+            if task is None:
+                grouped.append([_run(sub_request, deadline) for sub_request in group])
+                continue
+            try:
+                grouped.append(task.get(deadline))
+            except ApiTimeoutException:
+                grouped.append([_error(504, 'Batch timed out.') for sub_request in group])
+        return [grouped[index % workers][index // workers] for index in range(len(sub_requests))]
@@ -0,0 +1,273 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connections, router, transaction
+
+from api_boilerplate import parsers
+from api_boilerplate.cache import AUTH_CACHE
+from api_boilerplate.decorators import invalidate_api_cache
+from api_boilerplate.http import JSONResponse, JSONResponseBadRequest, JSONResponseMultiStatus
+from api_boilerplate.models import invalidate_auth_cache
+
+### Settings
+
+BULK_BATCH_SIZE = getattr(settings, 'API_BULK_BATCH_SIZE', 500)
+
+BULK_MAX_ITEMS = getattr(settings, 'API_BULK_MAX_ITEMS', 10000)
+
+# ``atomic`` replaced ``commit_on_success`` in Django 1.6
+atomic = getattr(transaction, 'atomic', None) or transaction.commit_on_success
+
+### Helper functions
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _error(index, status, errors):
+    return {'index': index, 'status': status, 'errors': errors}
+
+### Views
+
+class ApiBulkView(object):
+    """
+    Mixin for ``ApiView`` creating (``POST``) and updating (``PATCH``) many
+    ``model`` objects in one request.
+
+        class UsersBulkView(ApiBulkView, ApiView):
+            model = User
+            fields = ('username', 'email', 'first_name', 'last_name')
+
+    The body is a JSON array or NDJSON, parsed incrementally while reading.
+    Items are validated one by one and
+    then as a batch, written in chunks of ``batch_size`` with
+    ``bulk_create`` and ``bulk_update`` (``save(update_fields=...)`` on
+    Django versions without it) in a single transaction. Invalid items don't
+    stop the valid ones from being written: the response lists a result per
+    item, in request order, with ``207 Multi-Status`` when some failed.
+
+    Updated items must carry the primary key in ``id``. Created items
+    report their ``id`` when the database backend returns it.
+
+    ``bulk_create`` doesn't send ``post_save``, so ``api_cache`` tags that
+    signal handlers would expire are listed in ``cache_tags`` and expired
+    after every write. Cached credentials of written users and API keys
+    are dropped too.
+    """
+    model = None
+    fields = None
+    batch_size = None
+    max_items = None
+    cache_tags = ()
+
+    def post(self, request, *args, **kwargs):
+        return self.bulk_create(request)
+
+    def patch(self, request, *args, **kwargs):
+        return self.bulk_update(request)
+
+    def get_fields(self):
+        """
+        Returns the names of the fields items may set.
+        """
+        if self.fields is not None:
+            return self.fields
+        return [field.name for field in self.model._meta.fields if field.editable and not field.primary_key]
+
+    def get_items(self, request):
+        """
+        Returns the items in the request body, or an error response.
+        """
+        max_items = self.max_items or BULK_MAX_ITEMS
+        items = []
+        try:
+            for item in parsers.iter_items(request):
+                if not isinstance(item, dict):
+                    return JSONResponseBadRequest(request, 'Expected a list of objects.')
+                if len(items) == max_items:
+                    return JSONResponseBadRequest(request, 'Too many items, up to %d are allowed per request.' % max_items)
+                items.append(item)
+        except ValueError as e:
+            return JSONResponseBadRequest(request, 'Invalid JSON: %s' % e)
+        return items
+
+    def build_object(self, item, obj=None):
+        """
+        Sets the values of ``item`` on ``obj`` (a new instance by default)
+        and validates it. Raises ``ValidationError``.
+        """
+        fields = self.get_fields()
+        unknown = [name for name in item if name not in fields and name != 'id']
+        if unknown:
+            raise ValidationError(dict((name, ['Unknown field.']) for name in unknown))
+
+        if obj is None:
+            obj = self.model()
+        for name in fields:
+            if name in item:
+                setattr(obj, name, item[name])
+        # Uniqueness is checked for the whole batch at once
+        exclude = [field.name for field in self.model._meta.fields if field.name not in fields]
+        obj.clean_fields(exclude=exclude)
+        obj.clean()
+        return obj
+
+    def validate_batch(self, objects):
+        """
+        Validates ``objects``, a list of ``(index, obj)``, as a whole.
+
+        Returns a dict of errors by index. Checks unique fields against each
+        other and against the database with one query per field.
+        """
+        errors = {}
+        for field in self.model._meta.fields:
+            if not field.unique or field.primary_key or field.name not in self.get_fields():
+                continue
+
+            values = {}
+            for index, obj in objects:
+                value = getattr(obj, field.attname)
+                if value is None:
+                    continue
+                if value in values:
+                    errors.setdefault(index, {})[field.name] = ['Duplicate value in the request.']
+                values.setdefault(value, []).append((index, obj))
+
+            for chunk in _chunks(list(values), self.batch_size or BULK_BATCH_SIZE):
+                taken = self.model._default_manager.filter(**{'%s__in' % field.name: chunk})
+                for pk, value in taken.values_list('pk', field.attname):
+                    for index, obj in values.get(value, ()):
+                        if obj.pk != pk:
+                            errors.setdefault(index, {})[field.name] = ['Already exists.']
+        return errors
+
+    def bulk_create(self, request):
+        items = self.get_items(request)
+        if not isinstance(items, list):
+            return items
+
+        results = [None] * len(items)
+        objects = []
+        for index, item in enumerate(items):
+            try:
+                objects.append((index, self.build_object(item)))
+            except ValidationError as e:
+                results[index] = _error(index, 400, e.update_error_dict({}))
+
+        self._write(objects, results, self._create_chunk, 201)
+        return self._response(request, results)
+
+    def bulk_update(self, request):
+        items = self.get_items(request)
+        if not isinstance(items, list):
+            return items
+
+        # Only write the fields that were sent
+        self.update_fields = [name for name in self.get_fields() if any(name in item for item in items)]
+
+        results = [None] * len(items)
+        pks = {}
+        for index, item in enumerate(items):
+            try:
+                pks[index] = self.model._meta.pk.to_python(item.get('id'))
+            except (ValidationError, TypeError):
+                pks[index] = None
+
+        existing = {}
+        for chunk in _chunks([pk for pk in pks.values() if pk is not None], self.batch_size or BULK_BATCH_SIZE):
+            existing.update(self.model._default_manager.in_bulk(chunk))
+
+        objects = []
+        seen = set()
+        for index, item in enumerate(items):
+            obj = existing.get(pks[index])
+            if obj is None:
+                results[index] = _error(index, 404, {'id': ['Not found.']})
+                continue
+            if obj.pk in seen:
+                results[index] = _error(index, 400, {'id': ['Duplicate value in the request.']})
+                continue
+            seen.add(obj.pk)
+            try:
+                objects.append((index, self.build_object(item, obj)))
+            except ValidationError as e:
+                results[index] = _error(index, 400, e.update_error_dict({}))
+
+        self._write(objects, results, self._update_chunk, 200)
+        return self._response(request, results)
+
+    def get_write_batch_size(self, objects):
+        """
+        Returns how many objects are written per chunk.
+
+        Failed chunks are rolled back to a savepoint and retried one by one.
+        Without savepoints (e.g. SQLite on Django 1.5) a chunk is kept to
+        what ``bulk_create`` inserts in a single statement, so a failed chunk
+        leaves nothing behind.
+        """
+        batch_size = self.batch_size or BULK_BATCH_SIZE
+        connection = connections[router.db_for_write(self.model)]
+        if not connection.features.uses_savepoints and objects:
+            batch_size = min(batch_size, connection.ops.bulk_batch_size(self.model._meta.local_fields, objects))
+        return max(batch_size, 1)
+
+    def _write(self, objects, results, write_chunk, status):
+        errors = self.validate_batch(objects)
+        for index, error in errors.items():
+            results[index] = _error(index, 400, error)
+        objects = [(index, obj) for index, obj in objects if index not in errors]
+
+        with atomic():
+            for chunk in _chunks(objects, self.get_write_batch_size([obj for index, obj in objects])):
+                sid = transaction.savepoint()
+                try:
+                    write_chunk([obj for index, obj in chunk])
+                except DatabaseError:
+                    # Find the offending items one by one
+                    transaction.savepoint_rollback(sid)
+                    self._write_each(chunk, results, write_chunk, status)
+                    continue
+                transaction.savepoint_commit(sid)
+                for index, obj in chunk:
+                    results[index] = {'index': index, 'status': status, 'id': obj.pk}
+
+        if self.cache_tags and objects:
+            invalidate_api_cache(*self.cache_tags)
+        if AUTH_CACHE:
+            for index, obj in objects:
+                invalidate_auth_cache(self.model, obj)
+
+    def _write_each(self, objects, results, write_chunk, status):
+        for index, obj in objects:
+            sid = transaction.savepoint()
+            try:
+                write_chunk([obj])
+            except DatabaseError as e:
+                transaction.savepoint_rollback(sid)
+                results[index] = _error(index, 409, {'__all__': [str(e)]})
+            else:
+                transaction.savepoint_commit(sid)
+                results[index] = {'index': index, 'status': status, 'id': obj.pk}
+
+    def _create_chunk(self, objects):
+        self.model._default_manager.bulk_create(objects)
+
+    def _update_chunk(self, objects):
+        fields = self.update_fields
+        manager = self.model._default_manager
+        if not fields:
+            return
+        if hasattr(manager, 'bulk_update'):
+            manager.bulk_update(objects, fields)
+        else:
+            for obj in objects:
+                obj.save(update_fields=fields)
+
+    def _response(self, request, results):
+        data = {
+            'succeeded': sum(1 for result in results if 'errors' not in result),
+            'failed': sum(1 for result in results if 'errors' in result),
+            'results': results,
+        }
+        if data['failed']:
+            return JSONResponseMultiStatus(request, data)
+        return JSONResponse(request, data)
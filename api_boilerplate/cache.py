@@ -0,0 +1,293 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db import router
+from django.db.models.query_utils import deferred_class_factory
+from django.utils.crypto import constant_time_compare, get_random_string
+from django.utils.encoding import force_bytes
+
+### Settings
+
+AUTH_CACHE = getattr(settings, 'API_AUTH_CACHE', False)
+
+AUTH_CACHE_BACKEND = getattr(settings, 'API_AUTH_CACHE_BACKEND', 'default')
+
+AUTH_CACHE_TIMEOUT = getattr(settings, 'API_AUTH_CACHE_TIMEOUT', 300)
+
+AUTH_CACHE_LOCAL_SIZE = getattr(settings, 'API_AUTH_CACHE_LOCAL_SIZE', 1000)
+
+AUTH_CACHE_LOCAL_TIMEOUT = getattr(settings, 'API_AUTH_CACHE_LOCAL_TIMEOUT', 5)
+
+BASIC_AUTH_CACHE = getattr(settings, 'API_BASIC_AUTH_CACHE', False)
+
+BASIC_AUTH_CACHE_SIZE = getattr(settings, 'API_BASIC_AUTH_CACHE_SIZE', 1000)
+
+BASIC_AUTH_CACHE_TIMEOUT = getattr(settings, 'API_BASIC_AUTH_CACHE_TIMEOUT', 60)
+
+# Fields of users and API keys that aren't cached, loaded when accessed
+SECRET_FIELDS = ('password', 'key', 'key_hash')
+
+### Caches
+
+class LRUCache(object):
+    """
+    Bounded, thread safe in-process cache.
+
+    Evicts the least recently used entry when ``max_size`` is reached and
+    expires entries ``timeout`` seconds after they were set. Keeps ``hits``
+    and ``misses`` counters for monitoring.
+    """
+    def __init__(self, max_size=1000, timeout=60):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires < time.time():
+                self.misses += 1
+                return default
+
+            # Move to the most recently used end
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + timeout, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_matching(self, predicate):
+        """
+        Deletes all entries whose value matches ``predicate(value)``.
+        """
+        with self._lock:
+            for key, (expires, value) in list(self._data.items()):
+                if predicate(value):
+                    del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+class ApiKeyCache(object):
+    """
+    Two tier cache for API key credentials.
+
+    Successful ``(username, api_key)`` lookups are kept in a per process
+    ``LRUCache`` in front of Django's cache backend, so a warm request
+    authenticates without any queries. Entries are keyed by a hash of the
+    credentials and dropped when the ``User`` or its ``ApiKey`` is saved or
+    deleted. Other processes see the change through the shared cache right
+    away, their local tier within ``local_timeout`` seconds.
+
+    Only the field values are cached, without ``SECRET_FIELDS`` such as the
+    password hash. They come back as deferred instances that load those
+    fields on access, and only save the cached ones.
+
+    Shared entries carry the version of their user's credentials, kept in
+    its own cache key. Invalidating a user deletes the version, which
+    retires all their entries at once without tracking them.
+    """
+    prefix = 'api_boilerplate:auth:'
+
+    def __init__(self, cache=None, timeout=None, local_size=None, local_timeout=None):
+        if local_size is None:
+            local_size = AUTH_CACHE_LOCAL_SIZE
+        if local_timeout is None:
+            local_timeout = AUTH_CACHE_LOCAL_TIMEOUT
+
+        self.cache = cache or get_cache(AUTH_CACHE_BACKEND)
+        self.timeout = AUTH_CACHE_TIMEOUT if timeout is None else timeout
+        self.local = LRUCache(local_size, local_timeout) if local_size and local_timeout else None
+
+    def _key(self, username, api_key):
+        digest = hashlib.sha256(force_bytes(username) + b'\0' + force_bytes(api_key)).hexdigest()
+        return '%skey:%s' % (self.prefix, digest)
+
+    def _version_key(self, user_pk):
+        return '%sversion:%s' % (self.prefix, user_pk)
+
+    def _get_version(self, user_pk):
+        """
+        Returns the current version of the user's entries, starting a new
+        one when there is none.
+        """
+        version_key = self._version_key(user_pk)
+        version = self.cache.get(version_key)
+        if version is None:
+            # Another request may have started one meanwhile. A version
+            # that expires only retires the entries early.
+            self.cache.add(version_key, get_random_string(12), self.timeout)
+            version = self.cache.get(version_key)
+        return version
+
+    def get(self, username, api_key):
+        """
+        Returns the cached ``ApiKey``, with its user, for the credentials or
+        ``None``.
+        """
+        key = self._key(username, api_key)
+        if self.local is not None:
+            value = self.local.get(key)
+            if value is not None:
+                # New instances, not shared between concurrent requests
+                return _unpack(value)
+
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        version, value = entry
+        if version is None or version != self.cache.get(self._version_key(_user_id(value))):
+            return None
+        if self.local is not None:
+            self.local.set(key, value)
+        return _unpack(value)
+
+    def set(self, username, api_key, value):
+        key = self._key(username, api_key)
+        packed = _pack(value)
+        self.cache.set(key, (self._get_version(value.user_id), packed), self.timeout)
+
+        if self.local is not None:
+            self.local.set(key, packed)
+
+    def invalidate(self, user_pk):
+        """
+        Drops all cached credentials of a user.
+        """
+        self.cache.delete(self._version_key(user_pk))
+
+        if self.local is not None:
+            self.local.delete_matching(lambda value: _user_id(value) == user_pk)
+
+def _fields(instance):
+    """
+    Returns the model and the values of ``instance``, without secrets.
+    """
+    model = instance._meta.concrete_model
+    return model, dict((field.attname, getattr(instance, field.attname)) for field in model._meta.fields
+        if field.name not in SECRET_FIELDS)
+
+def _instance(model, values):
+    deferred = tuple(field.attname for field in model._meta.fields if field.attname not in values)
+    if deferred:
+        model = _deferred_class(model, deferred)
+    instance = model(**values)
+    instance._state.adding = False
+    instance._state.db = router.db_for_read(model)
+    return instance
+
+_deferred_classes = {}
+
+def _deferred_class(model, attrs):
+    if (model, attrs) not in _deferred_classes:
+        _deferred_classes[model, attrs] = deferred_class_factory(model, attrs)
+    return _deferred_classes[model, attrs]
+
+def _pack(api_key):
+    return _fields(api_key), _fields(api_key.user)
+
+def _user_id(value):
+    return value[0][1]['user_id']
+
+def _unpack(value):
+    (key_model, key_values), (user_model, user_values) = value
+    api_key = _instance(key_model, key_values)
+    api_key.user = _instance(user_model, user_values)
+    return api_key
+
+class BasicAuthCache(object):
+    """
+    Per process cache of verified HTTP Basic credentials.
+
+    Password hashers are slow on purpose, which makes ``check_password`` the
+    most expensive part of a Basic auth request. This keeps a keyed HMAC of
+    each successfully verified ``(username, password)`` pair together with
+    an HMAC of the user's password hash at that time. A repeated request is
+    accepted when the user's current password hash is still the same, so
+    changing the password invalidates the entry in every process.
+
+    Neither plain passwords nor password hashes are stored. ``hits`` and ``misses`` count the
+    verifications that could or couldn't skip the hasher.
+    """
+    def __init__(self, size=None, timeout=None):
+        self.local = LRUCache(
+            BASIC_AUTH_CACHE_SIZE if size is None else size,
+            BASIC_AUTH_CACHE_TIMEOUT if timeout is None else timeout,
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, username, password):
+        secret = force_bytes(settings.SECRET_KEY)
+        return hmac.new(secret, force_bytes(username) + b'\0' + force_bytes(password), hashlib.sha256).digest()
+
+    def _digest(self, user):
+        secret = force_bytes(settings.SECRET_KEY)
+        return hmac.new(secret, force_bytes(user.password), hashlib.sha256).hexdigest()
+
+    def check(self, user, username, password):
+        """
+        Returns ``True`` if the credentials were recently verified against the
+        user's current password.
+        """
+        digest = self.local.get(self._key(username, password))
+        if digest is not None and constant_time_compare(digest, self._digest(user)):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def set(self, user, username, password):
+        """
+        Remembers credentials that were verified with ``check_password``.
+        """
+        self.local.set(self._key(username, password), self._digest(user))
+
+    def stats(self):
+        stats = self.local.stats()
+        lookups = self.hits + self.misses
+        stats.update({
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+        })
+        return stats
+
+api_key_cache = ApiKeyCache()
+
+basic_auth_cache = BasicAuthCache()
@@ -0,0 +1,138 @@
+import re
+import zlib
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+### Settings
+
+COMPRESSION_MIN_SIZE = getattr(settings, 'API_COMPRESSION_MIN_SIZE', 1024)
+
+COMPRESSION_LEVELS = dict({
+    'br': 4,
+    'zstd': 3,
+    'gzip': 6,
+    'deflate': 6,
+}, **getattr(settings, 'API_COMPRESSION_LEVELS', {}))
+
+# Preferred first when the client accepts several with the same q-value
+COMPRESSION_ENCODINGS = getattr(settings, 'API_COMPRESSION_ENCODINGS', ('br', 'zstd', 'gzip', 'deflate'))
+
+COMPRESSION_CONTENT_TYPES = getattr(settings, 'API_COMPRESSION_CONTENT_TYPES',
+    ('application/json', 'text/javascript', 'application/msgpack', 'application/cbor'))
+
+ACCEPT_ENCODING = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$')
+
+### Compressors
+
+class ZlibCompressor(object):
+    """
+    ``gzip`` or ``deflate`` (zlib format, which is what HTTP calls deflate).
+    """
+    def __init__(self, level, gzip=True):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS if gzip else zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+class BrotliCompressor(object):
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+class ZstdCompressor(object):
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush()
+
+COMPRESSORS = {
+    'gzip': lambda level: ZlibCompressor(level),
+    'deflate': lambda level: ZlibCompressor(level, gzip=False),
+}
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliCompressor
+if zstandard is not None:
+    COMPRESSORS['zstd'] = ZstdCompressor
+
+### Helper functions
+
+def get_encoding(accept_encoding):
+    """
+    Picks the content coding to use from an ``Accept-Encoding`` header value,
+    or returns ``None`` to send the response as is.
+
+    The highest q-value wins, ties go to the order of
+    ``API_COMPRESSION_ENCODINGS``. ``*`` stands for codings not listed.
+    """
+    qvalues = {}
+    for item in accept_encoding.split(','):
+        match = ACCEPT_ENCODING.match(item)
+        if match is None:
+            continue
+        coding, q = match.group(1).lower(), match.group(2)
+        try:
+            qvalues[coding] = float(q) if q is not None else 1.0
+        except ValueError:
+            continue
+
+    best, best_q = None, 0
+    for coding in COMPRESSION_ENCODINGS:
+        if coding not in COMPRESSORS:
+            continue
+        q = qvalues.get(coding, qvalues.get('*', 0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+def get_compressor(encoding):
+    return COMPRESSORS[encoding](COMPRESSION_LEVELS[encoding])
+
+def compress(data, encoding):
+    """
+    Compresses ``data`` in one go.
+    """
+    compressor = get_compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+def compress_stream(content, encoding):
+    """
+    Compresses an iterable of chunks incrementally. Every input chunk is
+    flushed so clients can decode what was sent so far.
+    """
+    compressor = get_compressor(encoding)
+    for chunk in content:
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
@@ -0,0 +1,142 @@
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils import six
+from django.utils.six.moves import queue
+
+from api_boilerplate import metrics
+from api_boilerplate.exceptions import ApiTimeoutException
+
+### Settings
+
+CONCURRENCY_MAX_WORKERS = getattr(settings, 'API_CONCURRENCY_MAX_WORKERS', 10)
+
+CONCURRENCY_TIMEOUT = getattr(settings, 'API_CONCURRENCY_TIMEOUT', 30)
+
+### Thread pool
+
+class Task(object):
+    """
+    A call waiting for or running on a pool thread.
+    """
+    def __init__(self, function, request_metrics):
+        self.function = function
+        self.request_metrics = request_metrics
+        self.result = None
+        self.exc_info = None
+        self.done = threading.Event()
+
+    def run(self):
+        metrics.activate(self.request_metrics)
+        try:
+            self.result = self.function()
+        except Exception:
+            self.exc_info = sys.exc_info()
+        finally:
+            metrics.activate(None)
+            # Threads outlive requests, don't keep connections or
+            # transactions open between tasks
+            for connection in connections.all():
+                connection.close()
+            self.done.set()
+
+    def get(self, deadline):
+        if not self.done.wait(max(deadline - time.time(), 0)):
+            raise ApiTimeoutException('Call didn\'t finish in time.')
+        if self.exc_info is not None:
+            six.reraise(*self.exc_info)
+        return self.result
+
+class ThreadPool(object):
+    """
+    Daemon threads, started on demand up to ``size``, that run tasks from a
+    queue. Shared by all requests of the process.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.tasks = queue.Queue()
+        self.threads = []
+        # Threads waiting for a task, and tasks waiting for a thread
+        self.idle = 0
+        self.backlog = 0
+        self.lock = threading.Lock()
+
+    def submit(self, function, backlog=True):
+        """
+        Returns the ``Task`` running ``function``. With ``backlog=False``
+        returns ``None`` instead of queuing it when every thread is busy.
+        """
+        task = Task(function, metrics.current())
+        with self.lock:
+            if self.idle:
+                self.idle -= 1
+            elif len(self.threads) < self.size:
+                thread = threading.Thread(target=self._work, name='api-worker-%d' % len(self.threads))
+                thread.daemon = True
+                self.threads.append(thread)
+                thread.start()
+            elif backlog:
+                self.backlog += 1
+            else:
+                return None
+        self.tasks.put(task)
+        return task
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            task.run()
+            with self.lock:
+                if self.backlog:
+                    self.backlog -= 1
+                else:
+                    self.idle += 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(CONCURRENCY_MAX_WORKERS)
+    return _pool
+
+### Helper functions
+
+def run_concurrently(functions, timeout=None):
+    """
+    Calls ``functions`` (callables without arguments) on the shared thread
+    pool and returns their results in the same order.
+
+    Meant for views that fan out to slow I/O, e.g. other services or
+    independent queries, so the calls overlap instead of adding up. The
+    first exception raised by a call is re-raised, and
+    ``ApiTimeoutException`` when the calls take longer than ``timeout``
+    seconds (``API_CONCURRENCY_TIMEOUT``) together. Calls that timed out
+    keep running in the background.
+
+    Each call runs on its own database connection, so it doesn't see
+    uncommitted changes of the request. Calls the pool has no free thread
+    for run on the calling thread, so calls made from pool threads (e.g.
+    views in a batch) can't wait on each other for threads.
+    """
+    functions = list(functions)
+    if len(functions) < 2:
+        return [function() for function in functions]
+
+    deadline = time.time() + (timeout if timeout is not None else CONCURRENCY_TIMEOUT)
+    pool = get_pool()
+    tasks = [pool.submit(function, backlog=False) for function in functions]
+    results = []
+    for function, task in zip(functions, tasks):
+        if task is not None:
+            results.append(task.get(deadline))
+        elif time.time() >= deadline:
+            raise ApiTimeoutException('Call didn\'t finish in time.')
+        else:
+            results.append(function())
+    return results
@@ -1,6 +1,33 @@
+import hashlib
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import get_cache
+from django.http import HttpResponse
+from django.utils.encoding import force_bytes
+
+from api_boilerplate.renderers import select_renderer
+from api_boilerplate.http import JSONResponseUnauthorized, JSONResponseForbidden, JSONResponseNotAcceptable, JSONResponseBadRequest
+
+### Settings
+
+CACHE_BACKEND = getattr(settings, 'API_CACHE_BACKEND', 'default')
+
+CACHE_TIMEOUT = getattr(settings, 'API_CACHE_TIMEOUT', 60)
+
+CACHE_STALE_TIMEOUT = getattr(settings, 'API_CACHE_STALE_TIMEOUT', 30)
+
+CACHE_LOCK_TIMEOUT = getattr(settings, 'API_CACHE_LOCK_TIMEOUT', 10)
+
+CACHE_PREFIX = 'api_boilerplate:cache:'
 
-from api_boilerplate.http import JSONResponseUnauthorized, JSONResponseNotAcceptable, JSONResponseBadRequest
+# Tag versions outlive any entry
+TAG_TIMEOUT = 60 * 60 * 24 * 30
+
+response_cache = get_cache(CACHE_BACKEND)
 
 def api_login_required(function):
     """
@@ -39,3 +66,156 @@ def staff_required(function):
     if function:
         return _dec(function)
     return _dec
+
+
+def scope_required(*scopes):
+    """
+    Decorator to check that the request's credentials grant all ``scopes``.
+
+    Credentials without scopes, e.g. sessions and passwords, grant all.
+
+        @method_decorator(scope_required('write'))
+        def post(self, request, *args, **kwargs):
+    """
+    def _dec(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if not request.user.is_authenticated():
+                return JSONResponseUnauthorized(request, 'Please authenticate')
+            granted = getattr(request, 'auth_scopes', None)
+            missing = [scope for scope in scopes if granted is not None and scope not in granted]
+            if missing:
+                return JSONResponseForbidden(request, 'Missing scope: %s.' % ', '.join(missing))
+            return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return _dec
+
+
+def api_cache(timeout=None, tags=(), public=False, stale_timeout=None):
+    """
+    Decorator to cache GET responses of API views.
+
+    Use with ``method_decorator`` on ``ApiView`` methods:
+
+        @method_decorator(api_cache(60, tags=['users'], public=True))
+        def get(self, request, *args, **kwargs):
+
+    The cache key covers the path, the sorted query string (``limit``,
+    ``offset``, ``callback``, ``prettify``, ...), ``DEBUG`` and the
+    authenticated user, unless the response is the same for everyone
+    (``public``). Only ``200`` responses are cached, streaming ones included,
+    though those are read into memory for it.
+
+    ``tags`` are strings, or callables taking the view arguments, that
+    ``invalidate_api_cache`` can expire entries by.
+
+    Entries are served ``stale_timeout`` seconds past ``timeout`` while one
+    request rebuilds them, and a lock keeps concurrent misses from building
+    the same response at once.
+    """
+    if timeout is None:
+        timeout = CACHE_TIMEOUT
+    if stale_timeout is None:
+        stale_timeout = CACHE_STALE_TIMEOUT
+
+    def _dec(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            view_tags = [tag(request, *args, **kwargs) if callable(tag) else tag for tag in tags]
+            key = _cache_key(request, view_tags, public)
+            lock_key = '%s:lock' % key
+
+            entry = response_cache.get(key)
+            if entry is not None and time.time() < entry[3]:
+                return _cached_response(entry, 'HIT')
+
+            locked = response_cache.add(lock_key, 1, CACHE_LOCK_TIMEOUT)
+            if not locked:
+                if entry is not None:
+                    # Another request is already refreshing it
+                    return _cached_response(entry, 'STALE')
+                # Another request is building it, wait for the result
+                deadline = time.time() + CACHE_LOCK_TIMEOUT
+                while time.time() < deadline:
+                    time.sleep(0.05)
+                    entry = response_cache.get(key)
+                    if entry is not None:
+                        return _cached_response(entry, 'HIT')
+
+            try:
+                response = view_func(request, *args, **kwargs)
+                if response.status_code == 200:
+                    response = _store_response(key, response, timeout, stale_timeout)
+            finally:
+                # The lock may belong to another request after a timeout
+                if locked:
+                    response_cache.delete(lock_key)
+            return response
+        return _wrapped_view
+    return _dec
+
+
+def invalidate_api_cache(*tags):
+    """
+    Expires all responses cached with any of ``tags``.
+    """
+    response_cache.set_many(dict(
+        (_tag_key(tag), uuid.uuid4().hex) for tag in tags
+    ), TAG_TIMEOUT)
+
+
+def _tag_key(tag):
+    return '%stag:%s' % (CACHE_PREFIX, hashlib.md5(force_bytes(tag)).hexdigest())
+
+
+def _cache_key(request, tags, public):
+    """
+    Builds the cache key from the request and the current versions of ``tags``.
+    """
+    if public:
+        identity = 'public'
+    else:
+        user = getattr(request, 'user', None)
+        identity = 'user:%s' % user.pk if user is not None and user.is_authenticated() else 'anonymous'
+
+    query = sorted((key, sorted(values)) for key, values in request.GET.lists())
+
+    versions = []
+    if tags:
+        tag_keys = [_tag_key(tag) for tag in tags]
+        stored = response_cache.get_many(tag_keys)
+        for tag_key in tag_keys:
+            version = stored.get(tag_key)
+            if version is None:
+                version = uuid.uuid4().hex
+                response_cache.add(tag_key, version, TAG_TIMEOUT)
+                # Lost a race with another request, use its version
+                version = response_cache.get(tag_key, version)
+            versions.append(version)
+
+    # Responses differ by negotiated format
+    parts = (request.path.rstrip('/'), query, identity, settings.DEBUG, select_renderer(request).format, versions)
+    return '%s%s' % (CACHE_PREFIX, hashlib.md5(force_bytes(repr(parts))).hexdigest())
+
+
+def _store_response(key, response, timeout, stale_timeout):
+    if response.streaming:
+        content = b''.join(response.streaming_content)
+    else:
+        content = response.content
+
+    entry = (content, response.status_code, list(response.items()), time.time() + timeout)
+    response_cache.set(key, entry, timeout + stale_timeout)
+    return _cached_response(entry, 'MISS')
+
+
+def _cached_response(entry, state):
+    content, status_code, headers, fresh_until = entry
+    response = HttpResponse(content, status=status_code)
+    for header, value in headers:
+        response[header] = value
+    response['X-Cache'] = state
+    return response
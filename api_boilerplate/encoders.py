@@ -0,0 +1,109 @@
+import datetime
+import decimal
+import json
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
+from django.utils.encoding import force_text
+from django.utils.functional import Promise
+
+### Settings
+
+JSON_ENCODER = getattr(settings, 'API_JSON_ENCODER', 'auto')
+
+### Helper functions
+
+def default(obj):
+    """
+    Converts objects the JSON backends don't know about.
+
+    Handles datetimes, dates and times (ISO 8601), ``Decimal`` (string to
+    keep precision), ``UUID`` and lazy translation strings.
+    """
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, Promise):
+        return force_text(obj)
+    raise TypeError('%r is not JSON serializable' % (obj,))
+
+### Backends
+
+def _json():
+    def dumps(data, indent=None):
+        return json.dumps(data, indent=indent, default=default)
+    return dumps
+
+def _simplejson():
+    import simplejson
+    # Without the C extension simplejson is slower than the stdlib
+    if not simplejson._import_c_make_encoder():
+        raise ImportError('simplejson speedups are not available')
+
+    def dumps(data, indent=None):
+        return simplejson.dumps(data, indent=indent, default=default)
+    return dumps
+
+def _ujson():
+    import ujson
+
+    def dumps(data, indent=None):
+        return ujson.dumps(data, indent=indent or 0, default=default, escape_forward_slashes=False)
+    return dumps
+
+def _orjson():
+    if not six.PY3:
+        raise ImportError('orjson needs Python 3')
+    import orjson
+    options = orjson.OPT_NON_STR_KEYS
+
+    def dumps(data, indent=None):
+        option = options | orjson.OPT_INDENT_2 if indent else options
+        return orjson.dumps(data, default=default, option=option).decode('utf-8')
+    return dumps
+
+# In order of preference for ``auto``
+BACKENDS = (
+    ('orjson', _orjson),
+    ('ujson', _ujson),
+    ('simplejson', _simplejson),
+    ('json', _json),
+)
+
+# Encoded by a backend before it's used, some versions don't call default
+SAMPLE = {'created': datetime.datetime(2013, 1, 1, 12, 30), 'price': decimal.Decimal('1.50'), 'uri': '/api/'}
+SAMPLE_JSON = {'created': '2013-01-01T12:30:00', 'price': '1.50', 'uri': '/api/'}
+
+def _works(dumps):
+    try:
+        return json.loads(dumps(SAMPLE)) == SAMPLE_JSON
+    except (TypeError, ValueError):
+        return False
+
+def get_backend(name):
+    """
+    Returns the ``dumps(data, indent=None)`` function of backend ``name``.
+
+    ``auto`` returns the fastest installed backend that encodes a sample
+    with datetimes and decimals correctly.
+    """
+    for backend, loader in BACKENDS:
+        if name in (backend, 'auto'):
+            try:
+                dumps = loader()
+            except ImportError:
+                if name != 'auto':
+                    raise ImproperlyConfigured("JSON encoder '%s' is not installed." % name)
+                continue
+            if _works(dumps):
+                return dumps
+            if name != 'auto':
+                raise ImproperlyConfigured("JSON encoder '%s' doesn't support default encoding, upgrade it." % name)
+    raise ImproperlyConfigured("Unknown JSON encoder '%s'." % name)
+
+dumps = get_backend(JSON_ENCODER)
@@ -1,2 +1,11 @@
 class ApiBadRequestException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class ApiUnauthorizedException(Exception):
+    pass
+
+class ApiQueryCountException(AssertionError):
+    pass
+
+class ApiTimeoutException(Exception):
+    pass
@@ -1,37 +1,176 @@
 import re
-import json
+import math
+import hashlib
+import itertools
 import logging
+from calendar import timegm
  
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 from django.utils.decorators import method_decorator
 from django.conf import settings
 
+from api_boilerplate.encoders import dumps
+from api_boilerplate.metrics import timed
+from api_boilerplate.renderers import get_renderers, select_renderer
+from api_boilerplate.serialization import QueryCounter
+
 logger = logging.getLogger('django.request')
 
+STREAMING_CHUNK_SIZE = getattr(settings, 'API_STREAMING_CHUNK_SIZE', 100)
+
+USE_ETAGS = getattr(settings, 'API_USE_ETAGS', True)
+
+# JSONP callback may only contain letters, numbers, periods, and underscores
+JSONP_CALLBACK = re.compile(r'^[a-zA-Z][\w.]*$')
+
 class JSONResponse(HttpResponse):
-    def __init__(self, request, data):
+    """
+    Encodes ``data`` as JSON, or JSONP when a ``callback`` is requested.
+
+    Other formats (MessagePack, CBOR) are rendered when the client asks for
+    them with ``Accept`` or the ``format`` parameter, see ``renderers``.
+    This applies to all the response classes below.
+
+    With a ``resource``, ``data`` is serialized with it first. Querysets,
+    lists and tuples are serialized as collections.
+    """
+    @timed('serialize')
+    def __init__(self, request, data, resource=None):
+        if resource is not None:
+            if isinstance(data, (list, tuple)) or hasattr(data, 'values_list'):
+                data = resource.serialize_many(data)
+            else:
+                data = resource.serialize(data)
+        
+        renderer = select_renderer(request)
         indent = 2 if (settings.DEBUG or request.GET.get('prettify')) else None
-        mime = "text/javascript" if settings.DEBUG else "application/json"
-        content = json.dumps(data, indent=indent)
+        mime = renderer.get_media_type()
         
         # JSONP
         callback = request.GET.get('callback')
-        # verify that the callback is only letters, numbers, periods, and underscores
-        if callback and re.compile(r'^[a-zA-Z][\w.]*$').match(callback):
+        if renderer.format == 'json' and callback and JSONP_CALLBACK.match(callback):
             # Always return 200 with real status code in content
-            self.status_code = 200
-            content = {
-                'data': content,
+            data = {
+                'data': data,
                 'status_code': self.status_code,
             }
-            content = '%s(%s);' % (callback, content)
+            self.status_code = 200
+            content = '%s(%s);' % (callback, dumps(data, indent=indent))
+        else:
+            content = renderer.render(data, indent=indent)
         
         super(JSONResponse, self).__init__(
             content = content,
             mimetype = mime,
         )
+        if len(get_renderers()) > 1:
+            patch_vary_headers(self, ('Accept',))
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """
+    Streams a paginated collection as ``{"meta": ..., "objects": [...]}``.
+
+    Rows are fetched with ``QuerySet.iterator()`` and encoded ``chunk_size``
+    objects at a time, so memory use stays flat regardless of the page size
+    and the first bytes go out before the last row is read.
+
+    ``serializer`` is called for each object to get its API representation,
+    e.g. ``lambda profile: profile.api()``. Alternatively a ``resource``
+    serializes the objects, reading querysets with ``values_list()`` when
+    it can.
+
+    Other formats than JSON are rendered in one piece, after reading all
+    the objects.
+    """
+    def __init__(self, request, meta, objects, serializer=None, collection_name='objects', chunk_size=None, resource=None):
+        if resource is not None:
+            objects = resource.iterate(objects, chunked=True)
+        
+        renderer = select_renderer(request)
+        indent = 2 if (settings.DEBUG or request.GET.get('prettify')) else None
+        mime = renderer.get_media_type()
+        
+        # JSONP
+        callback = request.GET.get('callback')
+        if not (callback and JSONP_CALLBACK.match(callback)):
+            callback = None
+        
+        counter = QueryCounter(getattr(objects, 'db', 'default'))
+        objects = _iterate(objects)
+        if serializer is not None:
+            # Serialize the first objects before the status goes out, so N+1
+            # queries raise in the view instead of truncating the body
+            first = [counter.call(serializer, obj) for obj in itertools.islice(objects, 2)]
+            counter.check()
+            objects = itertools.chain(first, (counter.call(serializer, obj) for obj in objects))
+        
+        if renderer.format == 'json':
+            content = self._stream(meta, objects, collection_name,
+                chunk_size or STREAMING_CHUNK_SIZE, indent, callback, counter)
+        else:
+            content = self._render(renderer, meta, objects, collection_name, counter)
+        
+        super(StreamingJSONResponse, self).__init__(
+            streaming_content = content,
+            mimetype = mime,
+        )
+        if len(get_renderers()) > 1:
+            patch_vary_headers(self, ('Accept',))
+
+    def _render(self, renderer, meta, objects, collection_name, counter):
+        objects = list(objects)
+        counter.check(log=True)
+        yield renderer.render({'meta': meta, collection_name: objects})
+
+    def _stream(self, meta, objects, collection_name, chunk_size, indent, callback, counter):
+        if indent:
+            pad = ' ' * indent
+            reindent = lambda content, level: content.replace('\n', '\n' + pad * level)
+            head = '{\n%s"meta": %s,\n%s%s: [' % (pad, reindent(dumps(meta, indent=indent), 1), pad, dumps(collection_name))
+            first, separator, last, tail = '\n' + pad * 2, ',\n' + pad * 2, '\n' + pad, ']\n}'
+        else:
+            reindent = lambda content, level: content
+            head = '{"meta": %s, %s: [' % (dumps(meta), dumps(collection_name))
+            first, separator, last, tail = '', ', ', '', ']}'
+        
+        if callback:
+            # Always return 200 with real status code in content
+            head = '%s({"status_code": %d, "data": %s' % (callback, self.status_code, head)
+            tail = '%s});' % tail
+        
+        chunk = [head]
+        empty = True
+        for obj in objects:
+            chunk.append(separator if not empty else first)
+            chunk.append(reindent(dumps(obj, indent=indent), 2))
+            empty = False
+            
+            if len(chunk) >= chunk_size * 2:
+                yield ''.join(chunk)
+                chunk = []
+        
+        counter.check(log=True)
+        if not empty:
+            chunk.append(last)
+        chunk.append(tail)
+        yield ''.join(chunk)
+
+def _iterate(objects):
+    """
+    Iterates ``objects`` without filling the queryset's result cache.
+
+    Querysets that were already evaluated (e.g. by ``len()``) are iterated
+    from the cache instead of running the query again. ``iterator()`` skips
+    ``prefetch_related`` so such querysets are evaluated normally.
+    """
+    if (hasattr(objects, 'iterator') and getattr(objects, '_result_cache', None) is None
+            and not getattr(objects, '_prefetch_related_lookups', None)):
+        return objects.iterator()
+    return iter(objects)
 
 class JSONResponseCreated(JSONResponse):
     status_code = 201
@@ -43,6 +182,9 @@ class JSONResponseCreated(JSONResponse):
 class JSONResponseNoContent(JSONResponse):
     status_code = 204
 
+class JSONResponseMultiStatus(JSONResponse):
+    status_code = 207
+
 class JSONErrorResponse(JSONResponse):
     def __init__(self, request, data):
         super(JSONErrorResponse, self).__init__(request, {'message': data})
@@ -80,6 +222,18 @@ class JSONResponseMethodNotAllowed(JSONErrorResponse):
 class JSONResponseNotAcceptable(JSONErrorResponse):
     status_code = 406
 
+class JSONResponseRequestEntityTooLarge(JSONErrorResponse):
+    status_code = 413
+
+class JSONResponseTooManyRequests(JSONErrorResponse):
+    status_code = 429
+
+    def __init__(self, request, data='Too many requests.', retry_after=None):
+        super(JSONResponseTooManyRequests, self).__init__(request, data)
+        
+        if retry_after is not None:
+            self['Retry-After'] = str(int(math.ceil(retry_after)))
+
 class JSONResponseNotImplemented(JSONErrorResponse):
     status_code = 501
 
@@ -87,7 +241,40 @@ class JSONResponseNotImplemented(JSONErrorResponse):
 class ApiView(View):
     """
     API View
+
+    GET and HEAD requests support conditional requests. Responses get an
+    ``ETag`` from a hash of the body (``API_USE_ETAGS``) and matching
+    ``If-None-Match`` requests get an empty ``304``. Views can implement
+    ``get_etag`` and/or ``get_last_modified`` to answer ``304`` before the
+    handler runs at all.
+
+    Those run before decorators on the handler like ``api_login_required``,
+    so anonymous requests only get a ``304`` after the handler returned
+    ``200``, unless ``public_etags`` is set. Views restricted further (staff,
+    scopes) should check access in ``get_etag`` and return ``None`` when
+    it's denied.
     """
+    # Django < 1.6 doesn't route PATCH
+    http_method_names = ['get', 'post', 'put', 'patch', 'delete', 'head', 'options', 'trace']
+
+    # Answer conditional requests of anonymous clients before the handler
+    public_etags = False
+
+    def get_etag(self, request, *args, **kwargs):
+        """
+        Returns an ETag for the requested resource, or ``None``.
+
+        Should be cheaper than building the response, e.g. based on an
+        ``updated`` timestamp or a version counter.
+        """
+        return None
+
+    def get_last_modified(self, request, *args, **kwargs):
+        """
+        Returns the ``datetime`` the requested resource last changed, or ``None``.
+        """
+        return None
+
     def http_method_not_allowed(self, request, *args, **kwargs):
         logger.warning('Method Not Allowed (%s): %s', request.method, request.path,
             extra={
@@ -97,6 +284,7 @@ class ApiView(View):
         )
         return JSONResponseMethodNotAllowed(request)
     
+    @timed('view')
     def dispatch(self, request, *args, **kwargs):
         # Try to dispatch to the right method; if a method doesn't exist,
         # defer to the error handler. Also defer to the error handler if the
@@ -105,7 +293,65 @@ class ApiView(View):
             handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
         else:
             handler = self.http_method_not_allowed
-        return handler(request, *args, **kwargs)
+        
+        if request.method not in ('GET', 'HEAD') or handler == self.http_method_not_allowed:
+            return handler(request, *args, **kwargs)
+        
+        # Conditional GET
+        etag = self.get_etag(request, *args, **kwargs)
+        last_modified = self.get_last_modified(request, *args, **kwargs)
+        if last_modified is not None:
+            last_modified = timegm(last_modified.utctimetuple())
+        
+        # The handler's access checks haven't run yet
+        user = getattr(request, 'user', None)
+        early = self.public_etags or (user is not None and user.is_authenticated())
+        if early and _not_modified(request, etag, last_modified):
+            return _not_modified_response(etag, last_modified)
+        
+        response = handler(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        if not early and _not_modified(request, etag, last_modified):
+            return _not_modified_response(etag, last_modified)
+        
+        if etag is None and USE_ETAGS and not response.streaming and not response.has_header('ETag'):
+            etag = hashlib.md5(response.content).hexdigest()
+            if _not_modified(request, etag, None):
+                return _not_modified_response(etag, last_modified)
+        
+        if etag is not None and not response.has_header('ETag'):
+            response['ETag'] = quote_etag(etag)
+        if last_modified is not None and not response.has_header('Last-Modified'):
+            response['Last-Modified'] = http_date(last_modified)
+        return response
     
     def _allowed_methods(self):
         return [m.upper() for m in self.http_method_names if hasattr(self, m)]
+
+def _not_modified(request, etag, last_modified):
+    """
+    Checks ``If-None-Match`` and ``If-Modified-Since`` against the resource.
+
+    ``If-Modified-Since`` is ignored when ``If-None-Match`` is present.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        if etag is None:
+            return False
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+    
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and last_modified is not None:
+        if_modified_since = parse_http_date_safe(if_modified_since)
+        return if_modified_since is not None and last_modified <= if_modified_since
+    return False
+
+def _not_modified_response(etag, last_modified):
+    response = HttpResponseNotModified()
+    if etag is not None:
+        response['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
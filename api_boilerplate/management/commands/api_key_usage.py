@@ -0,0 +1,51 @@
+import datetime
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.loading import get_model
+from django.utils import timezone
+
+API_KEY_MODEL = getattr(settings, 'API_KEY_MODEL', 'api_boilerplate.models.ApiKey')
+
+
+class Command(NoArgsCommand):
+    help = ('Lists API keys by request count, or the keys not used in a number '
+        'of days with --inactive. Counts are written by running processes every '
+        'API_KEY_USAGE_FLUSH_INTERVAL seconds.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--inactive', action='store', type='int', dest='inactive', default=None,
+            help='Only list keys not used in this many days, oldest first.'),
+        make_option('--limit', action='store', type='int', dest='limit', default=50,
+            help='Keys listed, 0 for all.'),
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database. Defaults to the "default" database.'),
+    )
+
+    def handle_noargs(self, **options):
+        if options['inactive'] is not None and options['inactive'] < 0:
+            raise CommandError('--inactive should be a positive number of days.')
+
+        model = get_model(API_KEY_MODEL.split('.')[0], API_KEY_MODEL.split('.')[-1])
+        keys = model.objects.using(options['database']).select_related('user')
+        if options['inactive'] is not None:
+            since = timezone.now() - datetime.timedelta(days=options['inactive'])
+            keys = keys.filter(Q(last_used__lt=since) | Q(last_used__isnull=True, created__lt=since))
+            keys = keys.order_by('last_used', 'created')
+        else:
+            keys = keys.order_by('-request_count', 'pk')
+        if options['limit']:
+            keys = keys[:options['limit']]
+
+        self.stdout.write('%-10s %-20s %-20s %12s  %s' % ('prefix', 'user', 'name', 'requests', 'last used'))
+        for api_key in keys:
+            self.stdout.write('%-10s %-20s %-20s %12d  %s' % (
+                api_key.prefix or '-',
+                api_key.user.username,
+                api_key.name or '-',
+                api_key.request_count,
+                api_key.last_used.strftime('%Y-%m-%d %H:%M') if api_key.last_used else 'never',
+            ))
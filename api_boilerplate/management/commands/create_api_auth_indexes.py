@@ -0,0 +1,74 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+
+def get_index_sql(connection):
+    """
+    Returns ``(name, sql)`` for the indexes API authentication lookups need.
+
+    ``username`` already has an unique index for exact lookups. Case
+    insensitive lookups are written by Django as ``UPPER(column::text)``, so
+    the functional indexes use the same expression.
+    """
+    case_insensitive = getattr(settings, 'API_AUTH_CASE_INSENSITIVE', False)
+    email_as_username = getattr(settings, 'API_AUTH_EMAIL_AS_USERNAME', False)
+
+    columns = []
+    if case_insensitive:
+        columns.append('username')
+    if email_as_username:
+        columns.append('email')
+
+    qn = connection.ops.quote_name
+    table = User._meta.db_table
+    indexes = []
+    for column in columns:
+        if case_insensitive:
+            name = '%s_%s_upper' % (table, column)
+            expression = 'UPPER(%s::text)' % qn(column)
+        else:
+            name = '%s_%s' % (table, column)
+            expression = qn(column)
+        indexes.append((name, 'CREATE INDEX %s ON %s (%s);' % (qn(name), qn(table), expression)))
+    return indexes
+
+
+class Command(NoArgsCommand):
+    help = ('Creates the indexes used by API authentication lookups with '
+        'API_AUTH_CASE_INSENSITIVE and API_AUTH_EMAIL_AS_USERNAME. PostgreSQL only.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--sql', action='store_true', dest='sql', default=False,
+            help='Print the SQL instead of running it.'),
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database. Defaults to the "default" database.'),
+    )
+
+    def handle_noargs(self, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'postgresql':
+            raise CommandError('Functional indexes are only supported on PostgreSQL.')
+
+        indexes = get_index_sql(connection)
+        if not indexes:
+            self.stdout.write('No indexes needed with the current settings.')
+            return
+
+        if options['sql']:
+            for name, sql in indexes:
+                self.stdout.write(sql)
+            return
+
+        cursor = connection.cursor()
+        for name, sql in indexes:
+            cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s', [name])
+            if cursor.fetchone():
+                self.stdout.write('Index %s already exists.' % name)
+                continue
+            cursor.execute(sql)
+            self.stdout.write('Created index %s.' % name)
+        transaction.commit_unless_managed(using=options['database'])
@@ -0,0 +1,97 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models.loading import get_model
+
+from api_boilerplate.models import hash_secret, split_key
+
+API_KEY_MODEL = getattr(settings, 'API_KEY_MODEL', 'api_boilerplate.models.ApiKey')
+
+# Columns added to API key tables created before keys were hashed
+# (and before usage tracking)
+NEW_FIELDS = ('name', 'prefix', 'key_hash', 'scopes', 'expires', 'last_used', 'request_count')
+
+
+def get_upgrade_sql(connection, model):
+    """
+    Returns the statements adding the hashed key columns to an existing
+    API key table, nothing for tables created with them.
+
+    On PostgreSQL also drops the unique constraint of the former one to
+    one ``user`` relation, other databases need that done by hand for
+    users to hold several keys.
+    """
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    cursor = connection.cursor()
+    columns = [column[0] for column in connection.introspection.get_table_description(cursor, table)]
+
+    statements = []
+    for name in NEW_FIELDS:
+        field = model._meta.get_field(name)
+        if field.column in columns:
+            continue
+        definition = field.db_type(connection)
+        if field.null:
+            definition += ' NULL'
+        else:
+            definition += ' DEFAULT %s NOT NULL' % ("''" if field.get_default() == '' else field.get_default())
+        statements.append('ALTER TABLE %s ADD COLUMN %s %s;' % (qn(table), qn(field.column), definition))
+        if field.db_index:
+            index = '%s_%s' % (table, field.column)
+            statements.append('CREATE INDEX %s ON %s (%s);' % (qn(index), qn(table), qn(field.column)))
+
+    if statements and connection.vendor == 'postgresql':
+        user_column = model._meta.get_field('user').column
+        statements.append('ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s;' % (qn(table), qn('%s_%s_key' % (table, user_column))))
+    return statements
+
+
+class Command(NoArgsCommand):
+    help = ('Moves plain text API keys to hashed storage. Adds the new columns '
+        'to API key tables created before keys were hashed. Clients keep using '
+        'their keys as they are.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--sql', action='store_true', dest='sql', default=False,
+            help='Print the SQL for the new columns instead of running anything.'),
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=1000,
+            help='Keys converted per transaction.'),
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database. Defaults to the "default" database.'),
+    )
+
+    def handle_noargs(self, **options):
+        database = options['database']
+        connection = connections[database]
+        model = get_model(API_KEY_MODEL.split('.')[0], API_KEY_MODEL.split('.')[-1])
+
+        statements = get_upgrade_sql(connection, model)
+        if options['sql']:
+            for sql in statements:
+                self.stdout.write(sql)
+            return
+
+        if statements:
+            cursor = connection.cursor()
+            for sql in statements:
+                cursor.execute(sql)
+            transaction.commit_unless_managed(using=database)
+            self.stdout.write('Added the hashed key columns.')
+
+        converted = 0
+        keys = model.objects.using(database).filter(key_hash='').exclude(key='')
+        while True:
+            batch = list(keys.only('pk', 'key')[:options['batch_size']])
+            if not batch:
+                break
+            with transaction.commit_on_success(using=database):
+                for api_key in batch:
+                    # The first characters of the old key become the prefix
+                    prefix, secret = split_key(api_key.key)
+                    model.objects.using(database).filter(pk=api_key.pk).update(
+                        prefix=prefix, key_hash=hash_secret(secret), key='')
+            converted += len(batch)
+        self.stdout.write('Hashed %d API keys.' % converted)
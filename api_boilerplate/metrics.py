@@ -0,0 +1,287 @@
+import bisect
+import logging
+import random
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+logger = logging.getLogger('api_boilerplate.metrics')
+
+### Settings
+
+METRICS_SERVER_TIMING = getattr(settings, 'API_METRICS_SERVER_TIMING', settings.DEBUG)
+
+METRICS_LOG_SAMPLE_RATE = getattr(settings, 'API_METRICS_LOG_SAMPLE_RATE', 0.01)
+
+METRICS_BUCKETS = tuple(getattr(settings, 'API_METRICS_BUCKETS',
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)))
+
+# Phases in the order they are reported
+PHASES = ('auth', 'parse', 'view', 'paginate', 'db', 'serialize', 'stream')
+
+### Request metrics
+
+_local = threading.local()
+
+class RequestMetrics(object):
+    """
+    Timings and counters of the request being handled by this thread.
+
+    ``timings`` holds seconds spent per phase. Phases nest, e.g. ``view``
+    includes ``db`` and ``serialize`` time spent inside the view.
+
+    Pool threads running calls for the request (``run_concurrently``,
+    batches) add to the same object, so updates are made under a lock.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.route = None
+        self.timings = {}
+        self.queries = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.timings[phase] = self.timings.get(phase, 0) + seconds
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.timings['db'] = self.timings.get('db', 0) + seconds
+
+    def server_timing(self, total):
+        """
+        Returns a ``Server-Timing`` header value, durations in milliseconds.
+        """
+        items = []
+        for phase in PHASES:
+            if phase in self.timings:
+                item = '%s;dur=%.1f' % (phase, self.timings[phase] * 1000)
+                if phase == 'db':
+                    item += ';desc="%d queries"' % self.queries
+                items.append(item)
+        items.append('total;dur=%.1f' % (total * 1000))
+        return ', '.join(items)
+
+def current():
+    """
+    Returns the ``RequestMetrics`` of this thread's request or ``None``.
+    """
+    return getattr(_local, 'metrics', None)
+
+def activate(metrics):
+    _local.metrics = metrics
+
+class timer(object):
+    """
+    Context manager adding the time spent in the block to ``phase``.
+
+    Does nothing outside requests handled by ``ApiMetricsMiddleware``.
+    """
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.metrics = current()
+        if self.metrics is not None:
+            self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        if self.metrics is not None:
+            self.metrics.add(self.phase, time.time() - self.start)
+
+def timed(phase):
+    """
+    Decorator adding the time spent in the function to ``phase``.
+    """
+    def _dec(function):
+        @wraps(function)
+        def _wrapped(*args, **kwargs):
+            metrics = current()
+            if metrics is None:
+                return function(*args, **kwargs)
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.add(phase, time.time() - start)
+        return _wrapped
+    return _dec
+
+### Database timing
+
+def _record_query(start):
+    metrics = current()
+    if metrics is not None:
+        metrics.add_query(time.time() - start)
+
+def _execute_wrapper(execute, sql, params, many, context):
+    start = time.time()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        _record_query(start)
+
+class TimedCursorWrapper(object):
+    """
+    Times queries on Django versions without ``execute_wrapper``.
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return self.cursor.execute(*args, **kwargs)
+        finally:
+            _record_query(start)
+
+    def executemany(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return self.cursor.executemany(*args, **kwargs)
+        finally:
+            _record_query(start)
+
+def install_query_timing():
+    """
+    Makes this thread's database connections report queries to the
+    request metrics. Connections are per thread, so this runs per request
+    and is a no-op once installed.
+    """
+    for connection in connections.all():
+        if getattr(connection, '_api_metrics', False):
+            continue
+        connection._api_metrics = True
+
+        if hasattr(connection, 'execute_wrappers'):
+            connection.execute_wrappers.append(_execute_wrapper)
+            continue
+
+        # Django < 2.0: wrap the cursors the connection hands out
+        _install_cursor_wrapper(connection)
+
+def _install_cursor_wrapper(connection):
+    # Wrapping cursor() rather than setting use_debug_cursor keeps
+    # connection.queries, and the query count checks relying on it, as
+    # DEBUG has them
+    cursor = connection.cursor
+    connection.cursor = lambda: TimedCursorWrapper(cursor())
+
+### Prometheus registry
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels)
+
+class Counter(object):
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s counter' % self.name]
+        for labels, value in sorted(self.values.items()):
+            lines.append('%s%s %s' % (self.name, _format_labels(labels), value))
+        return lines
+
+class Histogram(object):
+    def __init__(self, name, documentation, buckets=METRICS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # Per labels: counts per bucket (the last one is +Inf) and the sum
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        labels = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self.values.get(labels) or ([0] * (len(self.buckets) + 1), 0)
+            counts[index] += 1
+            self.values[labels] = (counts, total + value)
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s histogram' % self.name]
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (self.name, _format_labels(labels + (('le', bound),)), cumulative))
+            lines.append('%s_sum%s %s' % (self.name, _format_labels(labels), total))
+            lines.append('%s_count%s %d' % (self.name, _format_labels(labels), cumulative))
+        return lines
+
+requests_total = Counter('api_requests_total', 'API requests by route, method and status.')
+
+request_duration = Histogram('api_request_duration_seconds', 'API request duration by route.')
+
+phase_duration = Histogram('api_phase_duration_seconds', 'Time spent per request phase by route.')
+
+queries_total = Counter('api_db_queries_total', 'Database queries by route.')
+
+response_bytes_total = Counter('api_response_bytes_total', 'Response body bytes by route.')
+
+REGISTRY = [requests_total, request_duration, phase_duration, queries_total, response_bytes_total]
+
+def expose():
+    """
+    Returns all metrics in the Prometheus text format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+def observe(metrics, request, response, total):
+    """
+    Records a finished request in the registry and, sampled, in the log.
+    """
+    route = metrics.route or 'unknown'
+    requests_total.inc({'route': route, 'method': request.method, 'status': response.status_code})
+    request_duration.observe({'route': route}, total)
+    for phase, seconds in metrics.timings.items():
+        phase_duration.observe({'route': route, 'phase': phase}, seconds)
+    if metrics.queries:
+        queries_total.inc({'route': route}, metrics.queries)
+    response_bytes_total.inc({'route': route}, metrics.bytes)
+
+    if METRICS_LOG_SAMPLE_RATE and random.random() < METRICS_LOG_SAMPLE_RATE:
+        fields = [
+            ('route', route),
+            ('method', request.method),
+            ('status', response.status_code),
+            ('total_ms', '%.1f' % (total * 1000)),
+            ('queries', metrics.queries),
+            ('bytes', metrics.bytes),
+        ]
+        fields.extend(('%s_ms' % phase, '%.1f' % (metrics.timings[phase] * 1000)) for phase in PHASES if phase in metrics.timings)
+        logger.info(' '.join('%s=%s' % field for field in fields), extra=dict(fields))
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Metrics are kept per process, so every
+    worker has to be scraped. Keep it out of public reach.
+    """
+    return HttpResponse(expose(), content_type='text/plain; version=0.0.4')
@@ -1,151 +1,331 @@
-import base64
-import json
+import hashlib
+import math
+import time
 
-from django.contrib.auth.models import User
 from django.conf import settings
-from django.db.models.loading import get_model
-from django.middleware.csrf import get_token
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
 
-from api_boilerplate.http import JSONResponseUnauthorized, JSONResponseBadRequest
+from api_boilerplate import compression, metrics, parsers
+from api_boilerplate.authentication import (ApiKeyAuthenticator, BasicAuthenticator, SessionAuthenticator,
+    get_authenticators, is_api_request)
+from api_boilerplate.exceptions import ApiUnauthorizedException
+from api_boilerplate.http import JSONResponseUnauthorized, JSONResponseTooManyRequests, JSONResponseRequestEntityTooLarge
+from api_boilerplate.ratelimit import RATE_LIMIT, RATE_LIMIT_BY, get_backend, parse_rate
 
 ### Settings
 
-AUTH_CASE_INSENSITIVE = getattr(settings, 'API_AUTH_CASE_INSENSITIVE', False)
+REQUEST_MAX_BODY_SIZE = getattr(settings, 'API_REQUEST_MAX_BODY_SIZE', 10 * 1024 * 1024)
 
-AUTH_EMAIL_AS_USERNAME = getattr(settings, 'API_AUTH_EMAIL_AS_USERNAME', False)
+### Helper functions
 
-API_KEY_MODEL = getattr(settings, 'API_KEY_MODEL',
-    'api_boilerplate.models.ApiKey')
-ApiKey = get_model(*API_KEY_MODEL.split('.',1))
+def _authenticate(authenticators, request):
+    """
+    Sets ``request.user`` from the first authenticator that claims the
+    request. Returns a ``401`` response when the claimed credentials are
+    wrong.
+    """
+    for authenticator in authenticators:
+        try:
+            user = authenticator.authenticate(request)
+        except ApiUnauthorizedException as e:
+            return JSONResponseUnauthorized(request, str(e))
+        if user is not None:
+            request.user = user
+            return None
+    return None
 
-REQUEST_JSON = getattr(settings, 'API_REQUEST_JSON', True)
+# Request classes with a lazy ``data`` property, by request class
+_data_classes = {}
 
-### Helper functions
+def _get_data(request):
+    if '_data' not in request.__dict__:
+        request._data = parsers.parse_data(request)
+    return request._data
+
+def _set_data(request, data):
+    request._data = data
 
-def _get_user(username):
+def _lazy_data_class(cls):
+    if cls not in _data_classes:
+        _data_classes[cls] = type(cls.__name__, (cls,), {'data': property(_get_data, _set_data)})
+    return _data_classes[cls]
+
+def _stream_metrics(content, request_metrics, finish):
+    """
+    Counts the bytes of a streaming response and times producing them.
+    Chunks are produced after the middlewares ran, so the request metrics
+    are re-activated for every chunk (queries run in the generator).
+    """
     try:
-        if AUTH_CASE_INSENSITIVE:
-            user = User.objects.get(username__iexact=username)
-        else:
-            user = User.objects.get(username=username)
-    except User.DoesNotExist:
-        user = None
-    
-    if AUTH_EMAIL_AS_USERNAME:
-        if not user:
+        iterator = iter(content)
+        while True:
+            metrics.activate(request_metrics)
+            start = time.time()
             try:
-                if AUTH_CASE_INSENSITIVE:
-                    user = User.objects.get(email__iexact=username)
-                else:
-                    user = User.objects.get(email=username)
-            except User.DoesNotExist:
-                user = None
-    
-    return user
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                request_metrics.add('stream', time.time() - start)
+                metrics.activate(None)
+            request_metrics.bytes += len(chunk)
+            yield chunk
+    finally:
+        finish()
 
-### Authentication middlewares
+### Instrumentation middlewares
+
+class ApiMetricsMiddleware:
+    """
+    Records per request timings and counters.
+
+    Time spent in authentication, body parsing, the view, pagination,
+    database queries and serialization is collected for every request and
+    exported as Prometheus metrics by route name (see ``metrics.metrics_view``).
+    With ``API_METRICS_SERVER_TIMING`` (default: ``DEBUG``) responses carry
+    a ``Server-Timing`` header, and ``API_METRICS_LOG_SAMPLE_RATE`` of the
+    requests are logged to the ``api_boilerplate.metrics`` logger.
+
+    Place first in ``MIDDLEWARE_CLASSES`` so the totals cover the other
+    middlewares and the byte counts the compressed body.
+    """
+    def process_request(self, request):
+        metrics.install_query_timing()
+        request_metrics = metrics.RequestMetrics()
+        request._metrics = request_metrics
+        metrics.activate(request_metrics)
 
-class ApiDjangoAuthMiddleware:
     def process_view(self, request, view_func, view_args, view_kwargs):
-        """
-        Django session auth
+        request_metrics = getattr(request, '_metrics', None)
+        if request_metrics is not None:
+            resolver_match = getattr(request, 'resolver_match', None)
+            request_metrics.route = (resolver_match and resolver_match.url_name) or view_func.__name__
 
-        Authenticates logged in users. Handy for quick debugging or extensions.
+    def process_response(self, request, response):
+        request_metrics = getattr(request, '_metrics', None)
+        if request_metrics is None:
+            return response
 
-        Note: Only allows CSRF safe methods. See Django's CSRF AJAX documentation for including tokens to requests:
+        if metrics.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = request_metrics.server_timing(time.time() - request_metrics.start)
 
-            https://docs.djangoproject.com/en/dev/ref/contrib/csrf/#ajax
+        def finish():
+            metrics.observe(request_metrics, request, response, time.time() - request_metrics.start)
 
-        """
-        if request.user.is_authenticated():
-            # Always set CSRF token (not set by default unless templatetag or ensure_csrf_cookie decorator is used)
-            get_token(request)
+        if response.streaming:
+            # Finished when the last chunk is sent
+            response.streaming_content = _stream_metrics(response.streaming_content, request_metrics, finish)
+        else:
+            request_metrics.bytes = len(response.content)
+            finish()
+        metrics.activate(None)
+        return response
+
+### Authentication middlewares
+
+class ApiAuthenticationMiddleware:
+    """
+    Authenticates API requests with ``API_AUTHENTICATORS``.
+
+    Authenticators are tried in order and the first one that finds its
+    credentials in the request decides: it sets ``request.user`` or the
+    request gets a ``401``. The rest aren't consulted, so e.g. requests
+    with an API key never load the session. Requests outside
+    ``API_URL_PREFIXES`` are left alone.
+
+    Use instead of ``ApiDjangoAuthMiddleware``, ``ApiHttpBasicAuthMiddleware``
+    and ``ApiKeyAuthMiddleware``.
+    """
+    def __init__(self):
+        self.authenticators = get_authenticators()
+
+    @metrics.timed('auth')
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not is_api_request(request):
             return None
+        return _authenticate(self.authenticators, request)
+
+class ApiDjangoAuthMiddleware:
+    """
+    Django session auth, see ``authentication.SessionAuthenticator``.
+    """
+    def __init__(self):
+        self.authenticators = [SessionAuthenticator()]
+
+    @metrics.timed('auth')
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        return _authenticate(self.authenticators, request)
 
 class ApiHttpBasicAuthMiddleware:
+    """
+    HTTP Basic auth, see ``authentication.BasicAuthenticator``.
+    """
+    def __init__(self):
+        self.authenticators = [BasicAuthenticator()]
+
+    @metrics.timed('auth')
     def process_view(self, request, view_func, view_args, view_kwargs):
-        """
-        Middleware for API authentication.
-        
-        Partly forked from django-tastypie
-        """
-        # Basic Auth
-        if request.META.get('HTTP_AUTHORIZATION', None):
-            try:
-                (auth_type, data) = request.META['HTTP_AUTHORIZATION'].split()
-                if auth_type != 'Basic':
-                    return JSONResponseUnauthorized(request, 'Error with HTTP Basic Auth')
-                user_pass = base64.b64decode(data)
-            except:
-                return JSONResponseUnauthorized(request, 'Error with HTTP Basic Auth')
-
-            bits = user_pass.split(':', 1)
-
-            if len(bits) != 2:
-                return JSONResponseUnauthorized(request, 'Invalid Authorization header. Value should be "Basic QWxhZGRpbjpvcGVuIHNlc2FtZQ==" where base64 encoded part is encrypted from "username:password"')
-
-            
-            # Get user by username or email
-            username = bits[0]
-            user = _get_user(username)
-            if user == None:
-                return JSONResponseUnauthorized(request, 'User and password don\'t match')
-            
-            if user.check_password(bits[1]):
-                request.user = user
-            else:
-                return JSONResponseUnauthorized(request, 'Username and password don\'t match')
-            
-            request.user = user
-            return
+        authorization = request.META.get('HTTP_AUTHORIZATION')
+        if authorization and authorization.split(' ', 1)[0] != 'Basic':
+            return JSONResponseUnauthorized(request, 'Error with HTTP Basic Auth')
+        return _authenticate(self.authenticators, request)
 
 class ApiKeyAuthMiddleware:
+    """
+    API key auth, see ``authentication.ApiKeyAuthenticator``.
+    """
+    def __init__(self):
+        self.authenticators = [ApiKeyAuthenticator()]
+
+    @metrics.timed('auth')
     def process_view(self, request, view_func, view_args, view_kwargs):
+        return _authenticate(self.authenticators, request)
+
+### Rate limiting middlewares
+
+class ApiRateLimitMiddleware:
+    """
+    Limits the request rate per user, API key or IP address.
+
+    Place after the authentication middlewares. Configured with
+    ``API_RATE_LIMIT`` (e.g. ``'1000/h'``), ``API_RATE_LIMIT_BY`` and
+    ``API_RATE_LIMIT_BACKEND``. Responses carry ``X-RateLimit-Limit``,
+    ``X-RateLimit-Remaining`` and ``X-RateLimit-Reset`` (seconds until the
+    limit is fully restored) headers.
+    """
+    def __init__(self):
+        if not RATE_LIMIT:
+            raise MiddlewareNotUsed
+        self.limit, self.period = parse_rate(RATE_LIMIT)
+        self.backend = get_backend()
+        self.username_header = 'HTTP_X_%s_USERNAME' % settings.SITE_NAME.upper()
+        self.api_key_header = 'HTTP_X_%s_API_TOKEN' % settings.SITE_NAME.upper()
+
+    def get_key(self, request):
         """
-        Middleware for API authentication. Partly forked form django-tastypie
+        Returns the identity the limit applies to.
+
+        Requests without the configured identity fall back to the user and
+        then to the IP address.
         """
-        # ApiKey Auth
-        username = request.META.get('HTTP_X_%s_USERNAME' % (settings.SITE_NAME.upper()), None) 
-        api_key = request.META.get('HTTP_X_%s_API_TOKEN' % (settings.SITE_NAME.upper()), None)
-
-        if username and api_key:
-            '''
-            Handles API key auth, in which a user provides a username & API key.
-            '''
-            user = _get_user(username)
-            if user == None:
-                return JSONResponseUnauthorized(request, 'Can\'t find an user with this username and api_key')
+        if RATE_LIMIT_BY == 'api_key':
+            api_key = request.META.get(self.api_key_header)
+            if api_key:
+                username = request.META.get(self.username_header, '')
+                return 'key:%s' % hashlib.sha1(('%s:%s' % (username, api_key)).encode('utf-8')).hexdigest()
 
-            try:
-                ApiKey.objects.get(user=user, key=api_key)
-            except ApiKey.DoesNotExist:
-                return JSONResponseUnauthorized(request, 'Can\'t find an user with this username and api_key')
+        if RATE_LIMIT_BY in ('user', 'api_key'):
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated():
+                return 'user:%s' % user.pk
 
-            request.user = user
-            return
+        return 'ip:%s' % request.META.get('REMOTE_ADDR', '')
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Views running more requests (batches) limit them with check()
+        request.rate_limiter = self
+        return self.check(request)
+
+    def check(self, request):
+        """
+        Counts ``request`` against its identity's limit. Returns a ``429``
+        response when the limit is used up.
+        """
+        rate_limit = self.backend.consume(self.get_key(request), self.limit, self.period)
+        request.rate_limit = rate_limit
+        if not rate_limit.allowed:
+            return JSONResponseTooManyRequests(request, retry_after=rate_limit.retry_after)
+
+    def process_response(self, request, response):
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit is not None:
+            response['X-RateLimit-Limit'] = str(rate_limit.limit)
+            response['X-RateLimit-Remaining'] = str(rate_limit.remaining)
+            response['X-RateLimit-Reset'] = str(int(math.ceil(rate_limit.reset)))
+        return response
 
 ### Request middlewares
 
 class ApiRequestDataMiddleware:
+    """
+    Middleware for parsing POST/PUT/PATCH data.
+    
+    Provides the parsed body as ``request.data``: JSON (default=True, see
+    ``API_REQUEST_JSON``) or form encoded POST data, ``None`` otherwise.
+    The body is only read and parsed when a view accesses ``request.data``.
+    Requests larger than ``API_REQUEST_MAX_BODY_SIZE`` are rejected with
+    ``413`` before reading anything.
+    
+    ``parsers.iter_items(request)`` parses large JSON arrays and NDJSON
+    incrementally instead.
+    """
     def process_view(self, request, view_func, view_args, view_kwargs):
-        """
-        Middleware for parsing POST/PUT/PATCH data.
-        
-        Parses POST data into request.data. Optionally parses JSON from raw content as well (default=True).
-        """
-        
-        # JSON
-        if REQUEST_JSON:
-            try:
-                data = json.loads(request.body)
-            except ValueError:
-                data = None
+        if not is_api_request(request):
+            return
+        if request.method in parsers.BODYLESS_METHODS:
+            request.data = None
+            return
         
-        # POST
-        if request.method == 'POST' and request.POST.keys():
-            data = {}
-            for key in request.POST.keys():
-                data[key] = request.POST[key]
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if REQUEST_MAX_BODY_SIZE and content_length > REQUEST_MAX_BODY_SIZE:
+            return JSONResponseRequestEntityTooLarge(request,
+                'Request body is too large, up to %d bytes are allowed.' % REQUEST_MAX_BODY_SIZE)
         
-        request.data = data
+        request.__class__ = _lazy_data_class(request.__class__)
         return
+
+### Response middlewares
+
+class ApiCompressionMiddleware:
+    """
+    Compresses API responses with the best coding the client accepts.
+
+    Negotiates ``br`` and ``zstd`` (when the ``brotli`` and ``zstandard``
+    packages are installed), ``gzip`` and ``deflate`` from
+    ``Accept-Encoding``. Only ``API_COMPRESSION_CONTENT_TYPES`` are
+    compressed, and responses smaller than ``API_COMPRESSION_MIN_SIZE`` are
+    left alone. Streaming responses are compressed chunk by chunk as they
+    are sent.
+
+    Place first in ``MIDDLEWARE_CLASSES`` so it sees the final response,
+    and use it instead of Django's ``GZipMiddleware``.
+    """
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in compression.COMPRESSION_CONTENT_TYPES:
+            return response
+
+        # Caches must keep the variants apart even when not compressed
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        if not response.streaming and len(response.content) < compression.COMPRESSION_MIN_SIZE:
+            return response
+
+        encoding = compression.get_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compression.compress_stream(response.streaming_content, encoding)
+            if response.has_header('Content-Length'):
+                del response['Content-Length']
+        else:
+            content = compression.compress(response.content, encoding)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # The compressed bytes differ, the representation doesn't
+        etag = response.get('ETag')
+        if etag and not etag.startswith('W/'):
+            response['ETag'] = 'W/' + etag
+
+        response['Content-Encoding'] = encoding
+        return response
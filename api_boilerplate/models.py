@@ -1,34 +1,152 @@
-import uuid
+import hashlib
 import hmac
-from hashlib import sha1
 
 from django.db import models
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.conf import settings
+from django.utils.crypto import constant_time_compare, get_random_string
+from django.utils.encoding import force_bytes
 from django.utils.timezone import now
 from django.contrib.auth.models import User
 
+from api_boilerplate.cache import AUTH_CACHE, api_key_cache
+from api_boilerplate.tokens import revoke_api_key_tokens, revoke_user_tokens
+
+KEY_PREFIX_LENGTH = 8
+
+KEY_SECRET_LENGTH = 32
+
+KEY_CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+# Changes to these revoke the bearer tokens issued before
+USER_TOKEN_FIELDS = ('password', 'is_active')
+
+API_KEY_TOKEN_FIELDS = ('user', 'scopes', 'expires', 'key_hash', 'key')
+
+# Python < 2.7.7
+compare_digest = getattr(hmac, 'compare_digest', constant_time_compare)
+
+def hash_secret(secret):
+    """
+    Secrets are long and random, so a fast hash is as good as a slow
+    password hasher here and keeps every request cheap.
+    """
+    return hashlib.sha256(force_bytes(secret)).hexdigest()
+
+def split_key(raw_key):
+    """
+    Returns ``(prefix, secret)`` of a ``prefix.secret`` key. Keys issued
+    before hashing have no dot, their first characters are the prefix.
+    """
+    if '.' in raw_key:
+        return tuple(raw_key.split('.', 1))
+    return raw_key[:KEY_PREFIX_LENGTH], raw_key[KEY_PREFIX_LENGTH:]
+
 class ApiKey(models.Model):
     '''
     Api Key
     
-    This key is used for API key authentication
+    This key is used for API key authentication. Keys look like
+    ``prefix.secret``: the prefix is stored for lookups, the secret only
+    as a hash. The full key is available as ``raw_key`` right after the key
+    is created and never again.
     
     Forked from django-tastypie
     '''
-    user = models.OneToOneField(settings.AUTH_USER_MODEL, related_name='api_key')
-    key = models.CharField(max_length=256, blank=True, default='', db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='api_keys')
+    name = models.CharField(max_length=100, blank=True, default='')
+    prefix = models.CharField(max_length=KEY_PREFIX_LENGTH, blank=True, default='', db_index=True, editable=False)
+    key_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+    # Space separated, empty for all
+    scopes = models.CharField(max_length=255, blank=True, default='')
+    expires = models.DateTimeField(null=True, blank=True)
+    # Plain text keys from before hashing, see the hash_api_keys command
+    key = models.CharField(max_length=256, blank=True, default='', db_index=True, editable=False)
     
-    created = models.DateTimeField(default=now())
+    created = models.DateTimeField(default=now)
+    # Written in bulk by usage tracking (API_KEY_USAGE)
+    last_used = models.DateTimeField(null=True, blank=True, editable=False)
+    request_count = models.BigIntegerField(default=0, editable=False)
     
     def __unicode__(self):
-        return u"%s" % (self.user)
+        return u"%s (%s)" % (self.user, self.prefix)
 
     def save(self, *args, **kwargs):
-        if not self.key:
-            self.key = self.generate_key()
+        if not self.key_hash and not self.key:
+            self.raw_key = self.generate_key()
+            self.prefix, secret = split_key(self.raw_key)
+            self.key_hash = hash_secret(secret)
 
         return super(ApiKey, self).save(*args, **kwargs)
 
     def generate_key(self):
-        new_uuid = uuid.uuid4()
-        return hmac.new(str(new_uuid), digestmod=sha1).hexdigest()
\ No newline at end of file
+        return '%s.%s' % (get_random_string(KEY_PREFIX_LENGTH, KEY_CHARS), get_random_string(KEY_SECRET_LENGTH, KEY_CHARS))
+
+    def check_key(self, raw_key):
+        """
+        Compares in constant time, so response times don't leak the key.
+        """
+        if self.key_hash:
+            prefix, secret = split_key(raw_key)
+            return compare_digest(force_bytes(self.key_hash), force_bytes(hash_secret(secret)))
+        return constant_time_compare(self.key, raw_key)
+
+    def get_scopes(self):
+        """
+        Returns the granted scopes, or ``None`` when the key is unrestricted.
+        """
+        return frozenset(self.scopes.split()) if self.scopes else None
+
+    def is_expired(self):
+        return self.expires is not None and self.expires <= now()
+
+
+def _is_api_key_model(sender):
+    # API_KEY_MODEL may point to a custom model
+    label = getattr(settings, 'API_KEY_MODEL', 'api_boilerplate.models.ApiKey').lower().split('.')
+    # Instances from the auth cache have deferred (proxy) classes
+    opts = sender._meta.concrete_model._meta
+    return (opts.app_label, opts.object_name.lower()) == (label[0], label[-1])
+
+def _has_changed(sender, instance, fields, update_fields=None):
+    '''
+    Returns whether saving ``instance`` changes any of ``fields`` in the
+    database
+    '''
+    if update_fields is not None:
+        fields = [name for name in fields if name in update_fields]
+    if instance.pk is None or not fields:
+        return False
+    attnames = [sender._meta.get_field(name).attname for name in fields]
+    stored = sender._default_manager.filter(pk=instance.pk).values_list(*attnames)
+    return bool(stored) and tuple(stored[0]) != tuple(getattr(instance, name) for name in attnames)
+
+def invalidate_auth_cache(sender, instance, **kwargs):
+    '''
+    Drops cached credentials when a user or an API key changes
+    '''
+    if isinstance(instance, User):
+        api_key_cache.invalidate(instance.pk)
+    elif _is_api_key_model(sender):
+        api_key_cache.invalidate(instance.user_id)
+
+def revoke_tokens(sender, instance, signal, raw=False, update_fields=None, **kwargs):
+    '''
+    Revokes bearer tokens when their user's password or active status, or
+    the API key they were exchanged for changes, and when either is deleted
+    '''
+    if raw:
+        return
+    if isinstance(instance, User):
+        if signal is post_delete or _has_changed(sender, instance, USER_TOKEN_FIELDS, update_fields):
+            revoke_user_tokens(instance)
+    elif _is_api_key_model(sender):
+        if signal is post_delete or _has_changed(sender, instance, API_KEY_TOKEN_FIELDS, update_fields):
+            revoke_api_key_tokens(instance)
+
+if AUTH_CACHE:
+    post_save.connect(invalidate_auth_cache, dispatch_uid='api_boilerplate.invalidate_auth_cache')
+    post_delete.connect(invalidate_auth_cache, dispatch_uid='api_boilerplate.invalidate_auth_cache')
+
+pre_save.connect(revoke_tokens, dispatch_uid='api_boilerplate.revoke_tokens')
+post_delete.connect(revoke_tokens, dispatch_uid='api_boilerplate.revoke_tokens')
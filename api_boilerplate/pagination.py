@@ -1,7 +1,116 @@
+import datetime
+import decimal
+import hashlib
+
 from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils.encoding import force_bytes
 from urllib import urlencode
 
 from api_boilerplate.exceptions import ApiBadRequestException
+from api_boilerplate.metrics import timed
+from api_boilerplate.serialization import apply_prefetch
+
+### Count strategies
+
+class ExactCount(object):
+    """
+    Counts the objects with ``count()`` on every request.
+    """
+    def count(self, objects):
+        """
+        Returns a tuple of the count and a flag telling if it's an estimate.
+        """
+        try:
+            return objects.count(), False
+        except (AttributeError, TypeError):
+            # If it's not a QuerySet (or it's ilk), fallback to ``len``.
+            return len(objects), False
+
+class CachedCount(ExactCount):
+    """
+    Exact count cached with Django's cache framework.
+
+    The cache key is derived from the queryset's SQL and params, so each
+    differently filtered queryset gets its own entry. Counts may be off by
+    the writes done within ``timeout`` seconds.
+    """
+    def __init__(self, timeout=None, cache=cache):
+        if timeout is None:
+            timeout = getattr(settings, 'API_COUNT_CACHE_TIMEOUT', 60)
+        self.timeout = timeout
+        self.cache = cache
+
+    def count(self, objects):
+        key = self.get_cache_key(objects)
+        if key is None:
+            return super(CachedCount, self).count(objects)
+
+        count = self.cache.get(key)
+        if count is None:
+            count = super(CachedCount, self).count(objects)[0]
+            self.cache.set(key, count, self.timeout)
+        return count, False
+
+    def get_cache_key(self, objects):
+        try:
+            sql, params = objects.query.get_compiler(objects.db).as_sql()
+        except AttributeError:
+            return None
+        except EmptyResultSet:
+            # ``none()`` or ``pk__in=[]``, nothing to cache
+            return None
+
+        digest = hashlib.md5(force_bytes(repr((objects.db, sql, params)))).hexdigest()
+        return 'api_boilerplate:count:%s' % digest
+
+class EstimatedCount(ExactCount):
+    """
+    Query planner estimate for unfiltered querysets on PostgreSQL.
+
+    Reads ``pg_class.reltuples`` which ``ANALYZE`` and autovacuum keep up to
+    date. Filtered querysets, other databases and tables smaller than
+    ``threshold`` (where counting is cheap anyway) use ``fallback`` instead.
+    """
+    def __init__(self, threshold=None, fallback=None):
+        if threshold is None:
+            threshold = getattr(settings, 'API_COUNT_ESTIMATE_THRESHOLD', 10000)
+        self.threshold = threshold
+        self.fallback = fallback or ExactCount()
+
+    def count(self, objects):
+        estimate = self.get_estimate(objects)
+        if estimate is None or estimate < self.threshold:
+            return self.fallback.count(objects)
+        return estimate, True
+
+    def get_estimate(self, objects):
+        query = getattr(objects, 'query', None)
+        if query is None or query.where or query.having or query.distinct:
+            return None
+
+        connection = connections[objects.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        cursor = connection.cursor()
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [objects.model._meta.db_table])
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return int(row[0])
+
+COUNT_STRATEGIES = {
+    'exact': ExactCount,
+    'cached': CachedCount,
+    'estimate': EstimatedCount,
+}
+
+### Paginators
 
 class Paginator(object):
     """
@@ -19,9 +128,15 @@ class Paginator(object):
     Forked from django-testypie with few modifications.
     
     - ``skip_count`` - Speed requests by avoiding constly count() operations
+    - ``count_strategy`` - How ``total_count`` is computed, see ``COUNT_STRATEGIES``
+    - ``resource`` - Serializes the page with a ``Resource``
+    - ``lazy`` - Leaves the page unevaluated for ``StreamingJSONResponse``
     
     """
-    def __init__(self, request_data, objects, resource_uri=None, limit=None, offset=0, max_limit=200, skip_count=False, collection_name='objects'):
+    # Request parameters controlled by the paginator, replaced in generated URIs
+    paging_params = ('limit', 'offset')
+
+    def __init__(self, request_data, objects, resource_uri=None, limit=None, offset=0, max_limit=200, skip_count=False, collection_name='objects', count_strategy=None, resource=None, lazy=False):
         """
         Instantiates the ``Paginator`` and allows for some configuration.
 
@@ -42,6 +157,22 @@ class Paginator(object):
         Optionally accepts a ``max_limit`` argument, which the upper bound
         limit. Defaults to ``1000``. If you set it to 0 or ``None``, no upper
         bound will be enforced.
+
+        Optionally accepts a ``count_strategy`` argument, either a name from
+        ``COUNT_STRATEGIES`` or an object with a ``count(objects)`` method.
+        Defaults to ``settings.API_COUNT_STRATEGY`` or ``'exact'``.
+
+        Optionally accepts a ``resource`` argument, a ``Resource`` instance.
+        The page's objects are then returned serialized, read straight from
+        the database with ``values_list()`` when the resource allows it.
+        The ``fields`` and ``expand`` request parameters select the fields.
+
+        Optionally accepts a ``lazy`` argument. The page's objects are then
+        returned without evaluating them, for ``StreamingJSONResponse`` to
+        read them with ``iterator()`` chunk by chunk, and a ``resource``
+        serializes them as they're streamed. ``total_count`` then
+        always comes from the ``count_strategy``, as counting the page would
+        load it. Defaults to ``False``.
         """
         self.request_data = request_data
         self.objects = objects
@@ -51,6 +182,15 @@ class Paginator(object):
         self.skip_count = skip_count
         self.resource_uri = resource_uri
         self.collection_name = collection_name
+        self.resource = resource
+        self.lazy = lazy
+
+        if count_strategy is None:
+            count_strategy = getattr(settings, 'API_COUNT_STRATEGY', 'exact')
+        if isinstance(count_strategy, basestring):
+            count_strategy = COUNT_STRATEGIES[count_strategy]()
+        self.count_strategy = count_strategy
+        self.count_is_estimate = False
 
     def get_limit(self):
         """
@@ -111,21 +251,56 @@ class Paginator(object):
     def get_slice(self, limit, offset):
         """
         Slices the result set to the specified ``limit`` & ``offset``.
+
+        Applies the prefetch plan declared on the model's ``api()`` method,
+        unless a ``resource`` takes care of fetching.
         """
+        objects = self.objects if self.resource is not None else apply_prefetch(self.objects)
         if limit == 0:
-            return self.objects[offset:]
+            return objects[offset:]
 
-        return self.objects[offset:offset + limit]
+        return objects[offset:offset + limit]
+
+    def get_resource(self):
+        """
+        Narrows the ``resource`` to the requested ``fields`` and ``expand``.
+        """
+        if self.resource is None:
+            return None
+        return self.resource.for_request(self.request_data)
+
+    def serialize(self, resource, objects):
+        """
+        Serializes the page's ``objects`` with ``resource``. Lazy pages are
+        serialized one object at a time while they're streamed.
+        """
+        if self.lazy:
+            return resource.iterate(objects, chunked=True)
+        return resource.serialize_many(objects)
 
     def get_count(self):
         """
         Returns a count of the total number of objects seen.
+
+        Sets ``count_is_estimate`` if the ``count_strategy`` returned an
+        approximation.
         """
-        try:
-            return self.objects.count()
-        except (AttributeError, TypeError):
-            # If it's not a QuerySet (or it's ilk), fallback to ``len``.
-            return len(self.objects)
+        count, self.count_is_estimate = self.count_strategy.count(self.objects)
+        return count
+
+    def get_slice_count(self, objects, limit, offset):
+        """
+        Returns the total count if it can be told from the page itself, which
+        is the case when the page came back shorter than ``limit``. Otherwise
+        returns ``None``.
+        """
+        size = len(objects)
+        if limit and size >= limit:
+            return None
+        if not size and offset:
+            # Past the end, the total is unknown
+            return None
+        return offset + size
 
     def get_previous(self, limit, offset):
         """
@@ -142,23 +317,29 @@ class Paginator(object):
         If a next page is available, will generate a URL to request that
         page. If not available, this returns ``None``.
         """
-        if self.skip_count == False and offset + limit >= count:
+        if self.skip_count == False and not self.count_is_estimate and offset + limit >= count:
             return None
 
         return self._generate_uri(limit, offset+limit)
 
     def _generate_uri(self, limit, offset):
+        return self._build_uri({'limit': limit, 'offset': offset})
+
+    def _build_uri(self, params):
+        """
+        Generates a URI to ``resource_uri`` with the current request parameters
+        where the paging parameters have been replaced with ``params``.
+        """
         if self.resource_uri is None:
             return None
 
         try:
             # QueryDict has a urlencode method that can handle multiple values for the same key
             request_params = self.request_data.copy()
-            if 'limit' in request_params:
-                del request_params['limit']
-            if 'offset' in request_params:
-                del request_params['offset']
-            request_params.update({'limit': limit, 'offset': offset})
+            for key in self.paging_params:
+                if key in request_params:
+                    del request_params[key]
+            request_params.update(params)
             encoded_params = request_params.urlencode()
         except AttributeError:
             request_params = {}
@@ -169,11 +350,10 @@ class Paginator(object):
                 else:
                     request_params[k] = v
 
-            if 'limit' in request_params:
-                del request_params['limit']
-            if 'offset' in request_params:
-                del request_params['offset']
-            request_params.update({'limit': limit, 'offset': offset})
+            for key in self.paging_params:
+                if key in request_params:
+                    del request_params[key]
+            request_params.update(params)
             encoded_params = urlencode(request_params)
 
         return '%s?%s' % (
@@ -181,6 +361,7 @@ class Paginator(object):
             encoded_params
         )
 
+    @timed('paginate')
     def page(self):
         """
         Generates all pertinent data about the requested page.
@@ -190,15 +371,21 @@ class Paginator(object):
         """
         limit = self.get_limit()
         offset = self.get_offset()
+        resource = self.get_resource()
         objects = self.get_slice(limit, offset)
+        if resource is not None:
+            objects = self.serialize(resource, objects)
         meta = {
             'offset': offset,
             'limit': limit,
         }
         
         if self.skip_count == False:
-            count = self.get_count()
+            count = None if self.lazy else self.get_slice_count(objects, limit, offset)
+            if count is None:
+                count = self.get_count()
             meta['total_count'] = count
+            meta['is_estimate'] = self.count_is_estimate
         else:
             count = None
 
@@ -209,4 +396,198 @@ class Paginator(object):
         return {
             self.collection_name: objects,
             'meta': meta,
-        }
\ No newline at end of file
+        }
+
+class CursorPaginator(Paginator):
+    """
+    Keyset (cursor) based ``Paginator``.
+
+    Instead of slicing with ``offset`` (SQL ``OFFSET n`` gets slower the deeper
+    the page), this seeks on an indexed ordering key, so every page costs the
+    same. The ``next``/``previous`` links carry an opaque, signed ``cursor``
+    parameter in place of ``offset``. Response shape stays the same as with
+    ``Paginator``, minus ``offset``.
+
+    - ``ordering`` - Fields to order and seek on. Together they must be unique
+      and not null, e.g. ``('pk',)`` or ``('-created', 'pk')``
+    - ``skip_count`` - Defaults to ``True`` as counting defeats the purpose on
+      large tables
+
+    """
+    paging_params = ('limit', 'offset', 'cursor')
+    cursor_salt = 'api_boilerplate.pagination.CursorPaginator'
+
+    def __init__(self, request_data, objects, resource_uri=None, limit=None, max_limit=200, skip_count=True, collection_name='objects', count_strategy=None, ordering=('pk',), resource=None, lazy=False):
+        """
+        Instantiates the ``CursorPaginator``.
+
+        Accepts the same arguments as ``Paginator`` except ``offset``.
+        ``objects`` must be a ``QuerySet``.
+
+        Optionally accepts an ``ordering`` argument. Defaults to ``('pk',)``.
+        """
+        super(CursorPaginator, self).__init__(request_data, objects,
+            resource_uri=resource_uri,
+            limit=limit,
+            max_limit=max_limit,
+            skip_count=skip_count,
+            collection_name=collection_name,
+            count_strategy=count_strategy,
+            resource=resource,
+            lazy=lazy,
+        )
+        self.ordering = tuple(ordering)
+
+    def get_cursor(self):
+        """
+        Decodes the user-provided ``cursor`` from the GET parameters.
+
+        Returns a tuple of ordering key values and a flag telling if the
+        cursor points backwards, or ``(None, False)`` for the first page.
+        """
+        cursor = self.request_data.get('cursor')
+        if not cursor:
+            return None, False
+
+        try:
+            data = signing.loads(cursor, salt=self.cursor_salt)
+            values, reverse = data['v'], data['r']
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            raise ApiBadRequestException("Invalid cursor '%s' provided." % cursor)
+
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise ApiBadRequestException("Invalid cursor '%s' provided." % cursor)
+
+        return values, bool(reverse)
+
+    def get_ordering(self, reverse=False):
+        """
+        Returns the ``order_by`` arguments, flipped when paging backwards.
+        """
+        if not reverse:
+            return self.ordering
+        return tuple(field[1:] if field.startswith('-') else '-%s' % field for field in self.ordering)
+
+    def get_seek(self, objects, values, reverse):
+        """
+        Filters ``objects`` to the rows after the ordering key ``values``.
+
+        For ``('a', 'b')`` this is ``a > x OR (a = x AND b > y)`` which the
+        database can answer with an index range scan.
+        """
+        query = None
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            descending = field.startswith('-')
+            name = field.lstrip('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+
+            kwargs = dict(equal)
+            kwargs['%s__%s' % (name, lookup)] = value
+            query = Q(**kwargs) if query is None else query | Q(**kwargs)
+            equal[name] = value
+
+        return objects.filter(query)
+
+    def get_prefetched(self, resource=None):
+        """
+        Applies the prefetch plan of the ``resource`` or the model's ``api()``.
+        """
+        if resource is not None:
+            # Keep the ordering key loaded for the cursors
+            return resource.prepare(self.objects, [field.lstrip('-') for field in self.ordering])
+        return apply_prefetch(self.objects)
+
+    def get_values(self, obj):
+        """
+        Returns the ordering key values of ``obj`` for encoding into a cursor.
+        """
+        values = []
+        for field in self.ordering:
+            value = obj
+            for attr in field.lstrip('-').split('__'):
+                value = value[attr] if isinstance(value, dict) else getattr(value, attr)
+            values.append(_cursor_value(value))
+        return values
+
+    def _generate_cursor_uri(self, limit, values, reverse):
+        cursor = signing.dumps({'v': values, 'r': int(reverse)}, salt=self.cursor_salt)
+        return self._build_uri({'limit': limit, 'cursor': cursor})
+
+    @timed('paginate')
+    def page(self):
+        """
+        Generates all pertinent data about the requested page.
+
+        Handles getting the correct ``limit`` & ``cursor``, then seeks to the
+        correct set of results and returns all pertinent metadata.
+        """
+        limit = self.get_limit()
+        values, reverse = self.get_cursor()
+        resource = self.get_resource()
+
+        # Cursors are read from model instances, so resources serialize them
+        objects = self.get_prefetched(resource).order_by(*self.get_ordering(reverse))
+        if values is not None:
+            objects = self.get_seek(objects, values, reverse)
+
+        meta = {
+            'limit': limit,
+        }
+
+        if self.skip_count == False:
+            meta['total_count'] = self.get_count()
+            meta['is_estimate'] = self.count_is_estimate
+
+        if not limit:
+            if reverse:
+                objects = list(objects)[::-1]
+            if resource is not None:
+                objects = self.serialize(resource, objects)
+            return {
+                self.collection_name: objects,
+                'meta': meta,
+            }
+
+        # Fetch one extra row to find out if there's more to come
+        objects = list(objects[:limit + 1])
+        has_more = len(objects) > limit
+        objects = objects[:limit]
+
+        if reverse:
+            objects.reverse()
+            has_previous, has_next = has_more, values is not None
+        else:
+            has_previous, has_next = values is not None, has_more
+
+        meta['previous'] = None
+        meta['next'] = None
+        if has_previous:
+            anchor = self.get_values(objects[0]) if objects else values
+            meta['previous'] = self._generate_cursor_uri(limit, anchor, True)
+        if has_next:
+            anchor = self.get_values(objects[-1]) if objects else values
+            meta['next'] = self._generate_cursor_uri(limit, anchor, False)
+
+        if resource is not None:
+            objects = self.serialize(resource, objects)
+
+        return {
+            self.collection_name: objects,
+            'meta': meta,
+        }
+
+
+def _cursor_value(value):
+    """
+    Converts an ordering key value into something JSON can carry in a cursor.
+
+    Database lookups accept the string forms back, so no decoding is needed.
+    """
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (int, long, float, basestring)) or value is None:
+        return value
+    return unicode(value)
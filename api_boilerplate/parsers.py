@@ -0,0 +1,288 @@
+import codecs
+import io
+import json
+
+from django.conf import settings
+
+from api_boilerplate.metrics import timed
+from api_boilerplate.utils import import_by_path
+
+### Settings
+
+REQUEST_JSON = getattr(settings, 'API_REQUEST_JSON', True)
+
+PARSERS = getattr(settings, 'API_PARSERS', (
+    'api_boilerplate.parsers.JSONParser',
+    'api_boilerplate.parsers.MessagePackParser',
+    'api_boilerplate.parsers.CBORParser',
+))
+
+PARSER_CHUNK_SIZE = 64 * 1024
+
+JSON_CONTENT_TYPES = ('application/json', 'text/javascript')
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/jsonlines', 'application/x-jsonlines')
+
+FORM_CONTENT_TYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+# Methods whose requests don't carry a body
+BODYLESS_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+### Parsers
+
+class JSONParser(object):
+    media_types = JSON_CONTENT_TYPES
+    available = True
+
+    def matches(self, content_type):
+        # Bodies without a Content-Type are assumed to be JSON
+        return REQUEST_JSON and (not content_type or is_json(content_type))
+
+    def parse(self, body, encoding):
+        return json.loads(body.decode(encoding))
+
+class MessagePackParser(object):
+    media_types = ('application/msgpack', 'application/x-msgpack')
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            self.available = False
+        else:
+            self.available = True
+            self.msgpack = msgpack
+
+    def matches(self, content_type):
+        return content_type in self.media_types
+
+    def parse(self, body, encoding):
+        try:
+            return self.msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise ValueError(str(e))
+
+class CBORParser(object):
+    media_types = ('application/cbor',)
+
+    def __init__(self):
+        try:
+            import cbor2
+        except ImportError:
+            self.available = False
+        else:
+            self.available = True
+            self.cbor2 = cbor2
+
+    def matches(self, content_type):
+        return content_type in self.media_types
+
+    def parse(self, body, encoding):
+        try:
+            return self.cbor2.loads(body)
+        except Exception as e:
+            raise ValueError(str(e))
+
+### Helper functions
+
+_parsers = None
+
+def get_parsers():
+    """
+    Returns instances of the installed ``API_PARSERS``.
+    """
+    global _parsers
+    if _parsers is None:
+        parsers = [import_by_path(path)() for path in PARSERS]
+        _parsers = [parser for parser in parsers if parser.available]
+    return _parsers
+
+def get_parser(content_type):
+    """
+    Returns the parser for ``content_type`` or ``None``.
+    """
+    for parser in get_parsers():
+        if parser.matches(content_type):
+            return parser
+    return None
+
+def get_content_type(request):
+    return request.META.get('CONTENT_TYPE', '').split(';')[0].strip().lower()
+
+def is_json(content_type):
+    return content_type in JSON_CONTENT_TYPES or content_type.endswith('+json')
+
+@timed('parse')
+def parse_data(request):
+    """
+    Parses the request body into Python data according to its Content-Type.
+
+    Bodies are decoded by the first of ``API_PARSERS`` that accepts the
+    Content-Type. JSON bodies (also without a Content-Type) are decoded
+    when ``API_REQUEST_JSON`` is on, form encoded ``POST`` bodies become a
+    dict. Returns ``None`` for bodyless requests, unsupported Content-Types
+    and malformed bodies.
+    """
+    if request.method in BODYLESS_METHODS:
+        return None
+
+    content_type = get_content_type(request)
+    if content_type in FORM_CONTENT_TYPES:
+        if request.method == 'POST' and request.POST.keys():
+            return dict((key, request.POST[key]) for key in request.POST.keys())
+        return None
+
+    parser = get_parser(content_type)
+    if parser is None:
+        return None
+    try:
+        return parser.parse(request.body, request.encoding or settings.DEFAULT_CHARSET)
+    except ValueError:
+        return None
+
+def _stream(request):
+    """
+    Returns a file-like object for the request body, reading the input
+    stream unless the body was already read.
+    """
+    if hasattr(request, '_body'):
+        return io.BytesIO(request._body)
+    return request
+
+def _decode(stream, encoding):
+    """
+    Yields the stream as text, ``PARSER_CHUNK_SIZE`` bytes at a time.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        chunk = stream.read(PARSER_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+def iter_ndjson(stream, encoding='utf-8'):
+    """
+    Yields the values of a newline delimited JSON stream, one per line.
+
+    Raises ``ValueError`` on the first malformed line.
+    """
+    decoder = json.JSONDecoder()
+    number = 0
+    pending = ''
+    for text in _decode(stream, encoding):
+        lines = (pending + text).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield _decode_line(decoder, line, number)
+    if pending.strip():
+        yield _decode_line(decoder, pending, number + 1)
+
+def _decode_line(decoder, line, number):
+    try:
+        return decoder.decode(line)
+    except ValueError:
+        raise ValueError('Invalid JSON on line %d.' % number)
+
+# Characters a number cut off at the end of a chunk may end with
+NUMBER_CHARACTERS = '0123456789.eE+-'
+
+class _TextBuffer(object):
+    """
+    Text read from a stream of chunks, consumed from ``position``.
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.text = ''
+        self.position = 0
+
+    def fill(self, size=1):
+        """
+        Appends chunks until at least ``size`` characters were added or
+        the stream ends. Returns ``False`` when nothing was left to read.
+        """
+        chunks = []
+        added = 0
+        while added < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            chunks.append(chunk)
+            added += len(chunk)
+        if not chunks:
+            return False
+        self.text = self.text[self.position:] + ''.join(chunks)
+        self.position = 0
+        return True
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character, or ``''`` at the end.
+        """
+        while True:
+            while self.position < len(self.text) and self.text[self.position] in ' \t\r\n':
+                self.position += 1
+            if self.position < len(self.text):
+                return self.text[self.position]
+            if not self.fill():
+                return ''
+
+    def decode(self, decoder):
+        """
+        Decodes the next JSON value, reading until it's complete.
+
+        Incomplete values are parsed again from their start, so the text
+        buffered is doubled before each retry to keep large values linear.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.position)
+            except ValueError:
+                if not self.fill(len(self.text) - self.position):
+                    raise ValueError('Invalid JSON array item.')
+                continue
+            # A number may go on in the next chunk, e.g. "-3e" then "10"
+            rest = end
+            while rest < len(self.text) and self.text[rest] in NUMBER_CHARACTERS:
+                rest += 1
+            if rest == len(self.text) and self.fill():
+                continue
+            self.position = end
+            return value
+
+def iter_json_array(stream, encoding='utf-8'):
+    """
+    Yields the items of a JSON array one by one while reading the stream,
+    so only one item at a time is held in memory.
+
+    Raises ``ValueError`` if the stream isn't a well-formed array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = _TextBuffer(_decode(stream, encoding))
+    if buffer.peek() != '[':
+        raise ValueError('Expected a JSON array.')
+    buffer.position += 1
+    if buffer.peek() == ']':
+        return
+
+    while True:
+        yield buffer.decode(decoder)
+        character = buffer.peek()
+        buffer.position += 1
+        if character == ']':
+            return
+        if character != ',':
+            raise ValueError('Expected , or ] in JSON array.')
+
+def iter_items(request):
+    """
+    Yields the values of a JSON array or NDJSON request body, parsed
+    incrementally from the input stream.
+    """
+    encoding = request.encoding or settings.DEFAULT_CHARSET
+    if get_content_type(request) in NDJSON_CONTENT_TYPES:
+        return iter_ndjson(_stream(request), encoding)
+    return iter_json_array(_stream(request), encoding)
@@ -0,0 +1,192 @@
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.exceptions import ImproperlyConfigured
+
+from api_boilerplate.cache import LRUCache
+from api_boilerplate.utils import import_by_path
+
+### Settings
+
+RATE_LIMIT = getattr(settings, 'API_RATE_LIMIT', None)
+
+RATE_LIMIT_BY = getattr(settings, 'API_RATE_LIMIT_BY', 'user')
+
+RATE_LIMIT_BACKEND = getattr(settings, 'API_RATE_LIMIT_BACKEND',
+    'api_boilerplate.ratelimit.MemoryBackend')
+
+RATE_LIMIT_CACHE = getattr(settings, 'API_RATE_LIMIT_CACHE', 'default')
+
+RATE_LIMIT_REDIS_URL = getattr(settings, 'API_RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+
+PERIODS = {
+    's': 1,
+    'm': 60,
+    'h': 60 * 60,
+    'd': 24 * 60 * 60,
+}
+
+### Helper functions
+
+# ``reset`` is the number of seconds until the limit is fully restored and
+# ``retry_after`` the number of seconds until the next request is allowed.
+RateLimit = collections.namedtuple('RateLimit', 'allowed limit remaining reset retry_after')
+
+def parse_rate(rate):
+    """
+    Parses a rate like ``'100/m'`` into ``(100, 60)``.
+
+    Accepted periods are ``s``, ``m``, ``h`` and ``d``.
+    """
+    try:
+        limit, period = rate.split('/')
+        return int(limit), PERIODS[period]
+    except (ValueError, KeyError):
+        raise ImproperlyConfigured("Invalid rate limit '%s'. Use e.g. '100/m'." % rate)
+
+def get_backend(path=None):
+    """
+    Returns an instance of the rate limit backend class at dotted ``path``.
+    """
+    return import_by_path(path or RATE_LIMIT_BACKEND)()
+
+### Backends
+
+class MemoryBackend(object):
+    """
+    Token bucket kept in process memory.
+
+    Fastest, but every process keeps its own buckets so the effective limit
+    is multiplied by the number of processes. Good for a single process or
+    as a first line of defence.
+    """
+    def __init__(self, max_size=10000):
+        self.buckets = LRUCache(max_size)
+        self._lock = threading.Lock()
+
+    def consume(self, key, limit, period):
+        """
+        Takes a token from the bucket ``key`` that holds ``limit`` tokens and
+        fully refills in ``period`` seconds. Returns a ``RateLimit``.
+        """
+        rate = float(limit) / period
+        now = time.time()
+
+        with self._lock:
+            tokens, timestamp = self.buckets.get(key) or (limit, now)
+            tokens = min(limit, tokens + (now - timestamp) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # An untouched bucket is full after ``period``, no need to keep it
+            self.buckets.set(key, (tokens, now), period)
+
+        return _token_bucket_result(allowed, limit, tokens, rate)
+
+class CacheBackend(object):
+    """
+    Sliding window counter in Django's cache.
+
+    Counts requests in fixed windows of ``period`` seconds and weights the
+    previous window by how much of it still overlaps the sliding window.
+    Relies on ``incr`` being atomic, which holds for memcached and most
+    shared cache backends.
+    """
+    prefix = 'api_boilerplate:ratelimit:'
+
+    def __init__(self, cache=None):
+        self.cache = cache or get_cache(RATE_LIMIT_CACHE)
+
+    def consume(self, key, limit, period):
+        now = time.time()
+        window, elapsed = divmod(now, period)
+        current_key = '%s%s:%d' % (self.prefix, key, window)
+        previous_key = '%s%s:%d' % (self.prefix, key, window - 1)
+
+        self.cache.add(current_key, 0, period * 2)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # Expired between add() and incr()
+            current = 1
+            self.cache.set(current_key, current, period * 2)
+        previous = self.cache.get(previous_key) or 0
+
+        weight = 1 - elapsed / period
+        count = previous * weight + current
+        allowed = count <= limit
+        if not allowed:
+            # Rejected requests don't use up the limit
+            self.cache.decr(current_key)
+            current -= 1
+
+        remaining = max(0, int(limit - count))
+        # The current window still counts until the end of the next one
+        reset = period - elapsed + (period if current else 0)
+        if allowed:
+            retry_after = 0
+        elif previous and current < limit:
+            # Wait until the previous window has slid out enough
+            retry_after = (1 - float(limit - current - 1) / previous) * period - elapsed
+        else:
+            retry_after = period - elapsed
+        return RateLimit(allowed, limit, remaining, reset, max(0, retry_after))
+
+class RedisBackend(object):
+    """
+    Token bucket in Redis, updated atomically by a Lua script.
+
+    Shared by all processes. Needs the ``redis`` package unless a ``client``
+    (e.g. a ``fakeredis.FakeStrictRedis`` in tests) is given.
+    """
+    prefix = 'api_boilerplate:ratelimit:'
+
+    script = """
+        local limit = tonumber(ARGV[1])
+        local period = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local rate = limit / period
+
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+        local tokens = tonumber(bucket[1]) or limit
+        local timestamp = tonumber(bucket[2]) or now
+
+        tokens = math.min(limit, tokens + math.max(0, now - timestamp) * rate)
+        local allowed = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+            allowed = 1
+        end
+
+        redis.call('HMSET', KEYS[1], 'tokens', tokens, 'timestamp', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(period))
+        return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured('RedisBackend requires the redis package.')
+            client = redis.StrictRedis.from_url(RATE_LIMIT_REDIS_URL)
+        self.client = client
+        # Runs with EVALSHA, falling back to EVAL when the script isn't loaded
+        self.consume_script = client.register_script(self.script)
+
+    def consume(self, key, limit, period):
+        # Timestamps come from the web servers, keep their clocks in sync
+        allowed, tokens = self.consume_script(keys=[self.prefix + key], args=[limit, period, time.time()])
+        return _token_bucket_result(bool(allowed), limit, float(tokens), float(limit) / period)
+
+def _token_bucket_result(allowed, limit, tokens, rate):
+    return RateLimit(
+        allowed,
+        limit,
+        int(tokens),
+        (limit - tokens) / rate,
+        0 if allowed else (1 - tokens) / rate,
+    )
@@ -0,0 +1,147 @@
+import re
+
+from django.conf import settings
+from django.utils import six
+from django.utils.timezone import utc
+
+from api_boilerplate.encoders import default, dumps
+from api_boilerplate.utils import import_by_path
+
+### Settings
+
+RENDERERS = getattr(settings, 'API_RENDERERS', (
+    'api_boilerplate.renderers.JSONRenderer',
+    'api_boilerplate.renderers.MessagePackRenderer',
+    'api_boilerplate.renderers.CBORRenderer',
+))
+
+MEDIA_RANGE = re.compile(r'^\s*([^;\s]+)\s*(?:;.*?\bq\s*=\s*([\d.]+))?.*$')
+
+### Renderers
+
+class JSONRenderer(object):
+    """
+    Renders with the ``API_JSON_ENCODER`` backend. The only renderer with
+    JSONP and ``prettify`` support.
+    """
+    format = 'json'
+    media_types = ('application/json', 'text/javascript')
+    available = True
+
+    def get_media_type(self):
+        return "text/javascript" if settings.DEBUG else "application/json"
+
+    def render(self, data, indent=None):
+        return dumps(data, indent=indent)
+
+class MessagePackRenderer(object):
+    """
+    Renders MessagePack with the ``msgpack`` package.
+    """
+    format = 'msgpack'
+    media_types = ('application/msgpack', 'application/x-msgpack')
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            self.available = False
+        else:
+            self.available = True
+            self.msgpack = msgpack
+
+    def get_media_type(self):
+        return self.media_types[0]
+
+    def render(self, data, indent=None):
+        # Python 2 byte strings (URIs, ...) are text, keep them msgpack str
+        return self.msgpack.packb(data, default=default, use_bin_type=six.PY3)
+
+class CBORRenderer(object):
+    """
+    Renders CBOR with the ``cbor2`` package.
+
+    Datetimes are encoded as CBOR datetimes, naive ones (``USE_TZ = False``)
+    as UTC.
+    """
+    format = 'cbor'
+    media_types = ('application/cbor',)
+
+    def __init__(self):
+        try:
+            import cbor2
+        except ImportError:
+            self.available = False
+        else:
+            self.available = True
+            self.cbor2 = cbor2
+
+    def get_media_type(self):
+        return self.media_types[0]
+
+    def render(self, data, indent=None):
+        return self.cbor2.dumps(data, timezone=utc, default=lambda encoder, value: encoder.encode(default(value)))
+
+### Helper functions
+
+_renderers = None
+
+def get_renderers():
+    """
+    Returns instances of the installed ``API_RENDERERS``, the default first.
+    """
+    global _renderers
+    if _renderers is None:
+        renderers = [import_by_path(path)() for path in RENDERERS]
+        _renderers = [renderer for renderer in renderers if renderer.available]
+    return _renderers
+
+def parse_accept(accept):
+    """
+    Returns the media ranges of an ``Accept`` header as ``(media_range, q)``
+    sorted by preference.
+    """
+    ranges = []
+    for position, item in enumerate(accept.split(',')):
+        match = MEDIA_RANGE.match(item)
+        if match is None:
+            continue
+        try:
+            q = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+        media_range = match.group(1).lower()
+        # More specific ranges win ties
+        specificity = 0 if media_range == '*/*' else 1 if media_range.endswith('/*') else 2
+        ranges.append((media_range, q, specificity, -position))
+    ranges.sort(key=lambda item: item[1:], reverse=True)
+    return [(media_range, q) for media_range, q, specificity, position in ranges]
+
+def select_renderer(request):
+    """
+    Picks the renderer for a request.
+
+    The ``format`` parameter (e.g. ``?format=msgpack``) wins over the
+    ``Accept`` header. JSONP requests are always JSON. Anything the
+    renderers can't satisfy gets the default renderer rather than a
+    ``406``, so browsers keep getting JSON.
+    """
+    renderers = get_renderers()
+    if len(renderers) == 1 or request.GET.get('callback'):
+        return renderers[0]
+
+    requested = request.GET.get('format')
+    if requested:
+        for renderer in renderers:
+            if renderer.format == requested:
+                return renderer
+
+    accept = request.META.get('HTTP_ACCEPT')
+    if accept:
+        for media_range, q in parse_accept(accept):
+            if q <= 0:
+                continue
+            for renderer in renderers:
+                if media_range in renderer.media_types or media_range in ('*/*', renderer.media_types[0].split('/')[0] + '/*'):
+                    return renderer
+    return renderers[0]
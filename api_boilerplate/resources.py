@@ -0,0 +1,351 @@
+import re
+import types
+from calendar import timegm
+
+from django.utils import six
+
+from api_boilerplate.exceptions import ApiBadRequestException
+from api_boilerplate.serialization import PrefetchPlan
+
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+### Transforms
+
+def epoch(value):
+    """
+    Converts a ``datetime`` into a UNIX timestamp.
+    """
+    if value is None:
+        return None
+    return timegm(value.timetuple())
+
+### Fields
+
+class Field(object):
+    """
+    A resource field read from the object.
+
+    ``source`` is the attribute path on the object, e.g. ``'user.username'``
+    (``'user__username'`` works too). Defaults to the field name.
+    ``transform`` is called with the value, e.g. ``epoch``.
+    """
+    creation_counter = 0
+
+    def __init__(self, source=None, transform=None):
+        self.source = source
+        self.transform = transform
+        self.creation_counter = Field.creation_counter
+        Field.creation_counter += 1
+
+    def get_path(self, name):
+        path = (self.source or name).replace('__', '.').split('.')
+        for attr in path:
+            if not IDENTIFIER.match(attr):
+                raise ValueError("Invalid source '%s' for field '%s'." % (self.source, name))
+        return path
+
+class Method(Field):
+    """
+    A resource field computed by a method of the resource, called with the
+    object. Resources with method fields always serialize model instances.
+    """
+    def __init__(self, method=None):
+        super(Method, self).__init__()
+        self.method = method
+
+class Nested(Field):
+    """
+    A related object serialized with another ``Resource``.
+    """
+    def __init__(self, resource, source=None):
+        super(Nested, self).__init__(source)
+        self.resource = resource
+
+### Compiler
+
+class _Compiler(object):
+    """
+    Generates the source of the per-row functions of a resource.
+
+    Helpers (transforms, nested serializers) end up in ``namespace`` and are
+    referenced by generated names, attribute walks and tuple indexes are
+    inlined.
+    """
+    def __init__(self):
+        self.namespace = {}
+        self.columns = []
+        self.relations = set()
+        self.only = set()
+        self.values = True
+
+    def _helper(self, value):
+        name = '_h%d' % len(self.namespace)
+        self.namespace[name] = value
+        return name
+
+    def _transform(self, field, expression):
+        if field.transform is None:
+            return expression
+        return '%s(%s)' % (self._helper(field.transform), expression)
+
+    def object_expression(self, fields, target):
+        items = []
+        for name, field in fields:
+            if isinstance(field, Method):
+                expression = 'self.%s(%s)' % (field.method or 'get_%s' % name, target)
+                self.values = False
+            elif isinstance(field, Nested):
+                nested = self._helper(field.resource().serialize)
+                path = field.get_path(name)
+                expression = '%s(%s)' % (nested, '.'.join([target] + path))
+                self.relations.add('__'.join(path))
+                for relation in field.resource.prefetch_plan.select_related:
+                    self.relations.add('__'.join(path + [relation]))
+                for column in field.resource.prefetch_plan.only:
+                    self.only.add('__'.join(path + [column]))
+            else:
+                path = field.get_path(name)
+                expression = self._transform(field, '.'.join([target] + path))
+                if len(path) > 1:
+                    self.relations.add('__'.join(path[:-1]))
+                self.only.add('__'.join(path))
+            items.append('%r: %s' % (name, expression))
+        return '{%s}' % ', '.join(items)
+
+    def row_expression(self, fields, prefix=()):
+        items = []
+        for name, field in fields:
+            path = list(prefix) + field.get_path(name)
+            if isinstance(field, Nested):
+                expression = self.row_expression(field.resource.fields, path)
+            elif isinstance(field, Method):
+                self.values = False
+                return None
+            else:
+                column = '__'.join(path)
+                if column not in self.columns:
+                    self.columns.append(column)
+                expression = self._transform(field, 'row[%d]' % self.columns.index(column))
+            items.append('%r: %s' % (name, expression))
+        return '{%s}' % ', '.join(items)
+
+    def compile(self, fields):
+        source = 'def serialize_object(self, obj):\n    return %s\n' % self.object_expression(fields, 'obj')
+        row = self.row_expression(fields)
+        if self.values:
+            source += 'def serialize_row(self, row):\n    return %s\n' % row
+        else:
+            # Methods may read anything
+            self.columns = None
+            self.only = set()
+        exec(compile(source, '<resource>', 'exec'), self.namespace)
+        return self.namespace
+
+def _compile(fields):
+    """
+    Returns the compiled serializers, ``values_list()`` columns and prefetch
+    plan for ``fields``.
+    """
+    compiler = _Compiler()
+    namespace = compiler.compile(fields)
+    return {
+        'serialize_object': namespace['serialize_object'],
+        'serialize_row': namespace.get('serialize_row'),
+        'columns': compiler.columns and tuple(compiler.columns),
+        'prefetch_plan': PrefetchPlan(
+            select_related=sorted(compiler.relations),
+            only=sorted(compiler.only | compiler.relations if compiler.only else ()),
+        ),
+    }
+
+# Resolved field names by model and attribute paths
+_resolved = {}
+
+def _field_names(model, paths):
+    """
+    Maps attribute ``paths`` to the field names ``only()`` and
+    ``values_list()`` take, e.g. ``user_id`` to ``user`` and ``pk`` to
+    ``id``. Returns ``None`` if a path isn't made of concrete fields, e.g.
+    reads a property.
+    """
+    key = (model, paths)
+    if key not in _resolved:
+        names = []
+        for path in paths:
+            current = model
+            parts = path.split('__')
+            for part in parts[:-1]:
+                field = _get_field(current, part)
+                if field is None or field.rel is None:
+                    names = None
+                    break
+                current = field.rel.to
+            else:
+                field = _get_field(current, parts[-1])
+                if field is not None:
+                    names.append('__'.join(parts[:-1] + [field.name]))
+                    continue
+            names = None
+            break
+        _resolved[key] = names and tuple(names)
+    return _resolved[key]
+
+def _get_field(model, name):
+    if name == 'pk':
+        return model._meta.pk
+    for field in model._meta.fields:
+        if name in (field.name, field.attname):
+            return field
+    return None
+
+def _split(value):
+    if not value:
+        return []
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+### Resources
+
+class ResourceMetaclass(type):
+    """
+    Collects the declared fields and compiles the serializers once, at class
+    creation.
+    """
+    def __new__(mcs, name, bases, attrs):
+        fields = []
+        for base in bases:
+            fields.extend(getattr(base, 'fields', ()))
+        declared = [(key, value) for key, value in attrs.items() if isinstance(value, Field)]
+        declared.sort(key=lambda item: item[1].creation_counter)
+        for key, value in declared:
+            attrs.pop(key)
+            fields = [(other, field) for other, field in fields if other != key]
+            fields.append((key, value))
+        attrs['fields'] = tuple(fields)
+
+        expandable = attrs.get('expandable')
+        if expandable is None:
+            expandable = next((base.expandable for base in bases if hasattr(base, 'expandable')), ())
+        attrs.update(_compile([(key, field) for key, field in fields if key not in expandable]))
+        # Compiled field subsets, keyed by field names
+        attrs['_subsets'] = {}
+        return super(ResourceMetaclass, mcs).__new__(mcs, name, bases, attrs)
+
+class Resource(six.with_metaclass(ResourceMetaclass, object)):
+    """
+    Declarative serializer for API resources.
+
+        class UserProfileResource(Resource):
+            username = Field('user.username')
+            joined_at = Field('user.date_joined', transform=epoch)
+            resource_uri = Method()
+
+            def get_resource_uri(self, profile):
+                return '/api/users/%s/' % profile.user_id
+
+    Fields are compiled into a single function at class creation, so
+    serializing a row is one function call building a dict. Querysets are
+    read with ``values_list()`` when no ``Method`` fields are declared,
+    which skips model instantiation altogether. Otherwise the relations the
+    fields walk are fetched with ``select_related``.
+
+    Fields named in ``expandable`` are left out unless requested with
+    ``expand``. ``for_request()`` narrows a resource to the ``fields`` and
+    ``expand`` request parameters.
+    """
+    expandable = ()
+
+    def subset(self, fields=None, expand=()):
+        """
+        Returns a copy of the resource serializing only ``fields`` (defaults
+        to all fields but the expandable ones) plus the ``expand`` fields.
+
+        Raises ``ApiBadRequestException`` for unknown field names.
+        """
+        available = [name for name, field in self.fields]
+        for name in list(fields or ()) + list(expand):
+            if name not in available:
+                raise ApiBadRequestException("Invalid field '%s' requested. Available fields: %s." % (name, ', '.join(available)))
+        for name in expand:
+            if name not in self.expandable:
+                raise ApiBadRequestException("Field '%s' can't be expanded. Expandable fields: %s." % (name, ', '.join(self.expandable) or 'none'))
+
+        if fields is None:
+            fields = [name for name in available if name not in self.expandable]
+        names = tuple(name for name in available if name in fields or name in expand)
+
+        compiled = self._subsets.get(names)
+        if compiled is None:
+            compiled = _compile([(name, field) for name, field in self.fields if name in names])
+            self._subsets[names] = compiled
+
+        resource = self.__class__.__new__(self.__class__)
+        resource.__dict__.update(self.__dict__)
+        resource.__dict__.update(compiled)
+        resource.serialize_object = types.MethodType(compiled['serialize_object'], resource)
+        if compiled['serialize_row'] is not None:
+            resource.serialize_row = types.MethodType(compiled['serialize_row'], resource)
+        return resource
+
+    def for_request(self, request_data, expand=()):
+        """
+        Returns a subset of the resource for the comma separated ``fields``
+        and ``expand`` parameters in ``request_data``, e.g. ``request.GET``.
+
+        ``expand`` lists fields to expand regardless of the request.
+        """
+        fields = _split(request_data.get('fields')) or None
+        expand = list(expand) + [name for name in _split(request_data.get('expand')) if name not in expand]
+        if fields is None and not expand:
+            return self
+        return self.subset(fields, expand)
+    def serialize(self, obj):
+        """
+        Returns the API representation of a single object.
+        """
+        if obj is None:
+            return None
+        return self.serialize_object(obj)
+
+    def prepare(self, objects, only=()):
+        """
+        Applies the prefetch plan for serializing model instances. Only the
+        columns the fields read are loaded, plus the ``only`` fields.
+        """
+        if hasattr(objects, 'select_related') and objects._result_cache is None:
+            plan = self.prefetch_plan
+            if plan.select_related:
+                objects = objects.select_related(*plan.select_related)
+            names = plan.only and _field_names(objects.model, plan.only + tuple(only))
+            if names:
+                objects = objects.only(*names)
+        return objects
+
+    def iterate(self, objects, chunked=False):
+        """
+        Serializes ``objects`` one by one.
+
+        Querysets are read with ``values_list()`` when possible. With
+        ``chunked`` they are read with ``iterator()`` to keep memory flat.
+        Querysets that were already evaluated are serialized from their
+        result cache.
+        """
+        if hasattr(objects, 'values_list') and objects._result_cache is None:
+            columns = self.columns and _field_names(objects.model, self.columns)
+            if columns:
+                rows = objects.values_list(*columns)
+                rows = rows.iterator() if chunked else rows
+                serialize_row = self.serialize_row
+                return (serialize_row(row) for row in rows)
+
+            objects = self.prepare(objects)
+            if chunked and not objects._prefetch_related_lookups:
+                objects = objects.iterator()
+
+        serialize_object = self.serialize_object
+        return (serialize_object(obj) for obj in objects)
+
+    def serialize_many(self, objects):
+        """
+        Returns the API representations of ``objects`` as a list.
+        """
+        return list(self.iterate(objects))
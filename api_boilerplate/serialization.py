@@ -0,0 +1,112 @@
+import logging
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from api_boilerplate.exceptions import ApiQueryCountException
+
+logger = logging.getLogger('api_boilerplate.serialization')
+
+### Settings
+
+ASSERT_QUERY_COUNT = getattr(settings, 'API_ASSERT_QUERY_COUNT', settings.DEBUG)
+
+### Prefetch plans
+
+class PrefetchPlan(object):
+    """
+    Relations and fields a serializer method reads.
+
+    Applied to list querysets so serializing a page costs a constant number
+    of queries instead of one (or more) per row.
+    """
+    def __init__(self, select_related=(), prefetch_related=(), only=()):
+        self.select_related = tuple(select_related)
+        self.prefetch_related = tuple(prefetch_related)
+        self.only = tuple(only)
+
+    def apply(self, objects):
+        if self.select_related:
+            objects = objects.select_related(*self.select_related)
+        if self.prefetch_related:
+            objects = objects.prefetch_related(*self.prefetch_related)
+        if self.only:
+            objects = objects.only(*self.only)
+        return objects
+
+def prefetch(select_related=(), prefetch_related=(), only=()):
+    """
+    Decorator to declare the prefetch plan of a serializer method, e.g. ``api()``.
+
+        @prefetch(select_related=('user',))
+        def api(self):
+            return {'username': self.user.username}
+    """
+    def _dec(function):
+        function.prefetch_plan = PrefetchPlan(select_related, prefetch_related, only)
+        return function
+    return _dec
+
+def apply_prefetch(objects, method='api'):
+    """
+    Applies the plan declared on the ``method`` of the queryset's model.
+
+    Anything that isn't a queryset, or a model without a plan, is returned as is.
+    """
+    model = getattr(objects, 'model', None)
+    plan = getattr(getattr(model, method, None), 'prefetch_plan', None)
+    if plan is None or not hasattr(objects, 'select_related'):
+        return objects
+    return plan.apply(objects)
+
+def serialize(objects, method='api', **kwargs):
+    """
+    Returns a list of ``obj.<method>(**kwargs)`` with the prefetch plan applied.
+    """
+    objects = apply_prefetch(objects, method)
+    counter = QueryCounter(getattr(objects, 'db', DEFAULT_DB_ALIAS))
+    data = [counter.call(getattr(obj, method), **kwargs) for obj in objects]
+    counter.check()
+    return data
+
+### Query count assertions
+
+class QueryCounter(object):
+    """
+    Detects N+1 queries while serializing a list.
+
+    Counts the queries made inside the serializer calls. Serializing more
+    than one object with at least one query per object means the query count
+    grows with the page size, which raises ``ApiQueryCountException``.
+
+    Active with ``API_ASSERT_QUERY_COUNT`` (defaults to ``DEBUG``) when the
+    connection records queries.
+    """
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.connection = connections[using]
+        self.enabled = ASSERT_QUERY_COUNT and (settings.DEBUG or self.connection.use_debug_cursor)
+        self.objects = 0
+        self.queries = 0
+
+    def call(self, serializer, *args, **kwargs):
+        if not self.enabled:
+            return serializer(*args, **kwargs)
+
+        start = len(self.connection.queries)
+        data = serializer(*args, **kwargs)
+        self.queries += len(self.connection.queries) - start
+        self.objects += 1
+        return data
+
+    def check(self, log=False):
+        """
+        Raises ``ApiQueryCountException`` on N+1 queries, or logs a warning
+        with ``log``, e.g. once a streaming response's status was sent.
+        """
+        if self.enabled and self.objects > 1 and self.queries >= self.objects:
+            message = ('%d queries for serializing %d objects. '
+                'Declare the relations the serializer reads with @prefetch.' % (self.queries, self.objects))
+            if log:
+                logger.warning(message)
+                return
+            raise ApiQueryCountException(message)
@@ -0,0 +1,233 @@
+import json
+import time
+
+from django.conf.urls import patterns, url
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils.decorators import method_decorator
+from django.utils.six import StringIO
+
+from api_boilerplate import tokens
+from api_boilerplate.authentication import ApiKeyAuthenticator, _get_api_key
+from api_boilerplate.cache import api_key_cache
+from api_boilerplate.decorators import scope_required
+from api_boilerplate.exceptions import ApiUnauthorizedException
+from api_boilerplate.http import ApiView, JSONResponse
+from api_boilerplate.models import ApiKey, hash_secret
+
+
+class ScopedView(ApiView):
+    @method_decorator(scope_required('write'))
+    def get(self, request, *args, **kwargs):
+        return JSONResponse(request, {'user': request.user.pk})
+
+urlpatterns = patterns('',
+    url(r'^api/token/$', tokens.ApiTokenView.as_view()),
+    url(r'^api/scoped/$', ScopedView.as_view()),
+)
+
+MIDDLEWARE_CLASSES = (
+    'django.middleware.common.CommonMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api_boilerplate.middleware.ApiAuthenticationMiddleware',
+    'api_boilerplate.middleware.ApiRequestDataMiddleware',
+)
+
+
+def _signed(payload):
+    """
+    Returns a token for ``payload`` signed with the real key, e.g. an
+    expired one.
+    """
+    encoded = tokens._encode(json.dumps(payload).encode('utf-8'))
+    return '%s.%s' % (encoded, tokens._sign(encoded))
+
+
+class TokenTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        tokens.deny_list.cache.delete(tokens.DENY_LIST_KEY)
+        tokens.deny_list.load()
+
+    def payload(self, **kwargs):
+        now = int(time.time())
+        payload = {'uid': self.user.pk, 'scp': None, 'iat': now, 'exp': now + 60, 'jti': 'a' * 32}
+        payload.update(kwargs)
+        return payload
+
+    def assertRejected(self, token, message):
+        tokens.deny_list.loaded = 0
+        with self.assertRaises(ApiUnauthorizedException) as cm:
+            tokens.verify_token(token)
+        self.assertEqual(str(cm.exception), message)
+
+    def test_valid(self):
+        token, payload = tokens.issue_token(self.user, ['read'])
+        self.assertEqual(tokens.verify_token(token), payload)
+        self.assertEqual(payload['scp'], ['read'])
+
+    def test_tampered_payload(self):
+        token, payload = tokens.issue_token(self.user, ['read'])
+        signature = token.split('.')[1]
+        other = tokens._encode(json.dumps(dict(payload, scp=None)).encode('utf-8'))
+        self.assertRejected('%s.%s' % (other, signature), 'Invalid token.')
+
+    def test_tampered_signature(self):
+        token, payload = tokens.issue_token(self.user)
+        self.assertRejected(token[:-2] + ('AA' if not token.endswith('AA') else 'BB'), 'Invalid token.')
+        self.assertRejected(token.split('.')[0], 'Invalid token.')
+
+    def test_expired(self):
+        now = int(time.time())
+        self.assertRejected(_signed(self.payload(iat=now - 120, exp=now - 60)), 'Token has expired.')
+
+    def test_lifetime(self):
+        with self.assertRaises(ValueError):
+            tokens.issue_token(self.user, lifetime=tokens.TOKEN_MAX_LIFETIME + 1)
+
+    def test_revoked(self):
+        token, payload = tokens.issue_token(self.user)
+        other, _ = tokens.issue_token(self.user)
+        tokens.revoke_token(payload)
+        self.assertRejected(token, 'Token has been revoked.')
+        self.assertEqual(tokens.verify_token(other)['uid'], self.user.pk)
+
+    def test_revoked_user(self):
+        token = _signed(self.payload(iat=int(time.time()) - 10))
+        tokens.revoke_user_tokens(self.user)
+        self.assertRejected(token, 'Token has been revoked.')
+        # Tokens issued afterwards are valid
+        later = _signed(self.payload(iat=int(time.time()) + 1, jti='b' * 32))
+        self.assertEqual(tokens.verify_token(later)['jti'], 'b' * 32)
+
+    def test_revoked_on_password_change(self):
+        token = _signed(self.payload(iat=int(time.time()) - 10))
+        self.user.first_name = 'Alice'
+        self.user.save()
+        self.assertEqual(tokens.verify_token(token)['uid'], self.user.pk)
+        self.user.set_password('other')
+        self.user.save()
+        self.assertRejected(token, 'Token has been revoked.')
+
+    def test_revoked_on_deactivation(self):
+        token = _signed(self.payload(iat=int(time.time()) - 10))
+        self.user.is_active = False
+        self.user.save()
+        self.assertRejected(token, 'Token has been revoked.')
+
+    def test_revoked_with_api_key(self):
+        api_key = ApiKey.objects.create(user=self.user)
+        token = _signed(self.payload(iat=int(time.time()) - 10, kid=api_key.pk))
+        other = _signed(self.payload(iat=int(time.time()) - 10, jti='b' * 32))
+        api_key.delete()
+        self.assertRejected(token, 'Token has been revoked.')
+        self.assertEqual(tokens.verify_token(other)['jti'], 'b' * 32)
+
+
+class ApiKeyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        api_key_cache.invalidate(self.user.pk)
+
+    def test_hashed(self):
+        api_key = ApiKey.objects.create(user=self.user)
+        prefix, secret = api_key.raw_key.split('.')
+        stored = ApiKey.objects.get(pk=api_key.pk)
+        self.assertEqual((stored.prefix, stored.key_hash, stored.key), (prefix, hash_secret(secret), ''))
+        self.assertEqual(_get_api_key('alice', api_key.raw_key), stored)
+        wrong = secret[:-1] + ('x' if secret[-1] != 'x' else 'y')
+        self.assertEqual(_get_api_key('alice', '%s.%s' % (prefix, wrong)), None)
+        self.assertEqual(_get_api_key('bob', api_key.raw_key), None)
+
+    def test_legacy(self):
+        api_key = ApiKey.objects.create(user=self.user, key='0123456789abcdef0123456789abcdef')
+        self.assertEqual((api_key.prefix, api_key.key_hash), ('', ''))
+        self.assertEqual(_get_api_key('alice', '0123456789abcdef0123456789abcdef'), api_key)
+        self.assertEqual(_get_api_key('alice', '0123456789abcdef0123456789abcdee'), None)
+
+    def test_scopes(self):
+        self.assertEqual(ApiKey.objects.create(user=self.user).get_scopes(), None)
+        self.assertEqual(ApiKey.objects.create(user=self.user, scopes='read write').get_scopes(), frozenset(['read', 'write']))
+
+
+class HashApiKeysTests(TransactionTestCase):
+    """
+    The command's table introspection commits on SQLite.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+
+    def test_hash_api_keys(self):
+        api_key = ApiKey.objects.create(user=self.user, key='0123456789abcdef0123456789abcdef')
+        call_command('hash_api_keys', stdout=StringIO())
+        stored = ApiKey.objects.get(pk=api_key.pk)
+        self.assertEqual((stored.prefix, stored.key), ('01234567', ''))
+        self.assertEqual(stored.key_hash, hash_secret('89abcdef0123456789abcdef'))
+        # Clients keep using the same key
+        self.assertEqual(_get_api_key('alice', '0123456789abcdef0123456789abcdef'), stored)
+        self.assertEqual(_get_api_key('alice', '0123456789abcdef0123456789abcdee'), None)
+
+
+@override_settings(MIDDLEWARE_CLASSES=MIDDLEWARE_CLASSES)
+class ApiTokenViewTests(TestCase):
+    urls = 'api_boilerplate.tests'
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        api_key_cache.invalidate(self.user.pk)
+        tokens.deny_list.cache.delete(tokens.DENY_LIST_KEY)
+        tokens.deny_list.load()
+
+    def headers(self, scopes=''):
+        authenticator = ApiKeyAuthenticator()
+        api_key = ApiKey.objects.create(user=self.user, scopes=scopes)
+        return {authenticator.username_header: 'alice', authenticator.api_key_header: api_key.raw_key}
+
+    def get_token(self, data, **headers):
+        return self.client.post('/api/token/', json.dumps(data), content_type='application/json', **headers)
+
+    def get_scoped(self, token):
+        return self.client.get('/api/scoped/', HTTP_AUTHORIZATION='Bearer %s' % token)
+
+    def test_unrestricted_key(self):
+        response = self.get_token({}, **self.headers())
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['scopes'], None)
+        self.assertEqual(self.get_scoped(data['token']).status_code, 200)
+
+    def test_requested_scopes(self):
+        headers = self.headers()
+        data = json.loads(self.get_token({'scopes': ['read']}, **headers).content.decode('utf-8'))
+        self.assertEqual(data['scopes'], ['read'])
+        self.assertEqual(self.get_scoped(data['token']).status_code, 403)
+
+        data = json.loads(self.get_token({'scopes': []}, **headers).content.decode('utf-8'))
+        self.assertEqual(data['scopes'], [])
+        self.assertEqual(self.get_scoped(data['token']).status_code, 403)
+
+    def test_restricted_key(self):
+        headers = self.headers('read')
+        data = json.loads(self.get_token({}, **headers).content.decode('utf-8'))
+        self.assertEqual(data['scopes'], ['read'])
+        self.assertEqual(self.get_token({'scopes': ['read']}, **headers).status_code, 200)
+        self.assertEqual(self.get_token({'scopes': ['read', 'write']}, **headers).status_code, 400)
+
+    def test_token_for_token(self):
+        data = json.loads(self.get_token({}, **self.headers()).content.decode('utf-8'))
+        response = self.get_token({}, HTTP_AUTHORIZATION='Bearer %s' % data['token'])
+        self.assertEqual(response.status_code, 401)
+
+    def test_invalid_tokens(self):
+        data = json.loads(self.get_token({}, **self.headers()).content.decode('utf-8'))
+        self.assertEqual(self.get_scoped(data['token'] + 'x').status_code, 401)
+        self.assertEqual(self.client.get('/api/scoped/', HTTP_AUTHORIZATION='Bearer ').status_code, 401)
+
+    def test_revoke(self):
+        data = json.loads(self.get_token({}, **self.headers()).content.decode('utf-8'))
+        response = self.client.delete('/api/token/', HTTP_AUTHORIZATION='Bearer %s' % data['token'])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_scoped(data['token']).status_code, 401)
@@ -0,0 +1,276 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import get_cache
+from django.utils.crypto import constant_time_compare
+from django.utils import six
+from django.utils.encoding import force_bytes
+from django.utils.functional import SimpleLazyObject
+from django.utils.timezone import now as tz_now
+
+from api_boilerplate.exceptions import ApiUnauthorizedException
+from api_boilerplate.http import ApiView, JSONResponse, JSONResponseBadRequest, JSONResponseNoContent, JSONResponseUnauthorized
+
+### Settings
+
+TOKEN_SECRET = getattr(settings, 'API_TOKEN_SECRET', settings.SECRET_KEY)
+
+TOKEN_LIFETIME = getattr(settings, 'API_TOKEN_LIFETIME', 15 * 60)
+
+# Longest lifetime ``issue_token`` accepts, revocations of all tokens of an
+# user are kept this long
+TOKEN_MAX_LIFETIME = max(getattr(settings, 'API_TOKEN_MAX_LIFETIME', 24 * 60 * 60), TOKEN_LIFETIME)
+
+# Scopes tokens may be issued for, None for any
+TOKEN_SCOPES = getattr(settings, 'API_TOKEN_SCOPES', None)
+
+TOKEN_CACHE_BACKEND = getattr(settings, 'API_TOKEN_CACHE_BACKEND', 'default')
+
+TOKEN_DENY_LIST_REFRESH = getattr(settings, 'API_TOKEN_DENY_LIST_REFRESH', 30)
+
+DENY_LIST_KEY = 'api_boilerplate:tokens:deny'
+
+DENY_LIST_LOCK_TIMEOUT = 5
+
+# Keeps token signatures apart from other uses of SECRET_KEY
+_key = hashlib.sha256(force_bytes('api_boilerplate.tokens:%s' % TOKEN_SECRET)).digest()
+
+### Helper functions
+
+def _encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _decode(data):
+    return base64.urlsafe_b64decode(force_bytes(data) + b'=' * (-len(data) % 4))
+
+def _sign(payload):
+    return _encode(hmac.new(_key, force_bytes(payload), hashlib.sha256).digest())
+
+def issue_token(user, scopes=(), lifetime=None, api_key=None):
+    """
+    Returns a signed bearer token for ``user`` and its payload.
+
+    The payload carries the user id (``uid``), ``scopes`` (``scp``, ``None``
+    for unrestricted tokens), the issue and expiry times (``iat``, ``exp``)
+    and an id for revoking the token (``jti``). Tokens exchanged for an ``api_key`` carry its id
+    (``kid``) so its usage is tracked and they're revoked with it, and
+    don't outlive it. It's signed, not encrypted, so clients can read it.
+    ``lifetime`` can't exceed ``API_TOKEN_MAX_LIFETIME``.
+    """
+    lifetime = lifetime or TOKEN_LIFETIME
+    if lifetime > TOKEN_MAX_LIFETIME:
+        raise ValueError('Token lifetime is limited to %d seconds by API_TOKEN_MAX_LIFETIME.' % TOKEN_MAX_LIFETIME)
+    if api_key is not None and api_key.expires is not None:
+        lifetime = min(lifetime, int((api_key.expires - tz_now()).total_seconds()))
+    now = int(time.time())
+    payload = {
+        'uid': user.pk,
+        'scp': sorted(scopes) if scopes is not None else None,
+        'iat': now,
+        'exp': now + lifetime,
+        'jti': uuid.uuid4().hex,
+    }
+    if api_key is not None:
+        payload['kid'] = api_key.pk
+    encoded = _encode(force_bytes(json.dumps(payload, separators=(',', ':'), sort_keys=True)))
+    return '%s.%s' % (encoded, _sign(encoded)), payload
+
+def verify_token(token):
+    """
+    Returns the payload of a valid token. Raises ``ApiUnauthorizedException``
+    for tampered, expired and revoked tokens.
+
+    Needs no queries: the signature and expiry are checked in process and
+    revocations come from ``deny_list``.
+    """
+    encoded, _, signature = token.partition('.')
+    if not signature or not constant_time_compare(signature, _sign(encoded)):
+        raise ApiUnauthorizedException('Invalid token.')
+    try:
+        payload = json.loads(_decode(encoded).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise ApiUnauthorizedException('Invalid token.')
+
+    if payload['exp'] <= time.time():
+        raise ApiUnauthorizedException('Token has expired.')
+    if deny_list.is_denied(payload):
+        raise ApiUnauthorizedException('Token has been revoked.')
+    return payload
+
+### Revocation
+
+class DenyList(object):
+    """
+    Revoked token ids and per user and per API key revocation times,
+    until the tokens they cover expire.
+
+    Kept in the cache so every process sees them, and read from there at
+    most every ``API_TOKEN_DENY_LIST_REFRESH`` seconds. Revocations take up
+    to that long to reach other processes.
+    """
+    def __init__(self, refresh=TOKEN_DENY_LIST_REFRESH):
+        self.refresh = refresh
+        self.tokens = {}
+        self.users = {}
+        self.keys = {}
+        self.loaded = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return get_cache(TOKEN_CACHE_BACKEND)
+
+    def load(self):
+        entry = self.cache.get(DENY_LIST_KEY) or {}
+        with self._lock:
+            self.tokens = entry.get('tokens', {})
+            self.users = entry.get('users', {})
+            self.keys = entry.get('keys', {})
+            self.loaded = time.time()
+
+    def is_denied(self, payload):
+        if time.time() - self.loaded >= self.refresh:
+            self.load()
+        return (payload['jti'] in self.tokens or payload['iat'] <= self.users.get(payload['uid'], -1)
+            or ('kid' in payload and payload['iat'] <= self.keys.get(payload['kid'], -1)))
+
+    def add(self, jti=None, expires=None, user_id=None, key_id=None):
+        """
+        Revokes the token ``jti`` (valid until ``expires``), or all tokens
+        issued so far to ``user_id`` or for the API key ``key_id``.
+
+        Entries are kept until the tokens they cover expire. The entry is
+        rewritten under a lock in the cache, so concurrent revocations
+        don't overwrite each other.
+        """
+        cache = self.cache
+        lock = '%s:lock' % DENY_LIST_KEY
+        started = time.time()
+        # A crashed holder's lock expires, wait at most that long
+        locked = cache.add(lock, 1, DENY_LIST_LOCK_TIMEOUT)
+        while not locked and time.time() - started < DENY_LIST_LOCK_TIMEOUT:
+            time.sleep(0.01)
+            locked = cache.add(lock, 1, DENY_LIST_LOCK_TIMEOUT)
+        try:
+            now = time.time()
+            entry = cache.get(DENY_LIST_KEY) or {}
+            # Drop entries whose tokens have expired anyway
+            tokens = dict((key, value) for key, value in entry.get('tokens', {}).items() if value > now)
+            users = dict((key, value) for key, value in entry.get('users', {}).items() if value + TOKEN_MAX_LIFETIME > now)
+            keys = dict((key, value) for key, value in entry.get('keys', {}).items() if value + TOKEN_MAX_LIFETIME > now)
+            if jti is not None:
+                tokens[jti] = expires
+            if user_id is not None:
+                users[user_id] = int(now)
+            if key_id is not None:
+                keys[key_id] = int(now)
+            revoked = list(users.values()) + list(keys.values())
+            expiry = max(list(tokens.values()) + [value + TOKEN_MAX_LIFETIME for value in revoked] + [now])
+            cache.set(DENY_LIST_KEY, {'tokens': tokens, 'users': users, 'keys': keys}, int(expiry - now) + 1)
+        finally:
+            if locked:
+                cache.delete(lock)
+        with self._lock:
+            self.tokens, self.users, self.keys, self.loaded = tokens, users, keys, now
+
+deny_list = DenyList()
+
+def revoke_token(payload):
+    deny_list.add(jti=payload['jti'], expires=payload['exp'])
+
+def revoke_user_tokens(user):
+    """
+    Revokes all tokens issued to ``user``. Called on password changes,
+    deactivation and deletion, see ``models.revoke_tokens``.
+    """
+    deny_list.add(user_id=user.pk)
+
+def revoke_api_key_tokens(api_key):
+    """
+    Revokes all tokens exchanged for ``api_key``.
+    """
+    deny_list.add(key_id=api_key.pk)
+
+### Users
+
+class TokenUser(SimpleLazyObject):
+    """
+    The user of a token, loaded on first use. Authentication checks and
+    ``pk`` don't load it, so views that only need the id make no query.
+    """
+    def __init__(self, user_id):
+        super(TokenUser, self).__init__(lambda: User.objects.get(pk=user_id))
+        self.__dict__['user_id'] = user_id
+
+    @property
+    def pk(self):
+        return self.__dict__['user_id']
+
+    id = pk
+
+    def is_authenticated(self):
+        return True
+
+    def is_anonymous(self):
+        return False
+
+### Views
+
+class ApiTokenView(ApiView):
+    """
+    Token view
+
+    ``POST`` exchanges the caller's API key (or other non-token
+    credentials) for a bearer token, optionally limited to ``scopes``:
+
+        {"scopes": ["read"]}
+
+    Without ``scopes`` the token gets the scopes of the credentials, within
+    ``API_TOKEN_SCOPES``. An empty list grants no scopes.
+
+    Tokens can't be used to get new tokens, so a leaked token expires.
+    ``DELETE`` revokes the token used for the request.
+    """
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated() or getattr(request, 'auth_token', None) is not None:
+            return JSONResponseUnauthorized(request, 'Authenticate with your API key to get a token')
+
+        data = request.data or {}
+        granted = getattr(request, 'auth_scopes', None)
+        if isinstance(data, dict) and 'scopes' not in data:
+            # Same access as the credentials
+            scopes = granted
+            if TOKEN_SCOPES is not None:
+                scopes = set(TOKEN_SCOPES) if scopes is None else scopes & set(TOKEN_SCOPES)
+        else:
+            scopes = data.get('scopes') if isinstance(data, dict) else None
+            if not isinstance(scopes, list) or not all(isinstance(scope, six.string_types) for scope in scopes):
+                return JSONResponseBadRequest(request, 'scopes should be a list of strings.')
+            if TOKEN_SCOPES is not None:
+                unknown = sorted(set(scopes) - set(TOKEN_SCOPES))
+                if unknown:
+                    return JSONResponseBadRequest(request, 'Unknown scopes: %s.' % ', '.join(unknown))
+            if granted is not None and not set(scopes) <= granted:
+                return JSONResponseBadRequest(request, 'Scopes not granted to these credentials: %s.' % ', '.join(sorted(set(scopes) - granted)))
+
+        token, payload = issue_token(request.user, scopes, api_key=getattr(request, 'api_key', None))
+        return JSONResponse(request, {
+            'token': token,
+            'token_type': 'Bearer',
+            'expires_in': payload['exp'] - payload['iat'],
+            'scopes': payload['scp'],
+        })
+
+    def delete(self, request, *args, **kwargs):
+        payload = getattr(request, 'auth_token', None)
+        if payload is None:
+            return JSONResponseUnauthorized(request, 'Authenticate with the token to revoke')
+        revoke_token(payload)
+        return JSONResponseNoContent(request, None)
@@ -0,0 +1,165 @@
+import atexit
+import datetime
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models.loading import get_model
+from django.utils.timezone import utc
+
+logger = logging.getLogger('api_boilerplate.usage')
+
+### Settings
+
+KEY_USAGE = getattr(settings, 'API_KEY_USAGE', False)
+
+KEY_USAGE_FLUSH_INTERVAL = getattr(settings, 'API_KEY_USAGE_FLUSH_INTERVAL', 60)
+
+KEY_USAGE_BATCH_SIZE = 500
+
+API_KEY_MODEL = getattr(settings, 'API_KEY_MODEL', 'api_boilerplate.models.ApiKey')
+
+### Tracker
+
+def _to_datetime(timestamp):
+    if settings.USE_TZ:
+        return datetime.datetime.fromtimestamp(timestamp, utc)
+    return datetime.datetime.fromtimestamp(timestamp)
+
+class UsageTracker(object):
+    """
+    Counts API key uses in memory and writes them to ``last_used`` and
+    ``request_count`` in bulk.
+
+    Recording a use is a dict update, no query. A daemon thread flushes
+    the counts every ``interval`` seconds with one ``UPDATE`` per
+    ``KEY_USAGE_BATCH_SIZE`` keys, so a process that dies loses at most
+    that many seconds of usage. Pending counts are also flushed when the
+    interpreter exits normally.
+    """
+    def __init__(self, interval=KEY_USAGE_FLUSH_INTERVAL):
+        self.interval = interval
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def record(self, pk):
+        with self.lock:
+            if self.pid != os.getpid():
+                # Forked workers don't inherit threads, and their parent's
+                # counts aren't theirs
+                self.pid = os.getpid()
+                self.pending = {}
+                self.thread = None
+            entry = self.pending.get(pk)
+            if entry is None:
+                self.pending[pk] = [1, time.time()]
+            else:
+                entry[0] += 1
+                entry[1] = time.time()
+            if self.thread is None and self.interval:
+                self.start()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='api-key-usage')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing API key usage failed')
+            finally:
+                for connection in connections.all():
+                    connection.close()
+
+    def flush(self):
+        """
+        Writes the pending counts and returns how many keys were updated.
+        Counts that fail to write are kept for the next flush.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+
+        model = get_model(API_KEY_MODEL.split('.')[0], API_KEY_MODEL.split('.')[-1])
+        items = sorted(pending.items())
+        for start in range(0, len(items), KEY_USAGE_BATCH_SIZE):
+            try:
+                _update(model, items[start:start + KEY_USAGE_BATCH_SIZE])
+            except DatabaseError:
+                self._restore(items[start:])
+                raise
+        return len(items)
+
+    def _restore(self, items):
+        with self.lock:
+            for pk, (count, last_used) in items:
+                entry = self.pending.setdefault(pk, [0, last_used])
+                entry[0] += count
+                entry[1] = max(entry[1], last_used)
+
+def _update(model, items):
+    """
+    Adds the counts and sets ``last_used`` of a batch of keys in one query.
+    """
+    using = router.db_for_write(model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    pk_column = qn(opts.pk.column)
+    count_column = qn(opts.get_field('request_count').column)
+    last_used_field = opts.get_field('last_used')
+    last_used_column = qn(last_used_field.column)
+    # PostgreSQL types the CASE result as text. SQLite would turn the
+    # value into a number when cast to its datetime type.
+    if connection.vendor == 'postgresql':
+        last_used_sql = 'WHEN %%s THEN CAST(%%s AS %s)' % last_used_field.db_type(connection)
+    else:
+        last_used_sql = 'WHEN %s THEN %s'
+
+    counts, last_used, params_count, params_last_used = [], [], [], []
+    for pk, (count, timestamp) in items:
+        counts.append('WHEN %s THEN %s')
+        params_count.extend((pk, count))
+        last_used.append(last_used_sql)
+        params_last_used.extend((pk, connection.ops.value_to_db_datetime(_to_datetime(timestamp))))
+
+    sql = 'UPDATE %s SET %s = %s + CASE %s %s END, %s = CASE %s %s END WHERE %s IN (%s)' % (
+        qn(opts.db_table),
+        count_column, count_column, pk_column, ' '.join(counts),
+        last_used_column, pk_column, ' '.join(last_used),
+        pk_column, ', '.join(['%s'] * len(items)),
+    )
+    connection.cursor().execute(sql, params_count + params_last_used + [pk for pk, entry in items])
+    transaction.commit_unless_managed(using=using)
+
+tracker = UsageTracker()
+
+def record(api_key):
+    if KEY_USAGE:
+        tracker.record(api_key.pk)
+
+def record_id(pk):
+    """
+    Records a use of the key with primary key ``pk``, e.g. through a token
+    issued for it.
+    """
+    if KEY_USAGE:
+        tracker.record(pk)
+
+@atexit.register
+def _flush_at_exit():
+    if KEY_USAGE and tracker.pid == os.getpid():
+        try:
+            tracker.flush()
+        except Exception:
+            logger.exception('Flushing API key usage failed')
@@ -0,0 +1,23 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+
+def import_by_path(dotted_path):
+    """
+    Imports and returns the attribute at ``dotted_path``, e.g.
+    ``'api_boilerplate.ratelimit.MemoryBackend'``. Raises
+    ``ImproperlyConfigured`` when it can't be imported.
+
+    ``django.utils.module_loading.import_by_path`` needs Django 1.6.
+    """
+    try:
+        module_path, name = dotted_path.rsplit('.', 1)
+    except ValueError:
+        raise ImproperlyConfigured("'%s' isn't a dotted path." % dotted_path)
+    try:
+        module = import_module(module_path)
+    except ImportError as e:
+        raise ImproperlyConfigured("Error importing module '%s': %s" % (module_path, e))
+    try:
+        return getattr(module, name)
+    except AttributeError:
+        raise ImproperlyConfigured("Module '%s' doesn't define '%s'." % (module_path, name))
@@ -0,0 +1,45 @@
+"""
+Measures HTTP Basic auth requests/second with and without the verified
+credential cache (``API_BASIC_AUTH_CACHE``).
+
+Usage:
+
+    python benchmarks/basic_auth.py [--number 50]
+"""
+import argparse
+import base64
+
+from utils import setup_example, per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_example(DEBUG=False)
+
+    from django.contrib.auth.models import User
+    from django.test.client import Client
+
+    from api_boilerplate import authentication
+    from api_boilerplate.cache import basic_auth_cache
+
+    User.objects.create_user('bench', 'bench@example.com', 'secret')
+    client = Client()
+    authorization = 'Basic %s' % base64.b64encode(b'bench:secret').decode('ascii')
+
+    def request():
+        response = client.get('/api/echo/', HTTP_AUTHORIZATION=authorization)
+        assert response.status_code == 200
+
+    print('%-10s %12s %10s' % ('cache', 'requests/s', 'hit ratio'))
+    for enabled in (False, True):
+        authentication.BASIC_AUTH_CACHE = enabled
+        rate = per_second(request, args.number)
+        ratio = basic_auth_cache.stats()['hit_ratio'] if enabled else 0.0
+        print('%-10s %12.1f %10.3f' % (enabled and 'on' or 'off', rate, ratio))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Measures created objects/second through ``ApiBulkView``: one object per
+request against one request for all of them.
+
+Usage:
+
+    python benchmarks/bulk.py [--items 1000]
+"""
+import argparse
+import json
+import time
+
+from utils import setup_example
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_example(DEBUG=False)
+
+    from django.contrib.auth.models import User
+    from django.test.client import Client
+
+    User.objects.create_superuser('bench', 'bench@example.com', 'secret')
+    client = Client()
+    client.login(username='bench', password='secret')
+
+    def create(prefix, per_request):
+        items = [{'username': '%s%d' % (prefix, i), 'email': '%s%d@example.com' % (prefix, i)} for i in range(args.items)]
+        start = time.time()
+        for offset in range(0, len(items), per_request):
+            response = client.post('/api/users/bulk/', json.dumps(items[offset:offset + per_request]),
+                content_type='application/json')
+            assert response.status_code == 200, response.content
+        return args.items / (time.time() - start)
+
+    print('%-20s %12s %10s' % ('items per request', 'objects/s', 'speedup'))
+    baseline = None
+    for prefix, per_request in (('single', 1), ('bulk', args.items)):
+        rate = create(prefix, per_request)
+        baseline = baseline or rate
+        print('%-20d %12.0f %9.1fx' % (per_request, rate, rate / baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Compares the response formats on a ``UsersView`` shaped payload: payload
+size (plain and gzipped) and encode/decode time.
+
+Usage:
+
+    python benchmarks/formats.py [--objects 200] [--number 500]
+
+Formats whose packages aren't installed are skipped.
+"""
+import argparse
+import timeit
+import zlib
+
+# Configures the default settings
+from json_encoders import users_payload
+
+from api_boilerplate import parsers, renderers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--objects', type=int, default=200)
+    parser.add_argument('--number', type=int, default=500)
+    args = parser.parse_args()
+
+    payload = users_payload(args.objects)
+    print('%-10s %10s %10s %14s %14s' % ('format', 'bytes', 'gzipped', 'encode usec', 'decode usec'))
+    for renderer in renderers.get_renderers():
+        body_parser = parsers.get_parser(renderer.media_types[0])
+        content = renderer.render(payload)
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+
+        encode = min(timeit.Timer(lambda: renderer.render(payload)).repeat(repeat=3, number=args.number))
+        decode = min(timeit.Timer(lambda: body_parser.parse(content, 'utf-8')).repeat(repeat=3, number=args.number))
+        print('%-10s %10d %10d %14.1f %14.1f' % (renderer.format, len(content), len(zlib.compress(content, 6)),
+            encode / args.number * 1e6, decode / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Compares the JSON encoder backends on a ``UsersView`` shaped payload.
+
+Usage:
+
+    python benchmarks/json_encoders.py [--objects 200] [--number 500]
+
+Backends that aren't installed are skipped.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from django.conf import settings
+settings.configure()
+
+from django.core.exceptions import ImproperlyConfigured
+
+from api_boilerplate import encoders
+
+
+def users_payload(count):
+    """
+    Returns a payload like ``UsersView.get`` renders for ``limit=count``.
+    """
+    return {
+        'meta': {
+            'limit': count,
+            'offset': 0,
+            'total_count': count * 10,
+            'previous': None,
+            'next': '/api/users/?limit=%d&offset=%d' % (count, count),
+        },
+        'objects': [{
+            'username': 'user%d' % i,
+            'is_admin': i % 10 == 0,
+            'joined_at': 1360000000 + i,
+            'resource_uri': '/api/users/%d/' % i,
+        } for i in range(count)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--objects', type=int, default=200)
+    parser.add_argument('--number', type=int, default=500)
+    args = parser.parse_args()
+
+    payload = users_payload(args.objects)
+    print('%-12s %-10s %12s %10s' % ('backend', 'indent', 'usec/call', 'bytes'))
+    for name, loader in encoders.BACKENDS:
+        try:
+            dumps = encoders.get_backend(name)
+        except ImproperlyConfigured:
+            print('%-12s not installed' % name)
+            continue
+
+        for indent in (None, 2):
+            timer = timeit.Timer(lambda: dumps(payload, indent=indent))
+            best = min(timer.repeat(repeat=3, number=args.number)) / args.number
+            size = len(dumps(payload, indent=indent))
+            print('%-12s %-10s %12.1f %10d' % (name, indent, best * 1e6, size))
+
+
+if __name__ == '__main__':
+    main()
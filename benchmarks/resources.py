@@ -0,0 +1,52 @@
+"""
+Compares serializing user profiles with the hand written ``api()`` method
+and with a compiled ``Resource``, from model instances and from
+``values_list()`` rows.
+
+Usage:
+
+    python benchmarks/resources.py [--rows 10000] [--number 3]
+"""
+import argparse
+import timeit
+
+from utils import setup_example
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--number', type=int, default=3)
+    args = parser.parse_args()
+
+    setup_example(DEBUG=False)
+
+    from django.contrib.auth.models import User
+
+    from example.accounts.models import UserProfile
+    from example.api.resources import UserProfileResource
+
+    User.objects.bulk_create([
+        User(username='user%d' % i, email='user%d@example.com' % i) for i in range(args.rows)
+    ])
+    UserProfile.objects.bulk_create([UserProfile(user_id=pk) for pk in User.objects.values_list('pk', flat=True)])
+
+    resource = UserProfileResource()
+    profiles = UserProfile.objects.all()
+    candidates = (
+        ('api()', lambda: [profile.api() for profile in profiles.select_related('user')]),
+        ('Resource, objects', lambda: [resource.serialize(profile) for profile in resource.prepare(profiles)]),
+        ('Resource, values', lambda: resource.serialize_many(profiles)),
+    )
+
+    print('%-20s %12s %10s' % ('serializer', 'rows/s', 'speedup'))
+    baseline = None
+    for name, func in candidates:
+        best = min(timeit.Timer(func).repeat(repeat=args.number, number=1))
+        rate = args.rows / best
+        baseline = baseline or rate
+        print('%-20s %12.0f %9.1fx' % (name, rate, rate / baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+"""
+Benchmark suite for the API stack, run against the example project.
+
+Measures the components in isolation (user lookups, API key auth,
+pagination at shallow and deep offsets, ``api()`` serialization and
+``JSONResponse`` encoding) and full requests through the middleware stack.
+
+Usage:
+
+    python benchmarks/run.py [--users 10000] [--output results.json] [--compare baseline.json]
+    python benchmarks/run.py --load [--concurrency 8] [--requests 2000] [--path /api/users/]
+
+Fixtures are generated into a SQLite file (``--db``, by default in the
+temporary directory) and reused by later runs with the same ``--users``.
+``--compare`` prints the change against earlier results and exits with 1
+when a benchmark got slower than ``--threshold``. ``--load`` drives the
+WSGI application from ``--concurrency`` threads and reports latency
+percentiles and requests per second.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+from utils import ROOT, setup_example
+
+FIXTURE_BATCH_SIZE = 10000
+
+PASSWORD = 'secret'
+
+DEFAULT_PATHS = ('/api/users/?limit=20', '/api/users/self/', '/api/echo/')
+
+
+def api_key(index):
+    return '%08x.%032d' % (index, index)
+
+
+def create_fixtures(count, database):
+    """
+    Creates ``count`` users with profiles and API keys, unless the database
+    already has them. All users share one password hash, hashing a million
+    passwords would take hours.
+    """
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from django.db import transaction
+
+    from api_boilerplate.models import ApiKey, hash_secret, split_key
+    from example.accounts.models import UserProfile
+
+    existing = User.objects.count()
+    if existing == count:
+        return
+    if existing:
+        sys.exit('%s has %d users, use another --db for %d users.' % (database, existing, count))
+
+    password = make_password(PASSWORD)
+    started = time.time()
+    for start in range(0, count, FIXTURE_BATCH_SIZE):
+        stop = min(start + FIXTURE_BATCH_SIZE, count)
+        with transaction.commit_on_success():
+            User.objects.bulk_create([
+                User(pk=i + 1, username='user%d' % i, email='user%d@example.com' % i, password=password, is_staff=i % 10 == 0)
+                for i in range(start, stop)
+            ])
+            UserProfile.objects.bulk_create([UserProfile(user_id=i + 1) for i in range(start, stop)])
+            ApiKey.objects.bulk_create([
+                ApiKey(user_id=i + 1, prefix=split_key(api_key(i))[0], key_hash=hash_secret(split_key(api_key(i))[1]))
+                for i in range(start, stop)
+            ])
+        sys.stderr.write('\rCreating fixtures: %d/%d' % (stop, count))
+    sys.stderr.write(' (%.0fs)\n' % (time.time() - started))
+
+
+def measure(func, repeat, min_time=0.2):
+    """
+    Returns the best time per call in seconds. The number of calls per
+    round grows until a round takes ``min_time``.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1000000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    return min([elapsed] + timer.repeat(repeat=repeat - 1, number=number)) / number
+
+
+def get_benchmarks(users):
+    """
+    Returns ``(name, func, items)`` tuples, ``items`` being how many objects
+    one call handles.
+    """
+    from django.conf import settings
+    from django.contrib.auth.models import AnonymousUser
+    from django.test.client import Client, RequestFactory
+
+    from api_boilerplate import authentication, middleware
+    from api_boilerplate.http import JSONResponse
+    from api_boilerplate.pagination import Paginator
+    from example.accounts.models import UserProfile
+
+    factory = RequestFactory()
+    client = Client()
+    username_header = 'HTTP_X_%s_USERNAME' % settings.SITE_NAME.upper()
+    api_key_header = 'HTTP_X_%s_API_TOKEN' % settings.SITE_NAME.upper()
+    # Spread lookups over the table instead of hitting one row
+    indexes = [(i * 7919) % users for i in range(1000)]
+    state = {'position': 0}
+
+    def next_index():
+        state['position'] = (state['position'] + 1) % len(indexes)
+        return indexes[state['position']]
+
+    def get_user():
+        assert authentication._get_user('user%d' % next_index()) is not None
+
+    def get_api_key():
+        index = next_index()
+        assert authentication._get_api_key('user%d' % index, api_key(index)) is not None
+
+    auth_cache = authentication.AUTH_CACHE
+
+    def api_key_auth(auth, cached):
+        def run():
+            authentication.AUTH_CACHE = cached
+            try:
+                index = next_index() if not cached else 0
+                request = factory.get('/api/account/', **{username_header: 'user%d' % index, api_key_header: api_key(index)})
+                request.user = AnonymousUser()
+                assert auth.process_view(request, None, (), {}) is None
+            finally:
+                authentication.AUTH_CACHE = auth_cache
+        return run
+
+    profiles = UserProfile.objects.all().order_by('pk')
+
+    def paginate(offset, limit=20):
+        def run():
+            page = Paginator({'limit': limit, 'offset': offset}, profiles, resource_uri='/api/users/').page()
+            assert len(list(page['objects'])) == min(limit, users - offset)
+        return run
+
+    serialize_profiles = list(profiles.select_related('user')[:100])
+
+    def serialize():
+        [profile.api() for profile in serialize_profiles]
+
+    payload = [profile.api() for profile in serialize_profiles]
+
+    def json_response(**params):
+        request = factory.get('/api/users/', params)
+        def run():
+            JSONResponse(request, payload)
+        return run
+
+    deep_offset = max(users - 20, 0)
+    authorization = {username_header: 'user0', api_key_header: api_key(0)}
+
+    def get(path, **headers):
+        def run():
+            response = client.get(path, **headers)
+            assert response.status_code == 200, response.status_code
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return run
+
+    return [
+        ('auth.get_user', get_user, 1),
+        ('auth.get_api_key', get_api_key, 1),
+        ('auth.api_key_middleware', api_key_auth(middleware.ApiKeyAuthMiddleware(), False), 1),
+        ('auth.api_key_middleware_cached', api_key_auth(middleware.ApiKeyAuthMiddleware(), True), 1),
+        ('auth.pipeline_cached', api_key_auth(middleware.ApiAuthenticationMiddleware(), True), 1),
+        ('paginate.shallow', paginate(0), 20),
+        ('paginate.deep', paginate(deep_offset), 20),
+        ('serialize.api', serialize, len(serialize_profiles)),
+        ('response.json', json_response(), len(payload)),
+        ('response.jsonp', json_response(callback='callback'), len(payload)),
+        ('response.prettify', json_response(prettify=1), len(payload)),
+        ('stack.echo', get('/api/echo/'), 1),
+        ('stack.user', get('/api/users/self/', **authorization), 1),
+        ('stack.users', get('/api/users/?limit=20'), 20),
+        ('stack.users_deep', get('/api/users/?limit=20&offset=%d' % deep_offset), 20),
+    ]
+
+
+def run_benchmarks(args):
+    results = {}
+    print('%-34s %12s %12s %14s' % ('benchmark', 'usec/call', 'calls/s', 'objects/s'))
+    for name, func, items in get_benchmarks(args.users):
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        seconds = measure(func, args.repeat)
+        results[name] = {
+            'usec': seconds * 1e6,
+            'per_second': 1 / seconds,
+            'objects_per_second': items / seconds,
+        }
+        print('%-34s %12.1f %12.1f %14.0f' % (name, seconds * 1e6, 1 / seconds, items / seconds))
+    return results
+
+
+def percentile(values, percent):
+    """
+    Returns the ``percent`` percentile of sorted ``values`` (nearest rank).
+    """
+    if not values:
+        return 0
+    index = max(int(round(percent / 100.0 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def run_load(args):
+    """
+    Sends ``--requests`` requests to the WSGI application from
+    ``--concurrency`` threads, cycling through ``--path``.
+    """
+    from django.conf import settings
+    from django.core.handlers.wsgi import WSGIHandler
+    from wsgiref.util import setup_testing_defaults
+
+    application = WSGIHandler()
+    paths = args.path or DEFAULT_PATHS
+    headers = {
+        'HTTP_X_%s_USERNAME' % settings.SITE_NAME.upper(): 'user0',
+        'HTTP_X_%s_API_TOKEN' % settings.SITE_NAME.upper(): api_key(0),
+    }
+    lock = threading.Lock()
+    counter = {'sent': 0}
+    latencies = dict((path, []) for path in paths)
+    errors = []
+
+    def start_response(status, response_headers, exc_info=None):
+        environ_status.status = int(status.split()[0])
+
+    environ_status = threading.local()
+
+    def worker():
+        while True:
+            with lock:
+                if counter['sent'] >= args.requests:
+                    return
+                path = paths[counter['sent'] % len(paths)]
+                counter['sent'] += 1
+
+            environ = dict(headers, PATH_INFO=path.split('?')[0], QUERY_STRING=path.partition('?')[2])
+            setup_testing_defaults(environ)
+            start = time.time()
+            try:
+                result = application(environ, start_response)
+                for chunk in result:
+                    pass
+                if hasattr(result, 'close'):
+                    result.close()
+                if environ_status.status >= 400:
+                    errors.append((path, environ_status.status))
+            except Exception as e:
+                errors.append((path, repr(e)))
+            latencies[path].append(time.time() - start)
+
+    threads = [threading.Thread(target=worker) for i in range(args.concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    results = {}
+    print('%-40s %8s %10s %10s %10s' % ('path', 'requests', 'p50 ms', 'p99 ms', 'max ms'))
+    for path in paths + ('all',):
+        values = sorted(sum(latencies.values(), []) if path == 'all' else latencies[path])
+        results[path] = {
+            'requests': len(values),
+            'p50_ms': percentile(values, 50) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'max_ms': (values[-1] if values else 0) * 1000,
+        }
+        print('%-40s %8d %10.2f %10.2f %10.2f' % (path, len(values), results[path]['p50_ms'], results[path]['p99_ms'], results[path]['max_ms']))
+    results['all']['rps'] = args.requests / elapsed
+    results['all']['errors'] = len(errors)
+    print('\n%.1f requests/s with %d threads, %d errors' % (results['all']['rps'], args.concurrency, len(errors)))
+    for error in errors[:10]:
+        print('  %s: %s' % error)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the change per benchmark and returns the names of the ones that
+    got slower than ``threshold`` (a fraction).
+    """
+    regressions = []
+    print('\n%-34s %12s %12s %9s' % ('benchmark', 'baseline us', 'current us', 'change'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['usec'], results[name]['usec']
+        change = (after - before) / before
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  slower'
+        print('%-34s %12.1f %12.1f %+8.1f%%%s' % (name, before, after, change * 100, flag))
+    return regressions
+
+
+def get_metadata(args):
+    import django
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'users': args.users,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--db', help='SQLite file for the fixtures')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', action='append', help='Run benchmarks whose name contains this, e.g. auth.')
+    parser.add_argument('--output', help='Write results as JSON')
+    parser.add_argument('--compare', help='Compare with earlier JSON results')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Slowdown reported as a regression')
+    parser.add_argument('--load', action='store_true', help='Drive the WSGI application concurrently')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--path', action='append', help='Path for --load, repeatable')
+    args = parser.parse_args()
+
+    database = args.db or os.path.join(tempfile.gettempdir(), 'api-boilerplate-bench-%d.sqlite3' % args.users)
+    setup_example(
+        DEBUG=False,
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': database}},
+        # Every request does the work instead of hitting the response cache
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+    )
+    create_fixtures(args.users, database)
+
+    if args.path:
+        args.path = tuple(args.path)
+    output = {'meta': get_metadata(args)}
+    if args.load:
+        output['load'] = run_load(args)
+    else:
+        output['results'] = run_benchmarks(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    if args.compare and not args.load:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('\nBaseline: %s' % (baseline['meta'].get('commit') or baseline['meta'].get('date')))
+        if compare(output['results'], baseline['results'], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
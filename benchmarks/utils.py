@@ -0,0 +1,42 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+import os
+import sys
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+EXAMPLE = os.path.join(ROOT, 'example')
+
+
+def setup_example(**overrides):
+    """
+    Configures Django with the example project's settings on an in-memory
+    SQLite database and creates the tables.
+    """
+    sys.path[:0] = [ROOT, EXAMPLE]
+
+    from example import settings as example_settings
+    options = dict((name, getattr(example_settings, name)) for name in dir(example_settings) if name.isupper())
+    options['DATABASES'] = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        }
+    }
+    options['ALLOWED_HOSTS'] = ['*']
+    options.update(overrides)
+
+    from django.conf import settings
+    settings.configure(**options)
+
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+
+
+def per_second(func, number):
+    """
+    Returns how many times per second ``func`` runs, best of three.
+    """
+    best = min(timeit.Timer(func).repeat(repeat=3, number=number))
+    return number / best
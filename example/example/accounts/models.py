@@ -1,9 +1,11 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.contrib.auth.models import User
 
 from calendar import timegm as epoch
 
-from api_boilerplate.models import ApiKey
+from api_boilerplate.decorators import invalidate_api_cache
+from api_boilerplate.serialization import prefetch
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, related_name='profile')
@@ -12,10 +14,16 @@ class UserProfile(models.Model):
     def __unicode__(self):
         return u'%s' % (self.user.username)
     
-    def get_api_key(self):
-        api_key, created = ApiKey.objects.get_or_create(user=self.user)
-        return api_key.key
+    def get_api_keys(self):
+        # Secrets are only shown once, when a key is created
+        return [{
+            'prefix': api_key.prefix,
+            'name': api_key.name,
+            'scopes': api_key.scopes.split(),
+            'expires_at': epoch(api_key.expires.timetuple()) if api_key.expires else None,
+        } for api_key in self.user.api_keys.all()]
     
+    @prefetch(select_related=('user',))
     def api(self, include_account=False):
         user = self.user
         data = {
@@ -25,10 +33,29 @@ class UserProfile(models.Model):
             'resource_uri': '/api/users/%s/' % user.pk,
         }
         
-        # Return API key when account info is requested
+        # Return API keys when account info is requested
         if include_account:
-            data['api_key'] = self.get_api_key()
+            data['api_keys'] = self.get_api_keys()
         
         return data
 
-User.profile = property(lambda u: UserProfile.objects.get_or_create(user=u)[0])
\ No newline at end of file
+def get_profile(user):
+    '''
+    Returns the user's profile, creating it when missing. Cached on the user
+    like ``User.get_profile()`` does.
+    '''
+    if not hasattr(user, '_profile_cache'):
+        profile = UserProfile.objects.get_or_create(user=user)[0]
+        profile.user = user
+        user._profile_cache = profile
+    return user._profile_cache
+
+User.profile = property(get_profile)
+
+
+def invalidate_users_cache(sender, **kwargs):
+    invalidate_api_cache('users')
+
+for model in (User, UserProfile):
+    post_save.connect(invalidate_users_cache, sender=model)
+    post_delete.connect(invalidate_users_cache, sender=model)
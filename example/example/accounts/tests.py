@@ -0,0 +1,53 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from api_boilerplate import tokens
+from api_boilerplate.authentication import ApiKeyAuthenticator
+from api_boilerplate.cache import api_key_cache
+from api_boilerplate.models import ApiKey
+
+
+class ApiKeysViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        api_key_cache.invalidate(self.user.pk)
+
+    def headers(self, scopes=''):
+        authenticator = ApiKeyAuthenticator()
+        api_key = ApiKey.objects.create(user=self.user, scopes=scopes)
+        return {authenticator.username_header: 'alice', authenticator.api_key_header: api_key.raw_key}
+
+    def create(self, data, **headers):
+        return self.client.post('/api/account/keys/', json.dumps(data), content_type='application/json', **headers)
+
+    def test_unrestricted_key(self):
+        response = self.create({'name': 'ci', 'scopes': ['read', 'write']}, **self.headers())
+        self.assertEqual(response.status_code, 201)
+        raw_key = json.loads(response.content.decode('utf-8'))['key']
+        self.assertEqual(ApiKey.objects.get(prefix=raw_key.split('.')[0]).scopes, 'read write')
+        self.assertEqual(self.create({}, **self.headers()).status_code, 201)
+
+    def test_restricted_key(self):
+        headers = self.headers('read')
+        self.assertEqual(self.create({'scopes': ['read']}, **headers).status_code, 201)
+        self.assertEqual(self.create({'scopes': ['read', 'write']}, **headers).status_code, 400)
+        # No scopes would be an unrestricted key
+        self.assertEqual(self.create({}, **headers).status_code, 400)
+
+    def test_password(self):
+        self.assertTrue(self.client.login(username='alice', password='secret'))
+        self.assertEqual(self.create({'scopes': ['admin']}).status_code, 201)
+
+    def test_token(self):
+        token, payload = tokens.issue_token(self.user, None)
+        response = self.create({}, HTTP_AUTHORIZATION='Bearer %s' % token)
+        self.assertEqual(response.status_code, 401)
+
+    def test_invalid(self):
+        headers = self.headers()
+        self.assertEqual(self.create({'name': 1}, **headers).status_code, 400)
+        self.assertEqual(self.create({'scopes': ['read write']}, **headers).status_code, 400)
+        self.assertEqual(self.create({'expires_in': -1}, **headers).status_code, 400)
+        self.assertEqual(self.create({'expires_in': True}, **headers).status_code, 400)
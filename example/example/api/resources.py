@@ -0,0 +1,21 @@
+from api_boilerplate.resources import Resource, Field, Method, epoch
+
+
+class UserProfileResource(Resource):
+    '''
+    Public representation of a user, same as ``UserProfile.api()``
+    '''
+    username = Field('user.username')
+    is_admin = Field('user.is_staff')
+    joined_at = Field('user.date_joined', transform=epoch)
+    resource_uri = Field('user_id', transform=lambda pk: '/api/users/%s/' % pk)
+
+
+class AccountResource(UserProfileResource):
+    '''
+    Authenticated user's own account, includes the API keys
+    '''
+    api_keys = Method()
+    
+    def get_api_keys(self, profile):
+        return profile.get_api_keys()
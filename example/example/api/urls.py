@@ -1,5 +1,8 @@
 from django.conf.urls import patterns, url
 
+from api_boilerplate.batch import ApiBatchView
+from api_boilerplate.tokens import ApiTokenView
+
 from example.api.views import *
 
 urlpatterns = patterns('api.views',
@@ -8,8 +11,16 @@ urlpatterns = patterns('api.views',
     
     # User account - Returns API key
     url(r'^account/?$', AccountView.as_view(), name='api_account'),
+    url(r'^account/keys/?$', ApiKeysView.as_view(), name='api_account_keys'),
+    
+    # Exchanges the API key for a short-lived bearer token
+    url(r'^token/?$', ApiTokenView.as_view(), name='api_token'),
+    
+    # Runs several API calls in one request
+    url(r'^batch/?$', ApiBatchView.as_view(), name='api_batch'),
     
     # Sample API
     url(r'^users/?$', UsersView.as_view(), name='api_users'),
+    url(r'^users/bulk/?$', UsersBulkView.as_view(), name='api_users_bulk'),
     url(r'^users/(?P<user_id>[A-Za-z0-9_]+)/?$', UserView.as_view(), name='api_user'),
 )
\ No newline at end of file
@@ -1,12 +1,19 @@
+from datetime import timedelta
+
+from django.utils import six
 from django.utils.decorators import method_decorator
+from django.utils.timezone import now
 from django.contrib.auth.models import User
 
-from api_boilerplate.http import ApiView, JSONResponse, JSONResponseNotFound
+from api_boilerplate.bulk import ApiBulkView
+from api_boilerplate.http import ApiView, JSONResponse, JSONResponseCreated, StreamingJSONResponse, JSONResponseNotFound, JSONResponseBadRequest, JSONResponseUnauthorized
 from api_boilerplate.pagination import Paginator
-from api_boilerplate.decorators import api_login_required
+from api_boilerplate.decorators import api_login_required, staff_required, api_cache
 from api_boilerplate.exceptions import ApiBadRequestException
+from api_boilerplate.models import ApiKey
 
 from example.accounts.models import UserProfile
+from example.api.resources import UserProfileResource, AccountResource
 
 
 def _get_user(request, user_id):
@@ -72,7 +79,37 @@ class AccountView(ApiView):
     Attributes:
         None
     Parameters:
+        fields - Comma separated fields to return
+    
+    Visibility
+        Private - requires auth
+    '''
+    
+    @method_decorator(api_login_required)
+    def get(self, request, *args, **kwargs):
+        try:
+            resource = AccountResource().for_request(request.GET)
+        except ApiBadRequestException as e:
+            return JSONResponseBadRequest(request, e.message)
+        return JSONResponse(request, request.user.profile, resource=resource)
+
+
+class ApiKeysView(ApiView):
+    '''
+    API keys view
+    
+    Endpoint:
+        /api/account/keys/
+    
+    Attributes:
         None
+    Parameters:
+        None
+    
+    Body:
+        name - Optional name of the key
+        scopes - Optional list of scopes, all when missing
+        expires_in - Optional lifetime in seconds
     
     Visibility
         Private - requires auth
@@ -80,7 +117,40 @@ class AccountView(ApiView):
     
     @method_decorator(api_login_required)
     def get(self, request, *args, **kwargs):
-        return JSONResponse(request, request.user.profile.api(include_account=True))
+        return JSONResponse(request, request.user.profile.get_api_keys())
+    
+    @method_decorator(api_login_required)
+    def post(self, request, *args, **kwargs):
+        # Tokens expire, keys made with a leaked token wouldn't
+        if getattr(request, 'auth_token', None) is not None:
+            return JSONResponseUnauthorized(request, 'Authenticate with your API key or password to create keys')
+        
+        data = request.data if isinstance(request.data, dict) else {}
+        name = data.get('name', '')
+        scopes = data.get('scopes') or []
+        expires_in = data.get('expires_in')
+        if not isinstance(name, six.string_types):
+            return JSONResponseBadRequest(request, 'name should be a string.')
+        if not isinstance(scopes, list) or not all(isinstance(scope, six.string_types) and scope.split() == [scope] for scope in scopes):
+            return JSONResponseBadRequest(request, 'scopes should be a list of words.')
+        if expires_in is not None and (isinstance(expires_in, bool) or not isinstance(expires_in, six.integer_types) or expires_in <= 0):
+            return JSONResponseBadRequest(request, 'expires_in should be a positive number of seconds.')
+        
+        # Scoped credentials can't create keys with more access
+        granted = getattr(request, 'auth_scopes', None)
+        if granted is not None and (not scopes or not set(scopes) <= granted):
+            return JSONResponseBadRequest(request, 'Keys can only have scopes of the key used: %s.' % ' '.join(sorted(granted)))
+        
+        api_key = ApiKey.objects.create(
+            user=request.user,
+            name=name[:100],
+            scopes=' '.join(sorted(set(scopes))),
+            expires=now() + timedelta(seconds=expires_in) if expires_in else None,
+        )
+        return JSONResponseCreated(request, {
+            'prefix': api_key.prefix,
+            'key': api_key.raw_key,
+        }, '/api/account/keys/')
 
 
 class UsersView(ApiView):
@@ -93,7 +163,7 @@ class UsersView(ApiView):
     Attributes:
         None
     Parameters:
-        None
+        fields - Comma separated fields to return
     
     Visibility
         Public
@@ -102,7 +172,9 @@ class UsersView(ApiView):
     def get(self, request, *args, **kwargs):
         profiles = UserProfile.objects.all()
         
-        paginator = Paginator(request.GET, profiles, resource_uri='/api/users/')
+        # Streamed, so not cached with api_cache which would buffer it
+        paginator = Paginator(request.GET, profiles, resource_uri='/api/users/',
+            resource=UserProfileResource(), lazy=True)
         try:
             paginator_page = paginator.page()
             paginator_objects = paginator_page['objects']
@@ -110,15 +182,7 @@ class UsersView(ApiView):
         except ApiBadRequestException as e:
             return JSONResponseBadRequest(request, e.message)
         
-        objects = []
-        for profile in paginator_objects:
-            objects.append(profile.api())
-        
-        data = {
-            'meta': paginator_meta,
-            'objects': objects,
-        }
-        return JSONResponse(request, data)
+        return StreamingJSONResponse(request, paginator_meta, paginator_objects)
 
 
 class UserView(ApiView):
@@ -131,17 +195,59 @@ class UserView(ApiView):
     Attributes:
         None
     Parameters:
-        None
+        fields - Comma separated fields to return
     
     Visibility
         Public
     '''
     
+    @method_decorator(api_cache(tags=['users']))
     def get(self, request, user_id, *args, **kwargs):
+        try:
+            resource = UserProfileResource().for_request(request.GET)
+        except ApiBadRequestException as e:
+            return JSONResponseBadRequest(request, e.message)
+        
         ## Determine user
         user = _get_user(request,user_id)
         
         if user:
-            return JSONResponse(request, user.get_profile().api())
+            return JSONResponse(request, user.profile, resource=resource)
         return JSONResponseNotFound(request, 'User not found.')
-        
\ No newline at end of file
+        
+
+class UsersBulkView(ApiBulkView, ApiView):
+    '''
+    Users bulk view
+    
+    Endpoint:
+        /api/users/bulk/
+    
+    Attributes:
+        None
+    Parameters:
+        None
+    
+    Body:
+        JSON array or NDJSON of users. PATCH items need the user's id.
+    
+    Visibility
+        Private - requires staff
+    '''
+    model = User
+    fields = ('username', 'email', 'first_name', 'last_name')
+    cache_tags = ('users',)
+    
+    def build_object(self, item, obj=None):
+        user = super(UsersBulkView, self).build_object(item, obj)
+        if obj is None:
+            user.set_unusable_password()
+        return user
+    
+    @method_decorator(staff_required)
+    def post(self, request, *args, **kwargs):
+        return self.bulk_create(request)
+    
+    @method_decorator(staff_required)
+    def patch(self, request, *args, **kwargs):
+        return self.bulk_update(request)
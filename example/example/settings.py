@@ -109,14 +109,14 @@ MIDDLEWARE_CLASSES = (
     # Uncomment the next line for simple clickjacking protection:
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
     
-    'api_boilerplate.middleware.ApiDjangoAuthMiddleware',
-    'api_boilerplate.middleware.ApiHttpBasicAuthMiddleware',
-    'api_boilerplate.middleware.ApiKeyAuthMiddleware',
+    'api_boilerplate.middleware.ApiAuthenticationMiddleware',
     'api_boilerplate.middleware.ApiRequestDataMiddleware',
 )
 
 ROOT_URLCONF = 'example.urls'
 
+API_URL_PREFIXES = ('/api/',)
+
 # Python dotted path to the WSGI application used by Django's runserver.
 WSGI_APPLICATION = 'example.wsgi.application'
 
@@ -140,6 +140,7 @@ INSTALLED_APPS = (
     
     'api_boilerplate',
     'example.api',
+    'example.accounts',
 )
 
 # A sample logging configuration. The only tangible logging
@@ -172,4 +173,4 @@ LOGGING = {
 }
 
 
-AUTH_PROFILE_MODULE = 'api.UserProfile'
\ No newline at end of file
+AUTH_PROFILE_MODULE = 'accounts.UserProfile'
\ No newline at end of file